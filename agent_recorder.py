@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Opt-in recording of the micro data of a model run, i.e. the seed and the income of every farmer in every time step.
+Is used from model.py.
+
+The data are written to disk step by step while the model runs, so that they never have to be kept in memory:
+
+    full      The seeds (int8) and incomes (float32) go into two .npy files with the shape
+              (time steps + 1, replicates, farmers), [filename]_seeds.npy and [filename]_incomes.npy. Every time
+              step is written as one contiguous chunk at its place in the file, so nothing but the current step is
+              held in memory. 10^6 farmers and 10^3 time steps take 1 GB and 4 GB on disk, which are read back as
+              memory maps, see read_full().
+
+    switches  Only the changes of the seeds are logged as events (timestep, replicate, farmer, seed) in a compressed
+              and appendable table in [filename]_switches.h5. The events of time step 0 are the initial seeds of all
+              farmers, so the full seed panel can be reconstructed with seed_panel(). The size is proportional to the
+              number of switches. The incomes are not logged.
+
+Usage: python agent_recorder.py output/m1_k10_B_agents_1 prints the number of switches per time step in either mode.
+"""
+import os
+import sys
+
+import numpy as np
+
+__author__ = "Claudius Graebner"
+__email__ = "graebnerc@uni-bremen.de"
+
+MODES = ('full', 'switches')
+SWITCHES_KEY = 'switches'
+BATCH_EVENTS = 2 ** 20
+
+
+class AgentRecorder:
+    """
+    Writes the seeds and incomes of all farmers of all replicates of a run to disk in one of the MODES.
+    Call close() at the end, so that everything is written.
+    """
+    def __init__(self, filename, mode, nb_replicates, nb_agents, nb_timesteps):
+        """
+        Parameters
+        ----------
+        filename : str
+            The path of the files excluding the endings.
+
+        mode : str
+            'full' or 'switches', see the module documentation.
+
+        nb_replicates, nb_agents, nb_timesteps : int
+            The size of the run. One time step more is recorded for the initial state.
+        """
+        assert mode in MODES, "Mode of the agent recording should be one of {} but is {}.".format(MODES, mode)
+        self.__filename = filename
+        self.__mode = mode
+        self.__shape = (nb_timesteps + 1, nb_replicates, nb_agents)
+        self.__files = []
+        self.__last_step = None
+        self.__store = None
+        self.__last_seeds = None
+        self.__batch = []
+        self.__batch_size = 0
+
+    def start(self, resume_at=None, seeds=None):
+        """
+        Opens the files. A new recording replaces the files of an earlier one.
+
+        Parameters
+        ----------
+        resume_at : int or None
+            If given, the run continues from a checkpoint after resume_at recorded time steps. The recording made so
+            far is kept and all records from this time step on are replaced.
+
+        seeds : array of int or None
+            The seeds of the last recorded time step, needed to resume the switches.
+        """
+        resume = resume_at is not None
+        if self.__mode == 'full':
+            paths = [self.__filename + '_seeds.npy', self.__filename + '_incomes.npy']
+            resume = resume and all(os.path.isfile(path) for path in paths)
+            for path, dtype in zip(paths, (np.int8, np.float32)):
+                """The header is written and the file is allocated via a memory map, which is released right away."""
+                if resume:
+                    offset = np.load(path, mmap_mode='r').offset
+                else:
+                    offset = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=self.__shape).offset
+                step_size = np.dtype(dtype).itemsize * self.__shape[1] * self.__shape[2]
+                self.__files.append((open(path, 'r+b'), dtype, offset, step_size))
+            return
+        import pandas as pd
+        path = self.__filename + '_switches.h5'
+        if not resume and os.path.isfile(path):
+            os.remove(path)
+        self.__store = pd.HDFStore(path, mode='a', complevel=5, complib='blosc')
+        if resume:
+            if '/' + SWITCHES_KEY in self.__store.keys():
+                self.__store.remove(SWITCHES_KEY, where='timestep >= {}'.format(int(resume_at)))
+            self.__last_seeds = np.array(seeds, dtype=np.int8)
+
+    def record(self, timestep, seeds, incomes):
+        """
+        Records the seeds and incomes of all farmers in a time step, both with the shape (replicates, farmers).
+        """
+        if self.__mode == 'full':
+            self.__last_step = (seeds, incomes)
+            self.write_step(timestep)
+            return
+        if self.__last_seeds is None:
+            replicates, farmers = np.indices(seeds.shape).reshape(2, -1)
+        else:
+            replicates, farmers = np.nonzero(seeds != self.__last_seeds)
+        self.__last_seeds = np.array(seeds, dtype=np.int8)
+        if len(farmers) == 0:
+            return
+        self.__batch.append((np.full(len(farmers), timestep, dtype=np.int32), replicates.astype(np.int32),
+                             farmers.astype(np.int32), self.__last_seeds[replicates, farmers]))
+        self.__batch_size += len(farmers)
+        if self.__batch_size >= BATCH_EVENTS:
+            self.flush()
+
+    def write_step(self, timestep):
+        """Writes the last recorded seeds and incomes at the place of the given time step into the files."""
+        for (f, dtype, offset, step_size), values in zip(self.__files, self.__last_step):
+            f.seek(offset + timestep * step_size)
+            f.write(np.ascontiguousarray(values, dtype=dtype).tobytes())
+
+    def fill(self, start):
+        """Repeats the last recorded time step in all time steps from start on, see Model.fast_forward()."""
+        if self.__mode == 'full':
+            for timestep in range(start, self.__shape[0]):
+                self.write_step(timestep)
+
+    def flush(self):
+        """Writes everything recorded so far to disk."""
+        if self.__mode == 'full':
+            for f, _, _, _ in self.__files:
+                f.flush()
+                os.fsync(f.fileno())
+            return
+        if self.__batch:
+            import pandas as pd
+            columns = [np.concatenate(column) for column in zip(*self.__batch)]
+            events = pd.DataFrame(dict(zip(('timestep', 'replicate', 'farmer', 'seed'), columns)))
+            self.__store.append(SWITCHES_KEY, events, data_columns=['timestep', 'replicate'], index=False)
+            self.__batch = []
+            self.__batch_size = 0
+        self.__store.flush(fsync=True)
+
+    def close(self):
+        self.flush()
+        for f, _, _, _ in self.__files:
+            f.close()
+        if self.__store is not None:
+            self.__store.close()
+        self.__files = []
+        self.__store = None
+
+
+def read_full(filename):
+    """
+    Returns the seeds and incomes recorded in the mode 'full' as read-only memory maps with the shape
+    (time steps + 1, replicates, farmers).
+    """
+    return np.load(filename + '_seeds.npy', mmap_mode='r'), np.load(filename + '_incomes.npy', mmap_mode='r')
+
+
+def read_switches(filename, where=None):
+    """
+    Returns the events recorded in the mode 'switches' as pd.DataFrame with the columns timestep, replicate, farmer
+    and seed, optionally only those selected by where, e.g. 'replicate == 0'.
+    """
+    import pandas as pd
+    with pd.HDFStore(filename + '_switches.h5', mode='r') as store:
+        return store.select(SWITCHES_KEY, where=where)
+
+
+def seed_panel(switches, nb_timesteps, replicate=0):
+    """
+    Reconstructs the seeds of all farmers of one replicate in every time step from the switches.
+
+    Parameters
+    ----------
+    switches : pd.DataFrame
+        The events as returned by read_switches().
+
+    nb_timesteps : int
+        The number of time steps of the run, not counting the initial state.
+
+    replicate : int
+        The position of the replicate within the run.
+
+    Returns
+    -------
+    array of int8 with shape (time steps + 1, farmers)
+    """
+    events = switches[switches['replicate'] == replicate].sort_values('timestep', kind='stable')
+    initial = events[events['timestep'] == 0]
+    panel = np.empty((nb_timesteps + 1, len(initial)), dtype=np.int8)
+    panel[0, initial['farmer'].values] = initial['seed'].values
+    timesteps = events['timestep'].values
+    bounds = np.searchsorted(timesteps, np.arange(nb_timesteps + 2))
+    for t in range(1, nb_timesteps + 1):
+        panel[t] = panel[t - 1]
+        changes = events.iloc[bounds[t]:bounds[t + 1]]
+        panel[t, changes['farmer'].values] = changes['seed'].values
+    return panel
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('Arguments missing! Usage: python agent_recorder.py [path to agent files excluding ending]')
+        exit(1)
+    if os.path.isfile(sys.argv[1] + '_switches.h5'):
+        print(read_switches(sys.argv[1]).query('timestep > 0').groupby('timestep').size().to_string())
+    else:
+        switches = np.count_nonzero(np.diff(read_full(sys.argv[1])[0], axis=0), axis=(1, 2))
+        print('\n'.join('{} {}'.format(t, n) for t, n in enumerate(switches, start=1) if n > 0))
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+The aggregate-level simulation of the baseline model and of case A of the extensions. It is selected by the
+parameter "simulation" of a specification, "aggregate" instead of the default "agents". Is used from model.py.
+
+In these specifications the network plays no role: in the baseline model every farmer draws its seed independently,
+and in case A all farmers compare the P payoff with the same average NP payoff. So all farmers with the same seed and
+the same payoffs in their memory are interchangeable, and it suffices to track how many farmers there are of every such
+group. The groups split by a binomial draw where farmers decide at random, all groups take the same seed where the
+decision is unanimous, and the income of all NP users of a group is drawn as one sum. The recorded series then follow
+the same distribution as those of the agent-level simulation, while a time step costs in proportion to the number of
+groups, which is small, and not to the number of farmers.
+
+With random NP returns, the payoffs of the farmers of a group differ, and a group only keeps their average: the groups
+with the same seed are merged into one after every time step. The average NP payoff on which the farmers decide and
+the recorded series only depend on the sums of the payoffs, so they are not affected. Splits of such a group by ties
+assume that the payoffs are spread evenly, but ties have probability zero with random returns after the first time
+step. Above random_variates.EXACT_SUM_LIMIT NP users, the sums of the returns follow their normal approximation.
+"""
+import json
+
+import numpy as np
+
+import memory
+
+__author__ = "Claudius Graebner"
+__email__ = "graebnerc@uni-bremen.de"
+
+SIMULATIONS = ('agents', 'aggregate')
+
+
+def is_supported(parameters):
+    """Returns True if the aggregate simulation applies to the specification, i.e. for model_0 and for case A."""
+    return parameters["model"] == "model_0" or (parameters["model"] in ("model_1", "model_2") and
+                                                parameters["model_1_case"] == "A")
+
+
+class AggregatePopulation:
+    """
+    The groups of interchangeable farmers of one replicate.
+
+    Every group has a number of farmers, a seed (0 for P and 1 for NP), the income of its farmers in the last time step
+    and their retrospective memory, and the summed income of its farmers in the last time step. The memories of all
+    groups are kept in one memory.RetrospectiveMemory with one entry per group, so that the window means are computed
+    exactly as for the single farmers of the agent-level simulation.
+    """
+    def __init__(self, parameters, random_variates):
+        """
+        Parameters
+        ----------
+        parameters : dict
+            The parametrization of the model run.
+
+        random_variates : random_variates.RandomVariates
+            The source of all random draws of the replicate.
+        """
+        self.__parameters = parameters
+        self.__random = random_variates
+        self.__nb_agents = parameters["number_of_farmers"]
+        self.__net_return_P = float(parameters["fix_return_P"]) - parameters["yearly_cost_P"]
+        self.__deterministic = parameters["var_return_NP"] == 0 or parameters["model"] == "model_2"
+        nb_P = int(parameters['initial_share_P'] * self.__nb_agents)
+        counts = np.array([nb_P, self.__nb_agents - nb_P], dtype=np.int64)
+        present = counts > 0
+        self.__counts = counts[present]
+        self.__seeds = np.array([0, 1], dtype=np.int8)[present]
+        self.__incomes = np.zeros(len(self.__counts))
+        self.__totals = np.zeros(len(self.__counts))
+        self.__memory = memory.RetrospectiveMemory(parameters["retrospective_memory"], (len(self.__counts),))
+        self.__stable_steps = 0
+
+    def nb_NP(self):
+        """Returns the number of NP users."""
+        return int(self.__counts[self.__seeds == 1].sum())
+
+    def mean_NP(self):
+        """
+        Returns the average window mean of the NP users (NaN if there is no NP user). If all NP users have the same
+        window mean, it is returned as is.
+        """
+        users_NP = self.__seeds == 1
+        n_NP = self.__counts[users_NP].sum()
+        if n_NP == 0:
+            return np.nan
+        window_means = self.__memory.means()[users_NP]
+        if np.all(window_means == window_means[0]):
+            return float(window_means[0])
+        return float(np.dot(self.__counts[users_NP], window_means) / n_NP)
+
+    def choose_seeds(self, reference):
+        """
+        All farmers choose their seed. In the baseline model they choose at random, in case A on the basis of the
+        reference, the average NP payoff (NaN if undefined) compared with the P payoff.
+        """
+        if self.__parameters["model"] == "model_0":
+            self.split(lambda n: self.__random.nb_choices_NP(n, self.__parameters["p_P"]))
+        elif np.isnan(reference):
+            return
+        elif self.__net_return_P > reference:
+            self.__seeds[:] = 0
+        elif self.__net_return_P < reference:
+            self.__seeds[:] = 1
+        else:
+            self.split(self.__random.nb_coin_flips_NP)
+
+    def split(self, draw_nb_NP):
+        """
+        Splits every group into the farmers that choose the NP seed, whose number is drawn by draw_nb_NP, and those
+        that choose the P seed. Both parts keep the memory of the group.
+        """
+        nb_NP = np.array([draw_nb_NP(int(n)) for n in self.__counts], dtype=np.int64)
+        counts = np.concatenate((self.__counts - nb_NP, nb_NP))
+        seeds = np.repeat(np.array([0, 1], dtype=np.int8), len(self.__counts))
+        origins = np.tile(np.arange(len(self.__counts)), 2)
+        present = counts > 0
+        self.select(origins[present])
+        self.__counts = counts[present]
+        self.__seeds = seeds[present]
+
+    def select(self, indices):
+        """Keeps the groups at the given indices, repeated ones as copies, without their numbers and seeds."""
+        self.__incomes = self.__incomes[indices]
+        self.__totals = self.__totals[indices]
+        self.__memory.take(indices)
+
+    def receive_incomes(self, n):
+        """
+        Gives the farmers of all groups their income, where n is the number of NP users at the beginning of the time
+        step, and merges the groups that became alike.
+
+        Returns True if every farmer got the same income as in the last time step.
+        """
+        incomes = np.full(len(self.__counts), self.__net_return_P)
+        users_NP = self.__seeds == 1
+        totals = self.__counts * incomes
+        if self.__parameters["model"] == "model_2":
+            incomes[users_NP] = 2 * self.__net_return_P * (n / self.__parameters["number_of_farmers"])
+            totals[users_NP] = self.__counts[users_NP] * incomes[users_NP]
+        else:
+            totals[users_NP] = [self.__random.sum_of_returns_NP(int(k)) for k in self.__counts[users_NP]]
+            incomes[users_NP] = totals[users_NP] / self.__counts[users_NP]
+        unchanged = bool(np.all(incomes == self.__incomes)) and (self.__deterministic or not users_NP.any())
+        self.__incomes = incomes
+        self.__totals = totals
+        self.__memory.add(incomes)
+        self.__stable_steps = self.__stable_steps + 1 if unchanged else 0
+        self.merge()
+        return unchanged
+
+    def merge(self):
+        """
+        Merges the groups whose farmers are alike: with deterministic NP returns those with the same seed, income and
+        memory, otherwise all groups with the same seed, which keep the averages of their incomes and memories. In the
+        baseline model the memory does not enter the decisions, so the groups with the same seed are always merged.
+        """
+        if len(self.__counts) <= 1:
+            return
+        if self.__deterministic and self.__parameters["model"] != "model_0":
+            state = self.__memory.state()
+            rows = [self.__seeds, self.__incomes, state['sums']]
+            if 'buffer' in state:
+                rows.extend(state['buffer'])
+            _, first, groups = np.unique(np.column_stack(rows), axis=0, return_index=True, return_inverse=True)
+            if len(first) == len(self.__counts):
+                return
+            counts = np.bincount(groups.ravel(), weights=self.__counts).astype(np.int64)
+            totals = np.bincount(groups.ravel(), weights=self.__totals)
+            self.select(first)
+            self.__counts, self.__seeds, self.__totals = counts, self.__seeds[first], totals
+            return
+        seeds, first, groups = np.unique(self.__seeds, return_index=True, return_inverse=True)
+        if len(first) == len(self.__counts):
+            return
+        counts = np.bincount(groups, weights=self.__counts)
+        self.__incomes = np.bincount(groups, weights=self.__counts * self.__incomes) / counts
+        self.__totals = np.bincount(groups, weights=self.__totals)
+        self.__memory.pool(groups, self.__counts)
+        self.__counts, self.__seeds = counts.astype(np.int64), seeds
+
+    def converged(self):
+        """
+        Returns whether the state provably cannot change any more, by the same rules as
+        engine.PopulationEngine.converged().
+        """
+        params = self.__parameters
+        if params["model"] == "model_0":
+            return params["p_P"] >= 1 or (params["p_P"] <= 0 and self.__deterministic)
+        n_NP = self.nb_NP()
+        if n_NP == 0:
+            return True
+        size = self.__memory.size
+        if not (self.__deterministic and size > 0 and self.__stable_steps >= size - 1):
+            return False
+        reference = self.mean_NP()
+        if reference == self.__net_return_P:
+            return False
+        seed = int(self.__net_return_P < reference)
+        income = self.__net_return_P
+        if seed == 1:
+            income = 2 * self.__net_return_P * n_NP / params["number_of_farmers"] \
+                if params["model"] == "model_2" else params["mean_return_NP"]
+        return bool(np.all(self.__seeds == seed) and np.all(self.__incomes == income))
+
+    def totals(self):
+        """Returns the number of NP users and the summed incomes of the P and of the NP users."""
+        users_NP = self.__seeds == 1
+        return self.nb_NP(), float(self.__totals[~users_NP].sum()), float(self.__totals[users_NP].sum())
+
+    def state(self):
+        """Returns the state of the groups as dict of arrays, see restore()."""
+        state = {'counts': self.__counts, 'seeds': self.__seeds, 'incomes': self.__incomes, 'totals': self.__totals,
+                 'stable_steps': self.__stable_steps}
+        state.update(('memory_' + key, value) for key, value in self.__memory.state().items())
+        return state
+
+    def restore(self, state):
+        """Sets the groups to a state returned by state()."""
+        self.__counts = np.array(state['counts'], dtype=np.int64)
+        self.__seeds = np.array(state['seeds'], dtype=np.int8)
+        self.__incomes = np.array(state['incomes'], dtype=float)
+        self.__totals = np.array(state['totals'], dtype=float)
+        self.__stable_steps = int(state['stable_steps'])
+        self.__memory.restore({key[len('memory_'):]: value for key, value in state.items()
+                               if key.startswith('memory_')})
+
+    @property
+    def nb_groups(self):
+        return len(self.__counts)
+
+
+class AggregateEngine:
+    """
+    The aggregate-level counterpart of engine.PopulationEngine for the specifications supported by is_supported().
+
+    It holds one AggregatePopulation per replicate and provides the methods of the population engine that are used by
+    the model, apart from the state of the single farmers, which is not kept.
+    """
+    def __init__(self, parameters, random_variates):
+        """
+        Parameters
+        ----------
+        parameters : dict
+            The parametrization of the model run.
+
+        random_variates : list of random_variates.RandomVariates
+            The source of all random draws for every replicate.
+        """
+        assert is_supported(parameters), \
+            "The aggregate simulation only supports model_0 and case A, not {} case {}.".format(
+                parameters["model"], parameters["model_1_case"])
+        self.__parameters = parameters
+        self.__random = list(random_variates)
+        self.__populations = [AggregatePopulation(parameters, rv) for rv in self.__random]
+        self.__net_return_P = float(parameters["fix_return_P"]) - parameters["yearly_cost_P"]
+
+    def update(self, i):
+        """
+        The update procedure implemented at any time step, see engine.PopulationEngine.update().
+        """
+        n_NP, mean_NP = self.decision_basis(i)
+        self.choose_seeds(mean_NP)
+        self.receive_incomes(n_NP)
+
+    def decision_basis(self, i):
+        """
+        Returns the number of NP users and the average NP yield in every replicate, on which the farmers base their
+        decisions in time step i.
+        """
+        n_NP = np.array([population.nb_NP() for population in self.__populations])
+        mean_NP = np.full(len(self.__populations), self.__net_return_P)
+        if self.__parameters["model"] != "model_0" and i > 0:
+            mean_NP = np.array([population.mean_NP() for population in self.__populations])
+        return n_NP, mean_NP
+
+    def choose_seeds(self, mean_NP):
+        """All farmers choose the type of seed they want to use, see AggregatePopulation.choose_seeds()."""
+        for population, reference in zip(self.__populations, mean_NP):
+            population.choose_seeds(reference)
+
+    def receive_incomes(self, n):
+        """Gives the farmers their income, where n is the number of NP users in every replicate before they chose."""
+        for population, n_NP in zip(self.__populations, n):
+            population.receive_incomes(n_NP)
+
+    def converged(self):
+        """Returns for every replicate whether its state provably cannot change any more."""
+        return np.array([population.converged() for population in self.__populations])
+
+    def totals(self):
+        """Returns the number of NP users and the summed incomes of the P and of the NP users in every replicate."""
+        nb_NP, returns_P, returns_NP = zip(*(population.totals() for population in self.__populations))
+        return np.array(nb_NP), np.array(returns_P), np.array(returns_NP)
+
+    def state(self):
+        """
+        Returns the state of all groups and of the random streams as dict of arrays, see restore().
+        """
+        state = {'random': json.dumps([rv.state() for rv in self.__random])}
+        for replicate, population in enumerate(self.__populations):
+            state.update(('{}_{}'.format(replicate, key), value) for key, value in population.state().items())
+        return state
+
+    def restore(self, state):
+        """
+        Sets the engine to a state returned by state().
+        """
+        for rv, random_state in zip(self.__random, json.loads(str(state['random']))):
+            rv.restore(random_state)
+        for replicate, population in enumerate(self.__populations):
+            prefix = '{}_'.format(replicate)
+            population.restore({key[len(prefix):]: value for key, value in state.items() if key.startswith(prefix)})
+
+    @property
+    def nb_agents(self):
+        return self.__parameters["number_of_farmers"]
+
+    @property
+    def nb_replicates(self):
+        return len(self.__populations)
@@ -8,6 +8,9 @@ import json
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
+
+import online_stats
+import result_store
 plt.style.use('ggplot')
 
 __author__ = "Claudius Graebner"
@@ -22,30 +25,54 @@ class Results:
 
     A nice possibility to plot results: x_axis: a parameter; y_axis the average result of this parameter setting.
     """
-    def __init__(self, number_of_runs, parameter_file, output_title):
+    def __init__(self, number_of_runs, parameter_file, output_title, memmap_file=None):
+        """
+        The summary statistics computed during the simulation are used if they cover all stored iterations.
+        Otherwise all iterations are loaded in one pass and the statistics are computed from them.
+        If memmap_file is given, the loaded iterations are kept in this .npy file instead of in memory.
+        """
         self.parameters = json.load(open(parameter_file))
         self.name_of_run = str(output_title)
         self.name_of_datafile = output_title + "_data.h5"
-        self.data_file = pd.HDFStore("output/" + self.name_of_datafile)
-        names = self.get_data_names(len(self.data_file.keys()))
-        self.variables_of_interest = self.data_file[names[0]].keys()
-        self.stats_of_interest = ["mean", "sd", "10% quant", "90% quant"]
-        results = collections.OrderedDict()
-        for name in self.variables_of_interest:
-            results[name] = self.make_zips([self.data_file[i][name] for i in names])
-
-        self.dynamics_vars_interest_dict = dict()
-        print("Variables considered: "),
-        for name in self.variables_of_interest:
-            print(name),
-            intermediate_dict = collections.OrderedDict()
-            intermediate_dict[self.stats_of_interest[0]] = pd.Series([np.mean(i) for i in results[name]])
-            intermediate_dict[self.stats_of_interest[1]] = pd.Series([np.std(i) for i in results[name]])
-            intermediate_dict[self.stats_of_interest[2]] = pd.Series([np.percentile(i, 10) for i in results[name]])
-            intermediate_dict[self.stats_of_interest[3]] = pd.Series([np.percentile(i, 90) for i in results[name]])
-            self.dynamics_vars_interest_dict[name] = pd.DataFrame(intermediate_dict)
+        self.data_file = result_store.ResultStore("output/" + self.name_of_run, mode='r')
+        self.variables_of_interest = pd.Index(self.data_file.variables())
+        self.stats_of_interest = list(online_stats.STATS_OF_INTEREST)
+        self.dynamics_vars_interest_dict, nb_iterations = self.data_file.read_statistics()
+        self.replicates = self.data_file.replicates()
+        self.all_data = None
+        if self.dynamics_vars_interest_dict is None or nb_iterations != len(self.replicates):
+            """The statistics were not computed during the simulation, or not for all stored iterations."""
+            self.all_data = self.data_file.read_array(self.variables_of_interest, memmap_file)
+            self.dynamics_vars_interest_dict = self.compute_statistics(self.all_data, self.variables_of_interest)
+        print("Variables considered: ", ", ".join(self.variables_of_interest))
         self.data_file.close()
 
+    @staticmethod
+    def compute_statistics(data, variables):
+        """
+        Computes the statistics over all iterations for every time step.
+
+        Parameters
+        ----------
+        data : array of float with shape (variables, iterations, timesteps)
+            The results of all iterations, as returned by ResultStore.read_array().
+
+        variables : list of str
+            The names of the variables.
+
+        Returns
+        -------
+        dict with one pd.DataFrame per variable, with one row per time step and one column per statistic.
+        """
+        means = data.mean(axis=1)
+        sds = data.std(axis=1)
+        low, high = np.percentile(data, [10, 90], axis=1)
+        statistics = collections.OrderedDict()
+        for j, name in enumerate(variables):
+            statistics[name] = pd.DataFrame(collections.OrderedDict(zip(online_stats.STATS_OF_INTEREST,
+                                                                        (means[j], sds[j], low[j], high[j]))))
+        return statistics
+
     def provide_plot(self, id_run=1, spec=1):
         """
         Provides a visualization of the experimental results.
@@ -69,7 +96,12 @@ class Results:
             """Returns one figure that summarizes the results of one single iteration."""
             data_ident = "data_" + format(int(id_run), '03d')
             print("Run considered: ", data_ident)
-            self.data = pd.read_hdf("output/" + self.name_of_datafile, data_ident)
+            if self.all_data is not None:
+                self.data = pd.DataFrame(self.all_data[:, self.replicates.index(int(id_run))].T,
+                                         columns=self.variables_of_interest)
+            else:
+                with result_store.ResultStore("output/" + self.name_of_run, mode='r') as store:
+                    self.data = store.read_replicate(id_run)
             cols = ["green", "red"]
             time = range(0, self.parameters['number_of_timesteps'] + 1)
             print(time, self.parameters['number_of_timesteps'] + 1, len(self.data["Total_return"]))
@@ -1,10 +1,15 @@
 #!/usr/bin/env python3
 """
 Analysis of the simulation output. Is called via the main procedure, but can also be called individually.
+
+The figures are drawn with the non-interactive Agg backend and written straight into one multipage PDF, or as one PNG
+or SVG file per figure. The size of a PNG file does not grow with the number of time steps, which keeps the output of
+large sweeps small. Every figure is closed as soon as it is written.
 """
+import matplotlib
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
-import os
-from PyPDF2 import PdfFileMerger, PdfFileReader
+from matplotlib.backends.backend_pdf import PdfPages
 import sys
 
 import analysis_class
@@ -12,53 +17,84 @@ import analysis_class
 __author__ = "Claudius Graebner"
 __email__ = "graebnerc@uni-bremen.de"
 
+FIGURE_FORMATS = ('pdf', 'png', 'svg')
+FIGURE_SPECS = (1, 2, 3, 4)
 
-if __name__ == '__main__':
-    if len(sys.argv) < 5:
-        print('Arguments missing! '
-              'Usage: python analyze.py [nb_iterations] [path to outputfile] [parameter_file] [run_id]')
-        exit(1)
-    nb_of_runs = sys.argv[1]
-    output = sys.argv[2]
-    parameter_file = sys.argv[3]
-    id_run_ident = sys.argv[4]
 
+def figure_paths(output_title, figure_format='pdf'):
+    """
+    Returns the paths of the figure files of a specification: one multipage PDF, or one file per figure otherwise.
+    """
+    if figure_format == 'pdf':
+        return ['output/figures/' + output_title + '_results.pdf']
+    return ['output/figures/{}_results_{}.{}'.format(output_title, spec, figure_format) for spec in FIGURE_SPECS]
+
+
+def analyze(nb_of_runs, output, parameter_file, id_run=1, figure_format='pdf'):
+    """
+    Produces the figures and the table for the results of one parameter file.
+
+    Parameters
+    ----------
+    nb_of_runs : int
+        The number of iterations.
+
+    output : str
+        The path to the output file excluding ending, e.g. 'output/m1_k10_B'.
+
+    parameter_file : str
+        The parameter file used for the runs.
 
-def analyze(nb_of_runs, id_run=id_run_ident):
-    figures = []
-    merger = PdfFileMerger()
+    id_run : int
+        The iteration illustrated in the plot of a single iteration.
 
+    figure_format : str
+        One of FIGURE_FORMATS.
+
+    Returns
+    -------
+    list of str
+        The paths of the figures and of the table.
+    """
     print("output: ", output)
     output_title = str(output[7:])
     print("output title: ", output_title)
     results = analysis_class.Results(nb_of_runs, parameter_file, output_title)
-    results.provide_plot(id_run=id_run, spec=1)
-    path_res_1 = 'output/figures/' + output_title + '_results_1.pdf'
-    plt.savefig(path_res_1, format='pdf')
-    figures.append(path_res_1)
-    plt.clf()
-    results.provide_plot(id_run=id_run, spec=2)
-    path_res_2 = 'output/figures/' + output_title + '_results_2.pdf'
-    plt.savefig(path_res_2, format='pdf')
-    figures.append(path_res_2)
-    plt.clf()
-    results.provide_plot(id_run=id_run, spec=3)
-    path_res_3 = 'output/figures/' + output_title + '_results_3.pdf'
-    plt.savefig(path_res_3, format='pdf')
-    figures.append(path_res_3)
-    plt.clf()
-    results.provide_plot(id_run=id_run, spec=4)
-    path_res_4 = 'output/figures/' + output_title + '_results_4.pdf'
-    plt.savefig(path_res_4, format='pdf')
-    figures.append(path_res_4)
-    plt.clf()
-
-    for filename in figures:
-        merger.append(PdfFileReader(open(filename, 'rb')))
-    name = 'output/figures/' + str(output[7:]) + '_results.pdf'
-    merger.write(name)
-    for filename in figures:
-        os.remove(filename)
+    return write_outputs(results, output_title, id_run, figure_format)
+
+
+def write_outputs(results, output_title, id_run=1, figure_format='pdf'):
+    """
+    Writes the figures and the table of a specification and returns their paths.
+
+    Parameters
+    ----------
+    results : analysis_class.Results
+        The loaded results of the specification.
+
+    output_title : str
+        The name of the specification, e.g. 'm1_k10_B'.
+
+    id_run : int
+        The iteration illustrated in the plot of a single iteration.
+
+    figure_format : str
+        One of FIGURE_FORMATS.
+    """
+    assert figure_format in FIGURE_FORMATS, \
+        "Figure format should be one of {} but is {}.".format(FIGURE_FORMATS, figure_format)
+    paths = figure_paths(output_title, figure_format)
+    if figure_format == 'pdf':
+        with PdfPages(paths[0]) as pdf:
+            for spec in FIGURE_SPECS:
+                fig = results.provide_plot(id_run=id_run, spec=spec)[0]
+                pdf.savefig(fig)
+                plt.close(fig)
+    else:
+        for spec, path in zip(FIGURE_SPECS, paths):
+            fig = results.provide_plot(id_run=id_run, spec=spec)[0]
+            fig.savefig(path, format=figure_format)
+            plt.close(fig)
     print("Start making table..."),
     df = results.provide_statistics()
     path_table = 'output/tables/' + output_title + '_table.tex'
@@ -68,7 +104,12 @@ def analyze(nb_of_runs, id_run=id_run_ident):
 
     # results.save_data()
     print("Success!")
+    return paths + [path_table]
 
 if __name__ == '__main__':
+    if len(sys.argv) < 5:
+        print('Arguments missing! '
+              'Usage: python analyze.py [nb_iterations] [path to outputfile] [parameter_file] [run_id] [pdf|png|svg]')
+        exit(1)
     print('Start analysis')
-    analyze(sys.argv[1])
+    analyze(sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4], *sys.argv[5:6])
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Incremental analysis of all specifications in output/. Only the specifications whose data, parameters or analysis
+code changed since their last analysis, or whose figures and table are missing, are loaded and rendered again, and
+this from a pool of processes. Afterwards one summary table with the final statistics of all specifications is
+written, for which the unchanged specifications are not loaded at all.
+
+What was analyzed is recorded in MANIFEST_FILE. A data file is only hashed if its size or modification time changed,
+so a data file that was rewritten with the same content is not analyzed again.
+
+Usage: python batch_analysis.py [--workers 4] [--figure-format pdf] [--force]
+"""
+import argparse
+import collections
+import concurrent.futures
+import glob
+import hashlib
+import json
+import logging
+import os
+import sys
+
+import reporting
+import result_cache
+import result_store
+
+__author__ = "Claudius Graebner"
+__email__ = "graebnerc@uni-bremen.de"
+
+OUTPUT_DIRECTORY = 'output'
+MANIFEST_FILE = 'output/analysis_manifest.json'
+SUMMARY_TABLE = 'output/tables/summary_table.tex'
+SUMMARY_CSV = 'output/tables/summary.csv'
+BATCH_LOG_FILE = 'output/batch_analysis.log'
+HASH_CHUNK_SIZE = 2 ** 20
+
+logger = logging.getLogger(__name__)
+
+
+def file_hash(path):
+    """Returns the sha256 of the content of a file."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def fingerprint(path, previous=None):
+    """
+    Returns the size, modification time and content hash of a file. The hash is taken from previous, the fingerprint
+    recorded at the last analysis, if size and modification time are unchanged.
+    """
+    stat = os.stat(path)
+    if previous is not None and previous['size'] == stat.st_size and previous['mtime_ns'] == stat.st_mtime_ns:
+        return previous
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': file_hash(path)}
+
+
+def find_specifications(directory=OUTPUT_DIRECTORY):
+    """
+    Returns the names of all specifications in directory that have a data file and a parameter file, e.g. m1_k10_B
+    for output/m1_k10_B_data.h5 and output/m1_k10_B.json.
+    """
+    names = []
+    for data_name in sorted(glob.glob(os.path.join(directory, '**', '*_data.h5'), recursive=True)):
+        name = os.path.relpath(data_name, directory)[:-len('_data.h5')]
+        if os.path.isfile(os.path.join(directory, name + '.json')):
+            names.append(name)
+    return names
+
+
+def load_manifest():
+    """Returns the manifest of the last analyses, one entry per specification."""
+    if not os.path.isfile(MANIFEST_FILE):
+        return {}
+    with open(MANIFEST_FILE) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest):
+    temporary = MANIFEST_FILE + '.tmp'
+    with open(temporary, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(temporary, MANIFEST_FILE)
+
+
+def is_current(entry, inputs):
+    """
+    Returns True if the manifest entry of a specification was made with the given inputs and its outputs exist.
+    """
+    if entry is None or 'summary' not in entry:
+        return False
+    if any(entry[key] != inputs[key] for key in ('parameters', 'code', 'figure_format')):
+        return False
+    if entry['data']['sha256'] != inputs['data']['sha256']:
+        return False
+    return all(os.path.isfile(path) for path in entry['outputs'])
+
+
+def analyze_specification(name, figure_format='pdf'):
+    """
+    Loads the results of one specification and writes its figures and table. Runs in a worker process.
+
+    Returns the paths of the figures and the table, and the final statistics of every variable as dict
+    {variable: {statistic: value}}.
+    """
+    import analysis_class
+    import analyze
+    output_filename = os.path.join(OUTPUT_DIRECTORY, name)
+    with result_store.ResultStore(output_filename, mode='r') as store:
+        nb_iterations = len(store.replicates())
+    results = analysis_class.Results(nb_iterations + 1, output_filename + '.json', name)
+    outputs = analyze.write_outputs(results, name, 1, figure_format)
+    summary = results.provide_statistics()
+    return outputs, {variable: {stat: float(value) for stat, value in row.items()}
+                     for variable, row in summary.iterrows()}
+
+
+def summary_frame(manifest, names):
+    """
+    Returns the final statistics of the given specifications as one pd.DataFrame with one row per specification and
+    the columns (variable, statistic).
+    """
+    import pandas as pd
+    rows = collections.OrderedDict()
+    for name in names:
+        summary = manifest[name]['summary']
+        rows[name] = pd.Series({(variable, stat): value for variable, stats in summary.items()
+                                for stat, value in stats.items()})
+    return pd.DataFrame(rows).T
+
+
+def run_batch(workers=None, figure_format='pdf', force=False):
+    """
+    Analyzes all new or changed specifications in output/ and writes the summary table of all specifications.
+
+    Parameters
+    ----------
+    workers : int or None
+        The number of processes. If None, one per core.
+
+    figure_format : str
+        The format of the figures, see analyze.FIGURE_FORMATS.
+
+    force : bool
+        If True, all specifications are analyzed again.
+
+    Returns
+    -------
+    list of str
+        The names of the specifications that were analyzed.
+    """
+    manifest = load_manifest()
+    code = result_cache.code_version(result_cache.ANALYSIS_MODULES)
+    names = find_specifications()
+    stale = {}
+    for name in names:
+        output_filename = os.path.join(OUTPUT_DIRECTORY, name)
+        entry = manifest.get(name)
+        inputs = {'data': fingerprint(output_filename + '_data.h5', entry['data'] if entry else None),
+                  'parameters': file_hash(output_filename + '.json'), 'code': code, 'figure_format': figure_format}
+        if not force and is_current(entry, inputs):
+            """The fingerprint may have a new modification time for the same content."""
+            entry['data'] = inputs['data']
+        else:
+            stale[name] = inputs
+    logger.warning('%s of %s specifications have new or changed results.', len(stale), len(names))
+    analyzed = []
+    if stale:
+        progress = reporting.ProgressReporter('Batch analysis', len(stale), unit='specifications')
+        with reporting.process_pool(workers) as executor:
+            futures = {executor.submit(analyze_specification, name, figure_format): name for name in stale}
+            for future in concurrent.futures.as_completed(futures):
+                name = futures[future]
+                progress.advance(1, 1)
+                if future.exception() is not None:
+                    logger.error('Analysis of %s failed: %s', name, future.exception())
+                    continue
+                outputs, summary = future.result()
+                manifest[name] = dict(stale[name], outputs=outputs, summary=summary)
+                analyzed.append(name)
+        progress.finish()
+    save_manifest(manifest)
+    summarized = [name for name in names if 'summary' in manifest.get(name, {})]
+    if summarized:
+        summary = summary_frame(manifest, summarized)
+        summary.to_csv(SUMMARY_CSV)
+        with open(SUMMARY_TABLE, 'w') as f:
+            f.write(summary.to_latex(float_format='%.2f'))
+    return analyzed
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(description='Analyzes all new or changed specifications in output/.')
+    parser.add_argument('--workers', type=int, default=None, help='The number of processes (default: one per core).')
+    parser.add_argument('--figure-format', choices=('pdf', 'png', 'svg'), default='pdf',
+                        help='One multipage PDF with all figures per specification (default), or one PNG or SVG file '
+                             'per figure.')
+    parser.add_argument('--force', action='store_true', help='Analyze all specifications again.')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_arguments(sys.argv[1:])
+    with reporting.LogPipeline(BATCH_LOG_FILE):
+        run_batch(args.workers, args.figure_format, args.force)
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the startup time of the entry points. Every measurement starts a fresh interpreter, imports the entry
+point and reports the wall-clock time together with the heavy modules that were loaded on the way.
+
+Usage: python benchmarks/startup.py [--repeats 10] [--json startup.json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+__author__ = "Claudius Graebner"
+__email__ = "graebnerc@uni-bremen.de"
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENTRY_POINTS = ('main', 'sweep', 'model', 'analyze')
+HEAVY_MODULES = ('pandas', 'scipy.special', 'scipy.sparse', 'tables', 'matplotlib')
+PROBE = "import sys, {module}; print(','.join(m for m in {heavy!r} if m in sys.modules))"
+
+
+def time_import(module, repeats):
+    """
+    Imports module in repeats fresh interpreters. Returns the wall-clock times in seconds and the heavy modules that
+    were loaded.
+    """
+    code = PROBE.format(module=module, heavy=HEAVY_MODULES)
+    times, loaded = [], ''
+    for _ in range(repeats):
+        start = time.perf_counter()
+        loaded = subprocess.run([sys.executable, '-c', code], cwd=REPOSITORY, check=True, stdout=subprocess.PIPE,
+                                universal_newlines=True).stdout.strip()
+        times.append(time.perf_counter() - start)
+    return times, [m for m in loaded.split(',') if m]
+
+
+def time_interpreter(repeats):
+    """Returns the wall-clock times of starting an interpreter that does nothing, as a reference."""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'pass'], check=True)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Measures the startup time of the entry points.')
+    parser.add_argument('--repeats', type=int, default=10, help='The number of fresh interpreters per entry point.')
+    parser.add_argument('--json', default=None, help='Write the results to this file.')
+    args = parser.parse_args(argv)
+    results = {'python': sys.version.split()[0], 'repeats': args.repeats,
+               'interpreter': statistics.median(time_interpreter(args.repeats)), 'imports': {}}
+    print('{:<10} {:>10} {:>10}  {}'.format('module', 'median s', 'min s', 'heavy modules loaded'))
+    print('{:<10} {:>10.3f}'.format('(none)', results['interpreter']))
+    for module in ENTRY_POINTS:
+        times, loaded = time_import(module, args.repeats)
+        results['imports'][module] = {'median': statistics.median(times), 'min': min(times), 'loaded': loaded}
+        print('{:<10} {:>10.3f} {:>10.3f}  {}'.format(module, statistics.median(times), min(times),
+                                                     ', '.join(loaded) or '-'))
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the simulation kernels and the storage and analysis of the results.
+
+Every benchmark is run for every combination of the given numbers of farmers, time steps and retrospective memories.
+The throughput is reported in agent-steps per second for the simulation kernels, and in the unit given in the table
+for the others. The peak memory is measured in a separate run with tracemalloc, so that it does not slow down the
+timed runs. The results can be saved as baseline and later runs compared against it:
+
+    python benchmarks/suite.py --save benchmarks/baseline.json
+    python benchmarks/suite.py --compare benchmarks/baseline.json --threshold 0.2
+
+A benchmark is flagged as regression if its throughput dropped or its peak memory grew by more than the threshold.
+The exit code is 1 if there is any regression.
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPOSITORY)
+
+import model
+import population_generator
+import random_variates
+import result_store
+
+__author__ = "Claudius Graebner"
+__email__ = "graebnerc@uni-bremen.de"
+
+TEMPLATE = os.path.join(REPOSITORY, 'specifications', 'm1_k10_A.json')
+UPDATE_CASES = (('model_0', 'A'), ('model_1', 'A'), ('model_1', 'B'), ('model_1', 'C'), ('model_2', 'A'),
+                ('model_2', 'B'))
+AGGREGATE_CASES = (('model_0', 'A'), ('model_1', 'A'))
+NB_REPLICATES_STORED = 20
+MEMORY_FLOOR_MB = 1.0
+
+
+def specification(nb_farmers, nb_timesteps, memory, model_name='model_1', case='A', simulation='agents'):
+    """Returns the parameters of the shipped template with the given size, memory, model, case and simulation."""
+    parameters = json.load(open(TEMPLATE))
+    parameters.update({'number_of_farmers': nb_farmers, 'number_of_timesteps': nb_timesteps,
+                       'retrospective_memory': memory, 'model': model_name, 'model_1_case': case,
+                       'simulation': simulation})
+    return parameters
+
+
+def bench_update(parameters, directory):
+    """Model.update for all time steps."""
+    m = model.Model(parameters, os.path.join(directory, 'bench'), 1, seed=1)
+    yield
+    for i in range(parameters['number_of_timesteps']):
+        m.update(i)
+    yield parameters['number_of_farmers'] * parameters['number_of_timesteps']
+
+
+def bench_returns_NP(parameters, directory):
+    """RandomVariates.returns_NP, the NP returns of all farmers of a time step in one draw as in the model."""
+    rv = random_variates.RandomVariates(dict(parameters, var_return_NP=1.0), 1)
+    yield
+    rv.returns_NP(parameters['number_of_farmers'])
+    yield parameters['number_of_farmers']
+
+
+def bench_make_neighborhoods(parameters, directory):
+    """PopulationGenerator, i.e. the initial seeds and the network of one population."""
+    yield
+    population_generator.PopulationGenerator(parameters, None, 1)
+    yield parameters['number_of_farmers']
+
+
+def bench_save_data(parameters, directory):
+    """Model.save_data of one simulated iteration."""
+    output_filename = os.path.join(directory, 'bench_save')
+    m = model.Model(parameters, output_filename, 1, seed=1)
+    m.run(save=False)
+    if os.path.isfile(output_filename + '_data.h5'):
+        os.remove(output_filename + '_data.h5')
+    yield
+    m.save_data()
+    yield parameters['number_of_timesteps'] + 1
+
+
+def bench_results(parameters, directory):
+    """analysis_class.Results for NB_REPLICATES_STORED iterations, computing the statistics from the data file."""
+    import analysis_class
+    title = 'bench_results_{}_{}_{}'.format(parameters['number_of_farmers'], parameters['number_of_timesteps'],
+                                            -parameters['retrospective_memory'])
+    output_filename = os.path.join(directory, 'output', title)
+    os.makedirs(os.path.dirname(output_filename), exist_ok=True)
+    if not os.path.isfile(output_filename + '_data.h5'):
+        m = model.Model(parameters, output_filename, 1, seed=1, nb_replicates=NB_REPLICATES_STORED)
+        m.run(save=False)
+        with result_store.ResultStore(output_filename) as store:
+            for replicate in range(NB_REPLICATES_STORED):
+                store.append(replicate + 1, model.results_frame(m.get_results(replicate)))
+        with open(output_filename + '.json', 'w') as f:
+            json.dump(parameters, f)
+    working_directory = os.getcwd()
+    os.chdir(directory)
+    try:
+        yield
+        analysis_class.Results(NB_REPLICATES_STORED + 1, output_filename + '.json', title)
+        yield NB_REPLICATES_STORED * (parameters['number_of_timesteps'] + 1)
+    finally:
+        os.chdir(working_directory)
+
+
+def benchmarks():
+    """Returns (name, function, unit, relevant parameters, options of the specification) of all benchmarks."""
+    suite = [('update:{}_{}'.format(model_name, case), bench_update, 'agent-steps', ('N', 'T', 'k'),
+              dict(model_name=model_name, case=case)) for model_name, case in UPDATE_CASES]
+    suite += [('update:{}_{}_aggregate'.format(model_name, case), bench_update, 'agent-steps', ('N', 'T', 'k'),
+               dict(model_name=model_name, case=case, simulation='aggregate')) for model_name, case in AGGREGATE_CASES]
+    suite += [('returns_NP', bench_returns_NP, 'draws', ('N',), {}),
+              ('make_neighborhoods', bench_make_neighborhoods, 'agents', ('N',), {}),
+              ('save_data', bench_save_data, 'rows', ('N', 'T', 'k'), {}),
+              ('results', bench_results, 'rows', ('N', 'T', 'k'), {})]
+    return suite
+
+
+def measure(function, parameters, directory, trace=False):
+    """
+    Runs one benchmark. The code before the first yield of function is the untimed setup, the code between the
+    first and the second yield is measured. Returns the seconds, the amount of work and the peak memory in MB.
+    """
+    steps = function(parameters, directory)
+    next(steps)
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    work = next(steps)
+    seconds = time.perf_counter() - start
+    peak = 0.0
+    if trace:
+        peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+    steps.close()
+    return seconds, work, peak
+
+
+def run_suite(farmers, timesteps, memories, repeats=3, only=None):
+    """
+    Runs all benchmarks for all combinations of the parameters. Returns a dict with one entry per benchmark and
+    relevant parameters.
+    """
+    results = {}
+    directory = tempfile.mkdtemp(prefix='benchmarks_')
+    logging.disable(logging.CRITICAL)
+    try:
+        for nb_farmers, nb_timesteps, memory in itertools.product(farmers, timesteps, memories):
+            values = {'N': nb_farmers, 'T': nb_timesteps, 'k': memory}
+            for name, function, unit, relevant, options in benchmarks():
+                if only is not None and not any(name.startswith(prefix) for prefix in only):
+                    continue
+                key = '{}|{}'.format(name, ','.join('{}={}'.format(p, values[p]) for p in relevant))
+                if key in results:
+                    continue
+                parameters = specification(nb_farmers, nb_timesteps, memory, **options)
+                seconds = min(measure(function, parameters, directory)[0] for _ in range(repeats))
+                _, work, peak = measure(function, parameters, directory, trace=True)
+                results[key] = {'seconds': seconds, 'throughput': work / seconds, 'unit': unit, 'peak_mb': peak}
+                print('{:<45} {:>14.0f} {:<12} {:>9.3f} s {:>9.1f} MB'.format(key, work / seconds, unit + '/s',
+                                                                           seconds, peak))
+    finally:
+        logging.disable(logging.NOTSET)
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Returns the keys of the benchmarks whose throughput dropped or whose peak memory grew by more than threshold
+    compared to the baseline, together with a description.
+    """
+    regressions = []
+    for key, result in sorted(results.items()):
+        if key not in baseline:
+            continue
+        reference = baseline[key]
+        ratio = result['throughput'] / reference['throughput']
+        if ratio < 1 - threshold:
+            regressions.append((key, 'throughput {:.0%} of baseline'.format(ratio)))
+        if result['peak_mb'] > max(reference['peak_mb'] * (1 + threshold), reference['peak_mb'] + MEMORY_FLOOR_MB):
+            regressions.append((key, 'peak memory {:.1f} MB instead of {:.1f} MB'.format(result['peak_mb'],
+                                                                                       reference['peak_mb'])))
+    return regressions
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Benchmarks the simulation kernels, storage and analysis.')
+    parser.add_argument('--farmers', type=int, nargs='+', default=[100, 1000], help='Numbers of farmers.')
+    parser.add_argument('--timesteps', type=int, nargs='+', default=[100], help='Numbers of time steps.')
+    parser.add_argument('--memory', type=int, nargs='+', default=[-10, -50], help='Retrospective memories.')
+    parser.add_argument('--repeats', type=int, default=3, help='Timed runs per benchmark, the fastest counts.')
+    parser.add_argument('--only', nargs='+', default=None, help='Only run benchmarks starting with these names.')
+    parser.add_argument('--save', default=None, help='Save the results as baseline to this file.')
+    parser.add_argument('--compare', default=None, help='Compare the results to the baseline in this file.')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Relative change flagged as regression.')
+    args = parser.parse_args(argv)
+    results = run_suite(args.farmers, args.timesteps, args.memory, args.repeats, args.only)
+    if args.save is not None:
+        with open(args.save, 'w') as f:
+            json.dump({'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.node(),
+                       'results': results}, f, indent=2, sort_keys=True)
+    if args.compare is not None:
+        regressions = compare(results, json.load(open(args.compare))['results'], args.threshold)
+        for key, description in regressions:
+            print('REGRESSION {}: {}'.format(key, description))
+        if regressions:
+            return 1
+        print('No regressions beyond {:.0%}.'.format(args.threshold))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
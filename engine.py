@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+"""
+The array-backed population engine. It holds the state of all farmers in NumPy arrays and applies the decision and
+payoff rules of the model to the whole population at once. Is used from model.py.
+"""
+import json
+
+import numpy as np
+
+import memory
+import neighborhood
+
+__author__ = "Claudius Graebner"
+__email__ = "graebnerc@uni-bremen.de"
+
+
+class PopulationEngine:
+    """
+    The state of the farmer populations of one or several replicates.
+
+    Seeds, current incomes and the payoffs within the retrospective memory of all farmers are kept in arrays of shape
+    (replicates, farmers), where farmer i of replicate r is the entry [r, i] of every array. Replicates share the
+    parametrization, but each has its own network and its own stream of random draws. Seeds follow the convention of
+    the farmer class: 0 stands for the proprietary and 1 for the non-proprietary seed.
+
+    In contrast to the sequential activation of the farmer objects, all farmers decide simultaneously on the basis
+    of the state at the beginning of the time step. In the extensions, only the farmers whose reference changed since
+    their last decision and the farmers facing a tie decide again, the others keep their seed.
+    """
+    def __init__(self, parameters, initial_seeds, network, random_variates):
+        """
+        Parameters
+        ----------
+        parameters : dict
+            The parametrization of the model run.
+
+        initial_seeds : array of int (0 or 1) with shape (replicates, number_of_farmers)
+            The seed every farmer starts with.
+
+        network : topology.NetworkTopology or topology.LatticeTopology
+            The neighborhoods of the farmers of all replicates, where farmer i of replicate r has the index
+            r * number_of_farmers + i.
+
+        random_variates : list of random_variates.RandomVariates
+            The source of all random draws for every replicate.
+        """
+        self.__parameters = parameters
+        self.__random = list(random_variates)
+        self.__seeds = np.array(initial_seeds, dtype=np.int8, ndmin=2)
+        assert np.all((self.__seeds == 0) | (self.__seeds == 1)), "Initial seeds should be either 0 or 1."
+        self.__nb_replicates, self.__nb_agents = self.__seeds.shape
+        assert len(self.__random) == self.__nb_replicates, \
+            "Random variates given for {} but engine has {} replicates.".format(len(self.__random),
+                                                                               self.__nb_replicates)
+        self.__network = network
+        assert network.nb_agents == self.__seeds.size, \
+            "Network given for {} but population has {} agents.".format(network.nb_agents, self.__seeds.size)
+        self.__net_return_P = float(parameters["fix_return_P"]) - parameters["yearly_cost_P"]
+        self.__incomes = np.zeros(self.__seeds.shape)
+        self.__stable_steps = np.zeros(self.__nb_replicates, dtype=np.int64)
+        self.__memory = memory.RetrospectiveMemory(parameters["retrospective_memory"], self.__seeds.shape)
+        self.__neighborhoods = neighborhood.NeighborhoodMeans(network)
+        self.__last_reference = None
+        self.__ties = np.zeros(self.__seeds.shape, dtype=bool)
+        self.__decision_check = neighborhood.ChangeCheck()
+
+    def update(self, i):
+        """
+        The update procedure implemented at any time step.
+
+        Procedure
+        ----------
+
+        1. It first calculates the average yield for the NP users.
+        2. Then agents choose the type of seed they want to use.
+        3. Finally they receive their income.
+
+        Parameters
+        ----------
+        i : int
+            The current time step.
+        """
+        n_NP, mean_NP, window_means = self.decision_basis(i)
+        self.choose_seeds(mean_NP, window_means)
+        previous_incomes = self.__incomes
+        self.receive_incomes(n_NP)
+        unchanged = np.all(self.__incomes == previous_incomes, axis=1)
+        self.__stable_steps = np.where(unchanged, self.__stable_steps + 1, 0)
+
+    def decision_basis(self, i):
+        """
+        Returns the number of NP users and the average NP yield in every replicate, and the window means of all
+        farmers (None in the baseline model), on which the farmers base their decisions in time step i.
+        """
+        n_NP = np.count_nonzero(self.__seeds, axis=1)
+        window_means = None
+        mean_NP = np.full(self.__nb_replicates, self.__net_return_P)
+        if self.__parameters["model"] != "model_0":
+            window_means = self.window_means()
+            if i > 0:
+                mean_NP = self.average_NP(window_means, n_NP)
+        return n_NP, mean_NP, window_means
+
+    def average_NP(self, window_means, n_NP):
+        """
+        Returns the average window mean of the NP users in every replicate (NaN if there is no NP user).
+        """
+        sums_NP = np.sum(window_means, axis=1, where=self.__seeds == 1)
+        mean_NP = np.full(self.__nb_replicates, np.nan)
+        np.divide(sums_NP, n_NP, out=mean_NP, where=n_NP > 0)
+        return mean_NP
+
+    def converged(self):
+        """
+        Returns for every replicate whether its state provably cannot change any more, i.e. whether all following
+        time steps repeat the last one. Must only be called after an update.
+
+        A replicate without NP users stays there in the extensions, as the NP average is undefined for everybody. A
+        replicate with NP users has converged if no random draws are needed anymore (the NP return is deterministic
+        and there are no ties), the payoffs have been the same for the whole retrospective memory, and the next
+        decision on this basis confirms the current seeds and payoffs.
+        """
+        params = self.__parameters
+        n_NP = np.count_nonzero(self.__seeds, axis=1)
+        deterministic_NP = params["var_return_NP"] == 0 or params["model"] == "model_2"
+        if params["model"] == "model_0":
+            always_P = params["p_P"] >= 1
+            always_NP = params["p_P"] <= 0 and deterministic_NP
+            return np.full(self.__nb_replicates, always_P or always_NP)
+        converged = n_NP == 0
+        size = self.__memory.size
+        candidates = ~converged & (self.__stable_steps >= size - 1)
+        if not (deterministic_NP and size > 0 and candidates.any()):
+            return converged
+        window_means = self.window_means()
+        reference = self.reference(self.average_NP(window_means, n_NP), window_means)
+        undefined = np.isnan(reference)
+        ties = ~(undefined | (self.__net_return_P > reference) | (self.__net_return_P < reference))
+        seeds = np.where(undefined, self.__seeds, self.__net_return_P < reference)
+        incomes = np.full(self.__seeds.shape, self.__net_return_P)
+        if params["model"] == "model_2":
+            np.copyto(incomes, (2 * self.__net_return_P * n_NP / params["number_of_farmers"])[:, np.newaxis],
+                      where=seeds == 1)
+        else:
+            incomes[seeds == 1] = params["mean_return_NP"]
+        repeated = ~ties.any(axis=1) & np.all(seeds == self.__seeds, axis=1) & np.all(incomes == self.__incomes,
+                                                                                     axis=1)
+        return converged | (candidates & repeated)
+
+    def totals(self):
+        """
+        Returns the number of NP users and the summed incomes of the P and of the NP users in every replicate.
+        """
+        nb_NP = np.count_nonzero(self.__seeds, axis=1)
+        returns_NP = np.sum(self.__incomes, axis=1, where=self.__seeds == 1)
+        returns_P = np.sum(self.__incomes, axis=1, where=self.__seeds == 0)
+        return nb_NP, returns_P, returns_NP
+
+    def window_means(self):
+        """
+        Returns the average payoff of every farmer over the retrospective memory.
+        """
+        return self.__memory.means()
+
+    def neighborhood_means(self, window_means):
+        """
+        Returns for every farmer the average window mean of the neighbors that currently use the NP seed.
+
+        Sums and numbers of NP neighbors are both neighborhood sums over the NP mask. They are only computed again for
+        the neighborhoods of farmers whose seed or window mean changed since the last call, see
+        neighborhood.NeighborhoodMeans. Farmers without any NP neighbor get NaN, i.e. their reference is undefined.
+        The returned array is overwritten by the next call.
+        """
+        return self.__neighborhoods.update(self.__seeds, window_means).reshape(self.__seeds.shape)
+
+    def choose_seeds(self, mean_NP, window_means):
+        """
+        All farmers choose the type of seed they want to use.
+
+        Parameters
+        ----------
+        mean_NP : array of float
+            The average yield of the agents that use the NP seed in every replicate.
+
+        window_means : array of float or None
+            The average payoff of every farmer over the retrospective memory. Not needed in the baseline model.
+
+        Description
+        ------------
+        Depending on the model type, one of the following procedure is implemented:
+            Baseline model (model_0):
+                Agents choose a type of seed at random.
+            Extension 1: Here we distinguish three cases:
+                A : The agents compare the fixed return of the proprietary seed with the average yield of all agents
+                    that have used the non-proprietary alternative in the last k rounds (k is a parameter).
+                B: The agents compare the P payoff with the average payoffs of their neighbors using the NP seed
+                    (again considering the previous k rounds).
+                C: This case does not differ to case B, but agents add their own average payoff of the previous
+                    k rounds to the one of their neighbors.
+            Extension 2 works as the first extension but this time the payoff of the NP seed is a function of the users.
+        Ties are resolved at random. If the NP average is undefined because there is no NP user to observe (no NP
+        user at all in case A, no NP neighbor in the cases B and C), the farmer keeps its seed.
+
+        In the extensions the decision only depends on the reference, so a farmer whose reference did not change since
+        its last decision would take the same decision again. Only the other farmers decide, together with all
+        farmers facing a tie, which draw anew in every time step. If many references changed, all farmers decide.
+        """
+        params = self.__parameters
+        if params["model"] == "model_0":
+            self.__seeds = np.stack([rv.choices_NP(self.__nb_agents, params["p_P"]) for rv in self.__random])
+        elif params["model"] in ("model_1", "model_2"):
+            reference = self.reference(mean_NP, window_means)
+            last_reference, self.__last_reference = self.__last_reference, np.array(reference)
+            if last_reference is not None and self.__decision_check.due():
+                """Comparing the bits, an undefined reference (NaN) that stays undefined counts as unchanged."""
+                stale = reference.view(np.int64) != last_reference.view(np.int64)
+                few = np.count_nonzero(stale) <= neighborhood.FULL_UPDATE_SHARE * stale.size
+                self.__decision_check.found(few)
+                if few:
+                    self.choose_seeds_of(np.flatnonzero(stale), reference)
+                    return
+            undefined = np.isnan(reference)
+            prefer_P = self.__net_return_P > reference
+            prefer_NP = self.__net_return_P < reference
+            ties = ~(prefer_P | prefer_NP | undefined)
+            seeds = np.where(undefined, self.__seeds, prefer_NP).astype(np.int8)
+            seeds[ties] = self.__draw_per_replicate(ties, lambda rv, n: rv.coin_flips(n))
+            self.__ties = ties
+            self.__seeds = seeds
+        else:
+            raise Exception("No correct model specified.")
+
+    def choose_seeds_of(self, deciding, reference):
+        """
+        Only the given farmers (flat indices) decide on the basis of the reference, the farmers facing a tie in their
+        last decision draw anew, and all other farmers keep their seed.
+        """
+        if len(deciding) == 0 and not self.__ties.any():
+            return
+        values = reference.ravel()[deciding]
+        undefined = np.isnan(values)
+        prefer_P = self.__net_return_P > values
+        prefer_NP = self.__net_return_P < values
+        seeds = self.__seeds.copy()
+        seeds.ravel()[deciding] = np.where(undefined, seeds.ravel()[deciding], prefer_NP)
+        self.__ties.ravel()[deciding] = ~(prefer_P | prefer_NP | undefined)
+        seeds[self.__ties] = self.__draw_per_replicate(self.__ties, lambda rv, n: rv.coin_flips(n))
+        self.__seeds = seeds
+
+    def reference(self, mean_NP, window_means):
+        """
+        Returns for every farmer the NP payoff with which the P payoff is compared in the extensions (NaN if
+        undefined).
+        """
+        case = self.__parameters["model_1_case"]
+        if case == "A":
+            return np.broadcast_to(np.asarray(mean_NP, dtype=float)[:, np.newaxis], self.__seeds.shape)
+        elif case == "B":
+            return self.neighborhood_means(window_means)
+        elif case == "C":
+            #  TODO Maybe do this more rigorous
+            return self.neighborhood_means(window_means) + window_means
+        elif case == "D":
+            raise Exception("Case D not yet implemented.")
+        else:
+            raise Exception("No correct case specified.")
+
+    def receive_incomes(self, n):
+        """
+        Gives the agents their income.
+
+        Parameters
+        -----------
+        n : array of int
+            The number of agents using the NP seeds at the beginning of the time period considered in every
+            replicate. Needed to calculate the return in model extension 2.
+
+        Description
+        -----------
+        In the baseline model or the first extension, the yield of the P value is fixed, and the NP value follows a
+        truncated normal distribution (over positive reals) with given mean and variance.
+        In the second extension (model_2) the return of the NP seed depends on the number of users:
+            $$P = 2 * R_P * (n / N)$$
+        """
+        params = self.__parameters
+        incomes = np.full(self.__seeds.shape, self.__net_return_P)
+        users_NP = self.__seeds == 1
+        if params["model"] == "model_2":
+            returns_NP = 2 * self.__net_return_P * (np.asarray(n) / params["number_of_farmers"])
+            np.copyto(incomes, returns_NP[:, np.newaxis], where=users_NP)
+        else:
+            incomes[users_NP] = self.__draw_per_replicate(users_NP, lambda rv, k: rv.returns_NP(k))
+        self.__incomes = incomes
+        self.__memory.add(incomes)
+
+    def state(self):
+        """
+        Returns the state of all farmers and of the random streams as dict of arrays. Together with the parameters and
+        the network, from which the engine was built, it determines all following time steps, see restore().
+        """
+        state = {'seeds': self.__seeds, 'incomes': self.__incomes, 'stable_steps': self.__stable_steps,
+                 'random': json.dumps([rv.state() for rv in self.__random])}
+        state.update(('memory_' + key, value) for key, value in self.__memory.state().items())
+        return state
+
+    def restore(self, state):
+        """
+        Sets the engine to a state returned by state().
+        """
+        seeds = np.array(state['seeds'], dtype=np.int8)
+        assert seeds.shape == self.__seeds.shape, \
+            "State given for shape {} but engine has shape {}.".format(seeds.shape, self.__seeds.shape)
+        self.__seeds = seeds
+        self.__incomes = np.array(state['incomes'], dtype=float)
+        self.__stable_steps = np.array(state['stable_steps'], dtype=np.int64)
+        for rv, random_state in zip(self.__random, json.loads(str(state['random']))):
+            rv.restore(random_state)
+        self.__memory.restore({key[len('memory_'):]: value for key, value in state.items()
+                               if key.startswith('memory_')})
+        """The decisions and neighborhoods are derived from the state and are set up again in the next time step."""
+        self.__neighborhoods.clear()
+        self.__last_reference = None
+        self.__ties[:] = False
+        self.__decision_check.reset()
+
+    def __draw_per_replicate(self, mask, draw):
+        """
+        Draws one value for every True entry of mask from the random stream of the respective replicate.
+        The values are returned in the row-major order of the mask, so they can be assigned via array[mask].
+        """
+        counts = np.count_nonzero(mask, axis=1)
+        if self.__nb_replicates == 1:
+            return draw(self.__random[0], int(counts[0]))
+        return np.concatenate([draw(rv, int(k)) for rv, k in zip(self.__random, counts)])
+
+    @property
+    def seeds(self):
+        return self.__seeds
+
+    @property
+    def incomes(self):
+        return self.__incomes
+
+    @property
+    def network(self):
+        return self.__network
+
+    @property
+    def nb_agents(self):
+        return self.__nb_agents
+
+    @property
+    def nb_replicates(self):
+        return self.__nb_replicates
+
+    def get_payoff_history(self):
+        """
+        Returns the payoffs within the retrospective memory with shape (rounds, replicates, farmers), oldest first.
+        """
+        return self.__memory.window()
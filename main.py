@@ -3,40 +3,180 @@
 A computational experiment that is used to derive an algorithmic definition of an institution.
 This file is the meta-function that implements the computational model by running several instances of the model
 """
+import argparse
 import json
 import logging
 import model
+import numpy as np
+import online_stats
 import os
+import random_variates
+import reporting
+import result_cache
+import result_store
 import shutil
-import subprocess
 import sys
 
 
 __author__ = "Claudius Graebner"
 __email__ = "graebnerc@uni-bremen.de"
 
+logger = logging.getLogger(__name__)
 
-def main():
+def parse_arguments(argv):
+    """
+    Parses the command line: python main.py [parameterfile] [nb_iterations] [options]
+    """
+    parser = argparse.ArgumentParser(description='Runs the model for one parameter file.')
+    parser.add_argument('parameterfile', help='The parameter file, must be in the directory specifications/.')
+    parser.add_argument('nb_iterations', type=int,
+                        help='The number of iterations (replicates) of the model. With --tolerance, the number of '
+                             'iterations of every batch.')
+    parser.add_argument('--ensemble', action='store_true',
+                        help='Simulate all iterations together as one array run instead of one after another.')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='The number of processes over which the iterations are spread (default: 1).')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='The master seed from which the seeds of all iterations are spawned. '
+                             'If not given, a fresh one is drawn and recorded with the results.')
+    parser.add_argument('--cache-budget', type=float, default=1024,
+                        help='The disk budget of the cache of iteration results and of the cache of networks, each '
+                             'in megabytes (default: 1024). Iterations are only taken from the cache if the master '
+                             'seed is given.')
+    parser.add_argument('--no-cache', action='store_true', help='Neither use nor fill the caches.')
+    parser.add_argument('--profile', action='store_true',
+                        help='Time the phases of every run and store the timings with the results.')
+    parser.add_argument('--figure-format', choices=('pdf', 'png', 'svg'), default='pdf',
+                        help='One multipage PDF with all figures (default), or one PNG or SVG file per figure.')
+    parser.add_argument('--checkpoint-interval', type=int, default=None, metavar='STEPS',
+                        help='Save the state of every run every STEPS time steps. An interrupted run continues from '
+                             'its last checkpoint when it is started again with the same seed.')
+    parser.add_argument('--record-agents', choices=('full', 'switches'), default=None,
+                        help='Write the seed and income of every farmer in every time step (full) or only the seed '
+                             'switches (switches) to disk, see agent_recorder.py. Disables the cache of iteration '
+                             'results, as the cached iterations are not simulated again.')
+    parser.add_argument('--tolerance', action='append', default=[], metavar='VARIABLE=WIDTH',
+                        help='Run batches of nb_iterations until the confidence interval of the mean of VARIABLE at '
+                             'the final time step is at most WIDTH to either side, e.g. Share_P=0.01. Can be given '
+                             'for several variables.')
+    parser.add_argument('--max-iterations', type=int, default=online_stats.DEFAULT_MAX_ITERATIONS,
+                        help='The largest number of iterations with --tolerance (default: {}).'.format(
+                            online_stats.DEFAULT_MAX_ITERATIONS))
+    parser.add_argument('--confidence', type=float, default=online_stats.DEFAULT_CONFIDENCE,
+                        help='The confidence level of the intervals with --tolerance (default: {}).'.format(
+                            online_stats.DEFAULT_CONFIDENCE))
+    return parser.parse_args(argv)
+
+
+def run_replicates(parameters, output_filename, nb_iterations, master_seed, ensemble=False, workers=1, cache=None,
+                   profile=False, topology_cache=None, checkpoint_interval=None, record_agents=None, stopping=None):
+    """
+    Runs all iterations of the model and saves their results in batches to the result store. The summary statistics
+    for the analysis are updated with every finished iteration and saved with the results.
+
+    The seed of iteration i is the i-th child spawned from the master seed, so the results only depend on the
+    master seed and not on the number of workers or on the ensemble mode. Iterations found in the cache (a
+    result_cache.ResultCache) are not simulated again. The networks of the farmers are reused from topology_cache (a
+    result_cache.TopologyCache), if given. With profile, the timings of the phases of every run are stored with the
+    results. With a checkpoint interval, every run saves its state regularly and continues from it after an
+    interruption, see model.Model.run(). With record_agents, the micro data of every run are written next to the
+    results, see agent_recorder.
+
+    With stopping (an online_stats.SequentialStopping), nb_iterations are only the first batch, and further batches
+    of iterations are run until the statistics at the final time step are precise enough.
+
+    Returns the cache keys of the iterations (None without cache) and the number of iterations.
+    """
+    keys = [] if cache is not None else None
+    progress = reporting.ProgressReporter(output_filename, 0, 0)
+    any_simulated = False
+    expected_rows = (stopping.max_iterations if stopping is not None else nb_iterations) * \
+        (parameters["number_of_timesteps"] + 1)
+    statistics = online_stats.OnlineStatistics(model.RESULT_VARIABLES, parameters["number_of_timesteps"] + 1)
+    with result_store.ResultStore(output_filename, expected_rows=expected_rows) as store:
 
-    if len(sys.argv) < 3:
-        print('Arguments missing! Usage: python main.py [parameterfile] [nb_iterations]')
-        exit(1)
-    parameter_filename = sys.argv[1]
+        def keep(i, results, convergence_step, simulated=True, timings=None, nb_replicates=1):
+            store.append(i, model.results_frame(results), master_seed, convergence_step, timings, nb_replicates)
+            if simulated:
+                progress.advance(parameters["number_of_timesteps"], 1)
+            if simulated and cache is not None:
+                cache.put(keys[i - 1], results, convergence_step)
+
+        first, batch = 1, nb_iterations
+        while batch > 0:
+            iterations = range(first, first + batch)
+            seeds = random_variates.spawn_seeds(master_seed, first + batch - 1)
+            cached = {}
+            if cache is not None:
+                keys.extend(cache.key(parameters, seeds[i - 1]) for i in iterations)
+                for i in iterations:
+                    entry = cache.get(keys[i - 1])
+                    if entry is not None:
+                        cached[i] = entry
+                logger.warning('%s of %s iterations found in the cache.', len(cached), batch)
+            missing = [i for i in iterations if i not in cached]
+            progress.expect(len(missing) * parameters["number_of_timesteps"], len(missing))
+            any_simulated = any_simulated or bool(missing)
+            for i, (results, convergence_step) in sorted(cached.items()):
+                statistics.add_run(results)
+                keep(i, results, convergence_step, simulated=False)
+            if ensemble and missing:
+                m = model.Model(parameters, output_filename, missing[0], seed=[seeds[i - 1] for i in missing],
+                                nb_replicates=len(missing), statistics=statistics, profile=profile,
+                                topology_cache=topology_cache, checkpoint_interval=checkpoint_interval,
+                                record_agents=record_agents)
+                m.run(save=False)
+                for replicate, i in enumerate(missing):
+                    """The timings of the ensemble run are stored with its first iteration."""
+                    keep(i, m.get_results(replicate), m.get_convergence_step(replicate),
+                         timings=m.get_timings() if replicate == 0 else None, nb_replicates=len(missing))
+            elif workers > 1:
+                with reporting.process_pool(workers) as executor:
+                    futures = [executor.submit(model.run_replicate, parameters, output_filename, i, seeds[i - 1],
+                                               profile, topology_cache, checkpoint_interval, record_agents)
+                               for i in missing]
+                    for i, future in zip(missing, futures):
+                        results, convergence_step, timings = future.result()
+                        statistics.add_run(results)
+                        keep(i, results, convergence_step, timings=timings)
+            else:
+                for i in missing:
+                    results, convergence_step, timings = model.run_replicate(parameters, output_filename, i,
+                                                                             seeds[i - 1], profile, topology_cache,
+                                                                             checkpoint_interval, record_agents)
+                    statistics.add_run(results)
+                    keep(i, results, convergence_step, timings=timings)
+            if cache is not None:
+                cache.evict()
+            if topology_cache is not None:
+                topology_cache.evict()
+            first += batch
+            batch = stopping.next_batch(statistics) if stopping is not None else 0
+            if stopping is not None:
+                logger.warning('%s iterations done, half widths of the confidence intervals (tolerances): %s.%s',
+                               first - 1, stopping.describe(statistics),
+                               ' Running {} more.'.format(batch) if batch > 0 else '')
+        store.write_statistics(statistics)
+    if any_simulated:
+        progress.finish()
+    return keys, first - 1
+
+
+def main():
+    args = parse_arguments(sys.argv[1:])
+    parameter_filename = args.parameterfile
     assert parameter_filename[:15] == 'specifications/', "Called jsons must be in directory specifications/"
     parameters = json.load(open(parameter_filename))
-    """Initialize loggers to keep track of what happens in the model."""
+    """Send the logs of all processes through one queue to the terminal and the log file."""
     logging_filename = 'output/' + parameter_filename[15:-5] + '.log'
-    logger = logging.getLogger(__name__)
-    logger.setLevel(logging.WARNING)
-    terminal_handler = logging.StreamHandler()
-    terminal_handler.setLevel(logging.WARNING)
-    file_handler = logging.FileHandler(filename=logging_filename)
-    file_handler.setLevel(logging.WARNING)
-    standard_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    terminal_handler.setFormatter(standard_formatter)
-    file_handler.setFormatter(standard_formatter)
-    logger.addHandler(terminal_handler)
-    logger.addHandler(file_handler)
+    with reporting.LogPipeline(logging_filename):
+        run_experiment(args, parameter_filename, parameters)
+
+
+def run_experiment(args, parameter_filename, parameters):
+    """
+    Runs all iterations of one parameter file and analyzes them.
+    """
     logger.info("Parameters loaded successfully from parameter file: {}".format(str(parameter_filename)))
     """Specify output directory."""
     output_filename = 'output/' + parameter_filename[15:-5]
@@ -44,20 +184,39 @@ def main():
     if os.path.isfile(data_name):
         os.rename(data_name, data_name + "_old")
     """Conduct the computational experiment."""
-    iteration = int(sys.argv[2]) + 1
-    for i in range(1, iteration):
-        m = model.Model(parameters, output_filename, i)
-        m.run()
+    master_seed = args.seed if args.seed is not None else int(np.random.SeedSequence().entropy)
+    logger.warning('Master seed: %s', str(master_seed))
+    cache = None
+    if not (args.no_cache or args.record_agents):
+        cache = result_cache.ResultCache(budget=args.cache_budget)
+    topology_cache = None if args.no_cache else result_cache.TopologyCache(budget=args.cache_budget)
+    stopping = None
+    if args.tolerance:
+        stopping = online_stats.SequentialStopping(online_stats.parse_tolerances(args.tolerance), args.nb_iterations,
+                                                   args.max_iterations, args.confidence)
+    keys, nb_iterations = run_replicates(parameters, output_filename, args.nb_iterations, master_seed, args.ensemble,
+                                         args.workers, cache, args.profile, topology_cache, args.checkpoint_interval,
+                                         args.record_agents, stopping)
     """Save the results."""
     logger.info('Successfully finished simulation. Copy %s ...', str(parameter_filename))
     src_param = parameter_filename
     dst_param = 'output/' + parameter_filename[15:]
     shutil.copy(src_param, dst_param)
     """Analyze the results."""
+    analysis_key = cache.analysis_key(parameters, keys, args.figure_format) if cache is not None else None
+    if analysis_key is not None and cache.analysis_is_current(output_filename, analysis_key):
+        logger.warning('Results and analysis code unchanged, analysis of %s skipped.', str(output_filename))
+        return
     logger.info('completed. Now calling analyze file...')
-    analyze_call = 'python analyze.py ' + str(iteration) + ' ' + str(output_filename) + ' ' + str(dst_param) + ' ' + str(1)
-    print(analyze_call)
-    subprocess.call(analyze_call, shell=True)
+    """The analysis runs in this process. It is only imported here, as matplotlib takes a while to load."""
+    import analyze
+    try:
+        outputs = analyze.analyze(nb_iterations + 1, output_filename, dst_param, 1, args.figure_format)
+    except Exception:
+        logger.exception('Analysis of %s failed.', str(output_filename))
+        return
+    if analysis_key is not None:
+        cache.mark_analyzed(output_filename, analysis_key, outputs)
     logger.info('Completed. Find the results in %s and the figures in the corresp sub-folder.', str(output_filename))
 
 if __name__ == '__main__':
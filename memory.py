@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+The retrospective memory of the farmers. It keeps the payoffs of the last rounds that enter the decisions of the
+farmers. Is used from engine.py.
+"""
+import numpy as np
+
+__author__ = "Claudius Graebner"
+__email__ = "graebnerc@uni-bremen.de"
+
+
+class RetrospectiveMemory:
+    """
+    Rolling window over the last |k| payoffs of every farmer, where k is the parameter 'retrospective_memory'.
+
+    The payoffs are stored in a ring buffer of fixed size together with their running sum, so adding a payoff and
+    computing the window means costs O(1) per farmer and memory is bounded by k. The window starts with the initial
+    payoff of 0.0 and contains fewer than |k| payoffs in the first rounds, just as the slice wealth[k:] of a list.
+    A memory of k=0 considers all payoffs received so far and only keeps their sum.
+    """
+    def __init__(self, retrospective_memory, shape):
+        """
+        Parameters
+        ----------
+        retrospective_memory : int
+            The (non-positive) parameter k. The last |k| payoffs are considered.
+
+        shape : tuple of int
+            The shape of the payoff arrays, usually (number_of_farmers,).
+        """
+        assert retrospective_memory <= 0, \
+            "Retrospective memory should be non-positive but is {}.".format(retrospective_memory)
+        self.__size = -retrospective_memory
+        self.__sums = np.zeros(shape)
+        self.__latest = np.zeros(shape)
+        self.__count = 1
+        if self.__size > 0:
+            self.__buffer = np.zeros((self.__size,) + tuple(shape))
+            self.__position = 1 % self.__size
+        else:
+            self.__buffer = None
+            self.__position = 0
+
+    def add(self, payoffs):
+        """
+        Adds the payoffs of the current round. The oldest payoff leaves the window once it is full.
+        """
+        self.__latest = payoffs
+        if self.__buffer is None:
+            self.__sums += payoffs
+            self.__count += 1
+            return
+        if self.__count == self.__size:
+            self.__sums -= self.__buffer[self.__position]
+        else:
+            self.__count += 1
+        self.__buffer[self.__position] = payoffs
+        self.__sums += payoffs
+        self.__position = (self.__position + 1) % self.__size
+        if self.__position == 0:
+            """Recompute the sums once per cycle so that rounding errors cannot accumulate."""
+            self.__buffer.sum(axis=0, out=self.__sums)
+
+    def means(self):
+        """Returns the average payoff over the window."""
+        return self.__sums / self.__count
+
+    def window(self):
+        """
+        Returns the payoffs in the window in chronological order with one row per round. For k=0 only the last
+        payoffs are kept.
+        """
+        if self.__buffer is None:
+            return self.__latest[np.newaxis]
+        rows = (self.__position - self.__count + np.arange(self.__count)) % self.__size
+        return self.__buffer[rows]
+
+    def take(self, indices):
+        """
+        Keeps the memories at the given positions of the last axis in this order and drops the others. A position may
+        be given several times. Is used to split and merge groups of farmers, see aggregate.py.
+        """
+        self.__sums = self.__sums[..., indices]
+        self.__latest = np.asarray(self.__latest)[..., indices]
+        if self.__buffer is not None:
+            self.__buffer = self.__buffer[..., indices]
+
+    def pool(self, groups, weights):
+        """
+        Replaces the memories along the last axis by the weighted averages of the memories with the same group, where
+        group g becomes the memory at position g. Is used to merge groups of farmers, see aggregate.py.
+        """
+        shares = np.zeros((groups.max() + 1, len(groups)))
+        shares[groups, np.arange(len(groups))] = weights
+        shares /= shares.sum(axis=1, keepdims=True)
+        self.__sums = self.__sums @ shares.T
+        self.__latest = np.asarray(self.__latest) @ shares.T
+        if self.__buffer is not None:
+            self.__buffer = self.__buffer @ shares.T
+
+    def state(self):
+        """Returns the state of the memory as dict of arrays, see restore()."""
+        state = {'sums': self.__sums, 'latest': np.asarray(self.__latest), 'count': self.__count,
+                 'position': self.__position}
+        if self.__buffer is not None:
+            state['buffer'] = self.__buffer
+        return state
+
+    def restore(self, state):
+        """Sets the memory to a state returned by state()."""
+        self.__sums = np.array(state['sums'], dtype=float)
+        self.__latest = np.array(state['latest'], dtype=float)
+        self.__count = int(state['count'])
+        self.__position = int(state['position'])
+        if self.__buffer is not None:
+            self.__buffer = np.array(state['buffer'], dtype=float)
+
+    @property
+    def size(self):
+        return self.__size
+
+    @property
+    def count(self):
+        return self.__count
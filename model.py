@@ -1,20 +1,39 @@
 #!/usr/bin/env python3
 """
 The file with the main experiment instance. It is called from the main file for every overall iteration of the model.
+
+pandas and the result store are only imported when results are converted or saved, so that a worker process that
+only simulates does not load them.
 """
+import hashlib
 import json
 import logging
+import os
+import time
+
 import numpy as np
-import pandas as pd
 
+import agent_recorder
+import aggregate
+import engine
+import farmer
 import population_generator
+import random_variates
+import reporting
+import result_cache
+import timing
 
 __author__ = "Claudius Graebner"
 __mail__ = "graebnerc@uni-bremen.de"
 
+logger = logging.getLogger(__name__)
+
+RESULT_VARIABLES = ("Total_return", "Returns_P", "Returns_NP", "Returns_P_pc", "Returns_NP_pc", "Share_P", "Share_NP")
+
 
 class Model:
-    def __init__(self, parameters, output_filename, ident):
+    def __init__(self, parameters, output_filename, ident, seed=None, nb_replicates=1, statistics=None, profile=False,
+                 topology_cache=None, checkpoint_interval=None, record_agents=None):
         """
         Initiates a model instance.
 
@@ -27,31 +46,42 @@ class Model:
             Provide the path to the file in which output should be stored excluding ending.
 
         ident : int
-            Number of the iteration.
+            Number of the iteration. With several replicates, the number of the first one.
+
+        seed : int, numpy.random.SeedSequence, list of those or None
+            The seed for all random draws of the run. If None, fresh entropy is used. With several replicates, either
+            one seed per replicate or a single seed from which the seeds of the replicates are spawned.
+
+        nb_replicates : int
+            The number of replicates that are simulated together. Every replicate has its own network and its own
+            stream of random draws, and is saved under its own number starting with ident.
+
+        statistics : online_stats.OnlineStatistics or None
+            If given, the state variables of every replicate are added to it as soon as they are recorded.
+
+        profile : bool
+            If True, the wall time and the number of calls of every phase of the run are recorded per time step, see
+            get_timings().
+
+        topology_cache : result_cache.TopologyCache or None
+            If given, the networks of the replicates are taken from this cache or stored there.
+
+        checkpoint_interval : int or None
+            If given, the state of the run is saved every checkpoint_interval time steps, and a run that was
+            interrupted continues from its last checkpoint, see run().
+
+        record_agents : str or None
+            If 'full' or 'switches', the seeds and incomes of every farmer are written to disk as the run goes, see
+            agent_recorder. The files are named [output_filename]_agents_[ident].
 
         Timing
         ------
-        1. Set the loggers for the experiment.
-        2. Read in the parameter file.
-        3. Set up the experiment specification.
-        4. Set up the state variables for tracking simulation results.
-        """
-
-        """Set loggers."""
-        logging_filename = output_filename + '.log'
-        global logger
-        logger = logging.getLogger(__name__)
-        logger.setLevel(logging.WARNING)
-        logger.handlers = []
-        terminal_handler = logging.StreamHandler()
-        terminal_handler.setLevel(logging.WARNING)
-        file_handler = logging.FileHandler(filename=logging_filename)
-        file_handler.setLevel(logging.WARNING)
-        standard_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        terminal_handler.setFormatter(standard_formatter)
-        file_handler.setFormatter(standard_formatter)
-        logger.addHandler(terminal_handler)
-        logger.addHandler(file_handler)
+        1. Read in the parameter file.
+        2. Set up the experiment specification.
+        3. Set up the state variables for tracking simulation results.
+
+        The model only logs to its logger. Where the records go is set up by the caller, see reporting.LogPipeline.
+        """
 
         """Read in parameter file"""
         if type(parameters) == dict:
@@ -71,31 +101,104 @@ class Model:
         self.__ident = ident
         self.__outputfile_name = output_filename
         self.__timestep = 0
-        self.__pop_generator = population_generator.PopulationGenerator(self.__parameters, logging_filename, self)
-        self.__agents = self.__pop_generator.get_agents()
+        self.__nb_replicates = nb_replicates
+        start = time.perf_counter()
+        replicate_seeds = self.replicate_seeds(seed, nb_replicates)
+        self.__replicate_seeds = replicate_seeds
+        simulation = self.__parameters.get('simulation', 'agents')
+        assert simulation in aggregate.SIMULATIONS, \
+            "Simulation should be one of {} but is {}.".format(aggregate.SIMULATIONS, simulation)
+        initial_seeds, networks, self.__random = [], [], []
+        for replicate_seed in replicate_seeds:
+            network_seed, random_seed = random_variates.spawn_seeds(replicate_seed, 2)
+            if simulation == 'agents':
+                pop_generator = population_generator.PopulationGenerator(self.__parameters, self,
+                                                                         int(network_seed.generate_state(1)[0]),
+                                                                         topology_cache)
+                initial_seeds.append(pop_generator.get_initial_seeds())
+                networks.append(pop_generator.get_network())
+            self.__random.append(random_variates.RandomVariates(self.__parameters, random_seed))
+        if simulation == 'aggregate':
+            """Only the numbers of farmers alike are tracked, so there are neither single farmers nor a network."""
+            assert record_agents is None, "The farmers cannot be recorded in the aggregate simulation."
+            self.__engine = aggregate.AggregateEngine(self.__parameters, self.__random)
+        else:
+            network = networks[0] if nb_replicates == 1 else type(networks[0]).combine(networks)
+            self.__engine = engine.PopulationEngine(self.__parameters, initial_seeds, network, self.__random)
 
-        """State variables for tracking results."""
-        self.__total_return = []
-        self.__returns_P = []
-        self.__returns_NP = []
-        self.__share_P =[]
-        self.__share_NP = []
-        self.__returns_NP_pc = []
-        self.__returns_P_pc = []
+        """Time the phases of the run if requested."""
+        self.__timer = None
+        if profile:
+            self.__timer = timing.PhaseTimer()
+            self.__timer.add('setup', time.perf_counter() - start)
+            self.__timer.instrument(self.__engine, {'decision_basis': 'mean_NP', 'choose_seeds': 'choose_seeds',
+                                                    'receive_incomes': 'receive_incomes', 'converged': 'convergence'})
+            self.__timer.instrument(self, {'log_progress': 'logging', 'record': 'record',
+                                           'fast_forward': 'fast_forward'})
 
-    def run(self):
+        """State variables for tracking results: one row per time step, one column per entry in RESULT_VARIABLES
+        and one such table per replicate."""
+        self.__results = np.zeros((nb_replicates, self.__parameters["number_of_timesteps"] + 1,
+                                   len(RESULT_VARIABLES)))
+        self.__nb_records = 0
+        self.__statistics = statistics
+        self.__convergence_steps = np.full(nb_replicates, -1)
+        self.__progress = None
+        self.__checkpoint_interval = checkpoint_interval
+        self.__recorder = None
+        if record_agents is not None:
+            self.__recorder = agent_recorder.AgentRecorder(self.agents_filename(), record_agents, nb_replicates,
+                                                           self.__engine.nb_agents,
+                                                           self.__parameters["number_of_timesteps"])
+
+    def run(self, save=True):
         """
-        Runs the model for the specified number of time steps. At the end it saves the output.
+        Runs the model for the specified number of time steps. At the end it saves the output, unless save is False.
+
+        As soon as the states of all replicates cannot change any more, the remaining time steps are filled with the
+        last recorded state and the run stops early. The time step at which a replicate converged is recorded.
+
+        With a checkpoint interval, the run starts from the checkpoint of an interrupted run of the same iteration, if
+        there is one, and the results are the same as without interruption. The checkpoint is removed at the end.
         """
         params = self.__parameters
-        self.record()
-        for i in range(0, params["number_of_timesteps"]):
-            self.__timestep = i
-            logger.warning('Iteration %s: round %s of %s for file %s.',
-                           str(self.__ident), str(self.__timestep), str(params['number_of_timesteps'] - 1),
-                           self.__outputfile_name)
-            self.update(i)
-        self.save_data()
+        self.__progress = reporting.ProgressReporter('Iteration {} of {}'.format(
+            self.iteration_label(), self.__outputfile_name), params["number_of_timesteps"] * self.__nb_replicates)
+        first_step = 0
+        if self.__checkpoint_interval is not None and self.load_checkpoint():
+            first_step = self.__timestep + 1
+            logger.warning('Iteration %s resumed from its checkpoint after time step %s.', self.iteration_label(),
+                           self.__timestep)
+            if self.__recorder is not None:
+                self.__recorder.start(self.__nb_records, self.__engine.seeds)
+        else:
+            if self.__recorder is not None:
+                self.__recorder.start()
+            self.record()
+        try:
+            for i in range(first_step, params["number_of_timesteps"]):
+                self.__timestep = i
+                if self.__timer is not None:
+                    self.__timer.step(i)
+                self.update(i)
+                self.log_progress()
+                converged = self.__engine.converged()
+                self.__convergence_steps[converged & (self.__convergence_steps < 0)] = self.__nb_records - 1
+                if converged.all():
+                    self.fast_forward()
+                    break
+                if self.__checkpoint_interval is not None and (i + 1) % self.__checkpoint_interval == 0:
+                    self.save_checkpoint()
+        finally:
+            """Write the agent recording up to the interruption, if any, a resumed run replaces the extra steps."""
+            if self.__recorder is not None:
+                self.__recorder.close()
+        if self.__timer is not None:
+            self.__timer.step(timing.SETUP_STEP)
+        if save:
+            self.save_data()
+        if self.__checkpoint_interval is not None and os.path.isfile(self.checkpoint_filename()):
+            os.remove(self.checkpoint_filename())
 
     def update(self, i):
         """
@@ -108,56 +211,215 @@ class Model:
         2. Then agents choose the type of seed they want to use.
         3. Finally they receivy their income.
         4. At the end of every time step, the relevant variables are recorded.
+
+        Steps 1 to 3 are carried out for the whole population at once by the population engine.
         """
-        agents_NP = [f for f in self.__agents if f.seed == 1]
-        if i == 0:
-            mean_NP = self.__parameters["fix_return_P"] - self.__parameters["yearly_cost_P"]
-        else:
-            mean_NP = np.mean([np.mean(f.get_wealth()[self.__parameters["retrospective_memory"]:]) for f in agents_NP])
-        for f in self.__agents:
-            f.choose_seed(mean_NP)  # TODO might be effect of activation sequence
-            f.receive_income(len(agents_NP))
+        self.__engine.update(i)
         self.record()
 
+    def log_progress(self):
+        """Counts the current time step of all replicates for the progress reports."""
+        self.__progress.advance(self.__nb_replicates)
+
     def record(self):
         """
-        Records the state variables of interest at the end of each time step.
-        """
-        self.__total_return.append(sum([f.get_wealth()[-1] for f in self.__agents]))
-        agents_P = [f for f in self.__agents if f.seed == 0]
-        agents_NP = [f for f in self.__agents if f.seed == 1]
-        assert len(agents_P) + len(agents_NP) == len(self.__agents), \
-            "Sum of different agent types should be {} but is {}.".format(
-                len(self.__agents), (len(agents_P) + len(agents_NP)))
-        self.__returns_P.append(sum([f.get_wealth()[-1] for f in agents_P]))
-        self.__returns_NP.append(sum([f.get_wealth()[-1] for f in agents_NP]))
-        self.__share_P.append(float(len(agents_P)) / len(self.__agents))
-        self.__share_NP.append(1.0 - self.__share_P[-1])
-        if len(agents_P) > 0:
-            self.__returns_P_pc.append(self.__returns_P[-1] / len(agents_P))
-        else:
-            self.__returns_P_pc.append(0.0)
-        if len(agents_NP) > 0:
-            self.__returns_NP_pc.append(self.__returns_NP[-1] / len(agents_NP))
-        else:
-            self.__returns_NP_pc.append(0.0)
+        Records the state variables of interest at the end of each time step for every replicate.
+        """
+        nb_agents = self.__engine.nb_agents
+        nb_NP, returns_P, returns_NP = self.__engine.totals()
+        nb_P = nb_agents - nb_NP
+        rows = self.__results[:, self.__nb_records]
+        rows[:, 0] = returns_P + returns_NP
+        rows[:, 1] = returns_P
+        rows[:, 2] = returns_NP
+        np.divide(returns_P, nb_P, out=rows[:, 3], where=nb_P > 0)
+        np.divide(returns_NP, nb_NP, out=rows[:, 4], where=nb_NP > 0)
+        rows[:, 5] = nb_P / nb_agents
+        rows[:, 6] = 1.0 - rows[:, 5]
+        if self.__statistics is not None:
+            self.__statistics.add(self.__nb_records, rows)
+        if self.__recorder is not None:
+            self.__recorder.record(self.__nb_records, self.__engine.seeds, self.__engine.incomes)
+        self.__nb_records += 1
+
+    def fast_forward(self):
+        """
+        Fills the remaining time steps with the last recorded state.
+        """
+        logger.warning('Iteration %s converged at time step %s, skipping the remaining %s time steps.',
+                       self.iteration_label(), str(self.__nb_records - 1),
+                       str(self.__results.shape[1] - self.__nb_records))
+        last = self.__results[:, self.__nb_records - 1]
+        for timestep in range(self.__nb_records, self.__results.shape[1]):
+            self.__results[:, timestep] = last
+            if self.__statistics is not None:
+                self.__statistics.add(timestep, last)
+        if self.__recorder is not None:
+            self.__recorder.fill(self.__nb_records)
+        self.__nb_records = self.__results.shape[1]
 
     def save_data(self):
         """
         Saves the results in a pandas data frame and stores data in hd5 format.
         """
-        results_data = pd.DataFrame.from_items((["Total_return", self.__total_return],
-                                                ["Returns_P", self.__returns_P],
-                                                ["Returns_NP", self.__returns_NP],
-                                                ["Returns_P_pc", self.__returns_P_pc],
-                                                ["Returns_NP_pc", self.__returns_NP_pc],
-                                                ["Share_P", self.__share_P],
-                                                ["Share_NP", self.__share_NP]))
-        data_name = self.__outputfile_name + "_data.h5"
-        data_identification = "data_" + format(self.__ident, '03d')
-        store = pd.HDFStore(data_name)
-        store[data_identification] = results_data
-        store.close()
-
-    def get_agents(self):
-        return self.__agents
+        import result_store
+        start = time.perf_counter()
+        with result_store.ResultStore(self.__outputfile_name) as store:
+            for replicate in range(self.__nb_replicates):
+                store.append(self.__ident + replicate, results_frame(self.get_results(replicate)),
+                             convergence_step=self.get_convergence_step(replicate))
+            store.flush()
+            if self.__timer is not None:
+                self.__timer.add('save_data', time.perf_counter() - start)
+                store.write_timings(self.__ident, self.get_timings(), self.__nb_replicates)
+
+    def checkpoint_filename(self):
+        """Returns the file of the checkpoint of this iteration."""
+        return '{}_checkpoint_{}.npz'.format(self.__outputfile_name, self.iteration_label())
+
+    def checkpoint_fingerprint(self):
+        """
+        Returns a hash of everything that determines the run besides its state: the parameters, the seeds of the
+        replicates, the number of the iteration and the code of the model.
+        """
+        content = json.dumps([self.__parameters, [result_cache.canonical_seed(s) for s in self.__replicate_seeds],
+                              self.__ident, result_cache.code_version(result_cache.SIMULATION_MODULES)],
+                             sort_keys=True)
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def save_checkpoint(self, filename=None):
+        """
+        Saves the state of the run after the current time step: the state of the engine with the seeds, incomes,
+        memories and random streams of all farmers, and the results recorded so far. The file is replaced atomically,
+        see result_cache.save_atomically(), so an interruption while saving leaves the previous checkpoint intact.
+        """
+        filename = self.checkpoint_filename() if filename is None else filename
+        if self.__recorder is not None:
+            """The checkpoint must not be ahead of the recording of the farmers."""
+            self.__recorder.flush()
+        state = {'engine_' + key: value for key, value in self.__engine.state().items()}
+        state.update(fingerprint=self.checkpoint_fingerprint(), timestep=self.__timestep,
+                     nb_records=self.__nb_records, convergence_steps=self.__convergence_steps,
+                     results=self.__results[:, :self.__nb_records])
+        result_cache.save_atomically(filename, lambda f: np.savez(f, **state))
+
+    def load_checkpoint(self, filename=None):
+        """
+        Sets the run to the state saved by save_checkpoint(). Returns False if there is no checkpoint, or if it was
+        saved by a run with other parameters, seeds or model code, in which case it is ignored.
+
+        The recorded results are added to the statistics again, as they were lost with the interrupted run.
+        """
+        filename = self.checkpoint_filename() if filename is None else filename
+        if not os.path.isfile(filename):
+            return False
+        with np.load(filename) as checkpoint:
+            if str(checkpoint['fingerprint']) != self.checkpoint_fingerprint():
+                logger.warning('Checkpoint %s belongs to another run and is ignored.', filename)
+                return False
+            self.__engine.restore({key[len('engine_'):]: checkpoint[key] for key in checkpoint.files
+                                   if key.startswith('engine_')})
+            self.__timestep = int(checkpoint['timestep'])
+            self.__nb_records = int(checkpoint['nb_records'])
+            self.__convergence_steps = checkpoint['convergence_steps'].copy()
+            self.__results[:, :self.__nb_records] = checkpoint['results']
+        if self.__statistics is not None:
+            for timestep in range(self.__nb_records):
+                self.__statistics.add(timestep, self.__results[:, timestep])
+        self.__progress.advance(self.__nb_replicates * (self.__timestep + 1))
+        return True
+
+    def agents_filename(self):
+        """Returns the path of the files of the agent recording of this iteration, excluding the endings."""
+        return '{}_agents_{}'.format(self.__outputfile_name, self.iteration_label())
+
+    def iteration_label(self):
+        """Returns the number of the iteration, or the range of iterations if several replicates are simulated."""
+        if self.__nb_replicates == 1:
+            return str(self.__ident)
+        return "{}-{}".format(self.__ident, self.__ident + self.__nb_replicates - 1)
+
+    @staticmethod
+    def replicate_seeds(seed, nb_replicates):
+        """
+        Returns one numpy.random.SeedSequence per replicate.
+
+        A list of seeds is used as is. A single seed (or None for fresh entropy) is used directly for a single
+        replicate and spawns the seeds of the replicates otherwise.
+        """
+        if isinstance(seed, (list, tuple)):
+            assert len(seed) == nb_replicates, \
+                "Seeds given for {} but model has {} replicates.".format(len(seed), nb_replicates)
+            return [s if isinstance(s, np.random.SeedSequence) else np.random.SeedSequence(s) for s in seed]
+        if nb_replicates == 1:
+            return [seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)]
+        return random_variates.spawn_seeds(seed, nb_replicates)
+
+    def get_agents(self, replicate=0):
+        """Returns a view on every farmer of the population of the given replicate."""
+        assert isinstance(self.__engine, engine.PopulationEngine), \
+            "There are no single farmers in the aggregate simulation."
+        return [farmer.Farmer(i, self.__engine, replicate) for i in range(self.__engine.nb_agents)]
+
+    def get_convergence_step(self, replicate=0):
+        """Returns the time step at which the state of a replicate was found to be final, or None."""
+        step = int(self.__convergence_steps[replicate])
+        return step if step >= 0 else None
+
+    def get_timings(self):
+        """
+        Returns the timings of the run as list of (step, phase, seconds, calls), or None if the run is not profiled.
+        With several replicates, the timings cover all of them together.
+        """
+        return self.__timer.records() if self.__timer is not None else None
+
+    def get_results(self, replicate=0):
+        """Returns the recorded state variables of a replicate with one row per time step recorded so far."""
+        return self.__results[replicate, :self.__nb_records]
+
+
+def results_frame(results):
+    """
+    Returns the recorded state variables of one replicate as pd.DataFrame with one column per variable.
+    """
+    import pandas as pd
+    return pd.DataFrame(results, columns=list(RESULT_VARIABLES))
+
+
+def save_results(output_filename, ident, results, master_seed=None, convergence_step=None):
+    """
+    Stores the results of one replicate in hd5 format in the result store of the specification.
+
+    Parameters
+    ----------
+    output_filename : str
+        The path to the output file excluding ending.
+
+    ident : int
+        Number of the iteration.
+
+    results : array of float
+        The recorded state variables with one row per time step and one column per entry in RESULT_VARIABLES.
+
+    master_seed : int or None
+        The master seed from which the seed of the replicate was spawned. Stored together with the data.
+
+    convergence_step : int or None
+        The time step at which the state of the replicate was found to be final, if any.
+    """
+    import result_store
+    with result_store.ResultStore(output_filename) as store:
+        store.append(ident, results_frame(results), master_seed, convergence_step)
+
+
+def run_replicate(parameters, output_filename, ident, seed, profile=False, topology_cache=None,
+                  checkpoint_interval=None, record_agents=None):
+    """
+    Runs a single iteration of the model and returns its results, its convergence step and its timings (None unless
+    profile is True) without saving them. Is called in the worker processes, so that only the main process writes to
+    the data file.
+    """
+    m = Model(parameters, output_filename, ident, seed=seed, profile=profile, topology_cache=topology_cache,
+              checkpoint_interval=checkpoint_interval, record_agents=record_agents)
+    m.run(save=False)
+    return m.get_results(), m.get_convergence_step(), m.get_timings()
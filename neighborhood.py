@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+The average payoffs of the NP neighbors of every farmer, on which the farmers base their decisions in the cases B and
+C, and the scheduling of incremental updates. Is used from engine.py.
+"""
+import numpy as np
+
+__author__ = "Claudius Graebner"
+__email__ = "graebnerc@uni-bremen.de"
+
+FULL_UPDATE_SHARE = 0.05
+MAX_SKIPPED_CHECKS = 16
+
+
+class ChangeCheck:
+    """
+    Decides whether it is worth looking for the changes since the last update, or whether everything should be
+    computed again right away.
+
+    Looking for changes costs a few passes over the population. After a look found too many changes, the next
+    1, 2, 4, ... up to MAX_SKIPPED_CHECKS looks are skipped, so that the looks cost little while the whole
+    population keeps changing, e.g. with random NP returns, and the updates become incremental soon after it settled.
+    """
+    def __init__(self):
+        self.__skipped = 1
+        self.__to_skip = 0
+
+    def due(self):
+        """Returns True if the changes should be looked for in this update."""
+        if self.__to_skip > 0:
+            self.__to_skip -= 1
+            return False
+        return True
+
+    def found(self, few):
+        """Records whether the last look found few enough changes for an incremental update."""
+        if few:
+            self.__skipped = 1
+        else:
+            self.__to_skip = self.__skipped
+            self.__skipped = min(2 * self.__skipped, MAX_SKIPPED_CHECKS)
+
+    def reset(self):
+        """Looks for changes again from the next update on."""
+        self.__skipped = 1
+        self.__to_skip = 0
+
+
+class NeighborhoodMeans:
+    """
+    Average window mean of the NP neighbors of every farmer, updated incrementally.
+
+    The sums and numbers of NP neighbors of the last update are kept. Only the farmers whose seed or window mean
+    changed since then, the changed farmers, are looked at, and only the neighborhoods containing one of them are
+    summed up again. So an update costs in proportion to the changes, and little once most farmers have settled.
+    The neighborhoods are always summed up completely and in the same order, so the means are bit for bit the same as
+    those of a full update. If more than a share full_update_share of the farmers changed, all neighborhoods are
+    summed up at once, which is faster then.
+    """
+    def __init__(self, network, full_update_share=FULL_UPDATE_SHARE):
+        """
+        Parameters
+        ----------
+        network : topology.NetworkTopology or topology.LatticeTopology
+            The neighborhoods of all farmers.
+
+        full_update_share : float
+            The share of changed farmers above which all neighborhoods are summed up again.
+        """
+        self.__network = network
+        self.__full_update_share = full_update_share
+        self.__mask = None
+        self.__values = None
+        self.__sums = None
+        self.__counts = None
+        self.__means = None
+        self.__check = ChangeCheck()
+
+    def update(self, seeds, window_means):
+        """
+        Returns for every farmer the average window mean of the neighbors that currently use the NP seed, as flat
+        array with NaN for farmers without any NP neighbor.
+
+        The array is updated in place by the next call, so it must be copied to be kept.
+        """
+        mask = seeds.ravel().astype(float)
+        values = mask * window_means.ravel()
+        if self.__means is None or not self.__check.due():
+            self.update_all(mask, values)
+            return self.__means
+        changed = (values != self.__values) | (mask != self.__mask)
+        nb_changed = np.count_nonzero(changed)
+        self.__check.found(nb_changed <= self.__full_update_share * len(mask))
+        if nb_changed > self.__full_update_share * len(mask):
+            self.update_all(mask, values)
+            return self.__means
+        self.__mask, self.__values = mask, values
+        if nb_changed == 0:
+            return self.__means
+        changed = np.flatnonzero(changed)
+        dirty = np.zeros(len(mask), dtype=bool)
+        dirty[self.__network.neighbors_of_agents(changed)] = True
+        dirty = np.flatnonzero(dirty)
+        sums = self.__network.neighbor_sums_of(values, dirty)
+        counts = self.__network.neighbor_sums_of(mask, dirty)
+        means = np.full(len(dirty), np.nan)
+        np.divide(sums, counts, out=means, where=counts > 0)
+        self.__sums[dirty] = sums
+        self.__counts[dirty] = counts
+        self.__means[dirty] = means
+        return self.__means
+
+    def update_all(self, mask, values):
+        """Sums up all neighborhoods for the given NP mask and masked window means."""
+        self.__mask, self.__values = mask, values
+        self.__sums = self.__network.neighbor_sums(values)
+        self.__counts = self.__network.neighbor_sums(mask)
+        self.__means = np.full(len(mask), np.nan)
+        np.divide(self.__sums, self.__counts, out=self.__means, where=self.__counts > 0)
+
+    def clear(self):
+        """Forgets the last update, so that the next one sums up all neighborhoods."""
+        self.__means = None
+        self.__check.reset()
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+Streaming statistics over the iterations of a specification. The results of every iteration are added as soon as they
+are available, so the summary statistics needed for the analysis are ready right after the simulation and the
+memory does not depend on the number of iterations.
+"""
+import collections
+
+import numpy as np
+import pandas as pd
+
+__author__ = "Claudius Graebner"
+__email__ = "graebnerc@uni-bremen.de"
+
+STATS_OF_INTEREST = ("mean", "sd", "10% quant", "90% quant")
+DEFAULT_CONFIDENCE = 0.95
+DEFAULT_MAX_ITERATIONS = 1000
+
+
+class P2Quantile:
+    """
+    The P-square estimator for a quantile (Jain and Chlamtac, 1985), applied elementwise to arrays.
+
+    The first observations are kept, so that the quantile is exact (with linear interpolation as in np.percentile)
+    for up to exact_size observations. Beyond that, five markers per entry track the minimum, the p/2, p and (1+p)/2
+    quantiles and the maximum, so the memory does not grow with the number of observations. The estimate is then
+    approximate: the share of observations below it is typically off by about 0.01 and at most by 0.1, see
+    tests/test_online_stats.py.
+    """
+    def __init__(self, p, shape, exact_size=100):
+        """
+        Parameters
+        ----------
+        p : float
+            The quantile, between 0 and 1.
+
+        shape : tuple of int
+            The shape of the observations.
+
+        exact_size : int
+            The number of observations that are kept before switching to the markers, at least 20.
+        """
+        assert exact_size >= 20, "At least 20 observations should be kept but exact_size is {}.".format(exact_size)
+        shape = tuple(shape)
+        self.__p = p
+        self.__fractions = np.array([0.0, p / 2, p, (1 + p) / 2, 1.0])
+        self.__exact_size = exact_size
+        self.__counts = np.zeros(shape, dtype=np.int64)
+        self.__observations = np.zeros((exact_size,) + shape)
+        self.__heights = np.zeros((5,) + shape)
+        self.__positions = np.zeros((5,) + shape)
+
+    def add(self, x, index=Ellipsis):
+        """
+        Adds one observation for every entry. With index, only the selected entries are updated, which must all have
+        received the same number of observations before.
+        """
+        x = np.asarray(x, dtype=float)
+        selection = (slice(None),) + (index if isinstance(index, tuple) else (index,))
+        heights = self.__heights[selection]
+        positions = self.__positions[selection]
+        counts = self.__counts[index]
+        count = int(np.min(counts))
+        assert np.all(counts == count), "Entries have received different numbers of observations."
+        self.__counts[index] += 1
+        if count < self.__exact_size:
+            observations = self.__observations[selection]
+            observations[count] = x
+            if count + 1 == self.__exact_size:
+                """Place the markers on the sorted observations."""
+                marker_positions = 1 + np.round(count * self.__fractions).astype(int)
+                heights[...] = np.sort(observations, axis=0)[marker_positions - 1]
+                positions[...] = marker_positions.reshape((5,) + (1,) * x.ndim)
+            return
+        """Find the cell of x and update the extreme markers."""
+        heights[0] = np.minimum(heights[0], x)
+        heights[4] = np.maximum(heights[4], x)
+        cell = (x >= heights[1:4]).sum(axis=0)
+        positions[1:] += np.arange(1, 5).reshape((4,) + (1,) * x.ndim) > cell
+        desired = 1 + count * self.__fractions
+        """Adjust the heights of the three middle markers."""
+        for i in (1, 2, 3):
+            d = desired[i] - positions[i]
+            move_up = (d >= 1) & (positions[i + 1] - positions[i] > 1)
+            move_down = (d <= -1) & (positions[i - 1] - positions[i] < -1)
+            sign = np.where(move_up, 1.0, np.where(move_down, -1.0, 0.0))
+            if not sign.any():
+                continue
+            q_left, q_mid, q_right = heights[i - 1], heights[i], heights[i + 1]
+            n_left, n_mid, n_right = positions[i - 1], positions[i], positions[i + 1]
+            parabolic = q_mid + sign / (n_right - n_left) * (
+                (n_mid - n_left + sign) * (q_right - q_mid) / (n_right - n_mid) +
+                (n_right - n_mid - sign) * (q_mid - q_left) / (n_mid - n_left))
+            linear = np.where(sign > 0, q_mid + (q_right - q_mid) / (n_right - n_mid),
+                              q_mid - (q_left - q_mid) / (n_left - n_mid))
+            use_parabolic = (q_left < parabolic) & (parabolic < q_right)
+            heights[i] = np.where(sign != 0, np.where(use_parabolic, parabolic, linear), q_mid)
+            positions[i] += sign
+
+    def quantile(self):
+        """
+        Returns the estimated quantile for every entry (NaN for entries without observations).
+        """
+        estimate = self.__heights[2].copy()
+        for count in np.unique(self.__counts[self.__counts <= self.__exact_size]):
+            few = self.__counts == count
+            if count == 0:
+                estimate[few] = np.nan
+            else:
+                estimate[few] = np.percentile(self.__observations[:count][:, few], 100 * self.__p, axis=0)
+        return estimate
+
+
+class OnlineStatistics:
+    """
+    Mean, standard deviation and the 10% and 90% quantiles of every state variable at every time step over all
+    iterations added so far.
+
+    Mean and variance are updated with the algorithm of Welford, the quantiles with the P-square estimator. The
+    standard deviation is the one of the population, as in np.std.
+    """
+    def __init__(self, variables, nb_timesteps):
+        """
+        Parameters
+        ----------
+        variables : list of str
+            The names of the state variables, i.e. the columns of the results.
+
+        nb_timesteps : int
+            The number of recorded time steps, i.e. the rows of the results.
+        """
+        self.__variables = list(variables)
+        shape = (nb_timesteps, len(self.__variables))
+        self.__counts = np.zeros(nb_timesteps, dtype=np.int64)
+        self.__means = np.zeros(shape)
+        self.__squares = np.zeros(shape)
+        self.__quantiles = (P2Quantile(0.1, shape), P2Quantile(0.9, shape))
+
+    def add(self, timestep, values):
+        """
+        Adds the values of the state variables at one time step for one or several iterations.
+
+        Parameters
+        ----------
+        timestep : int
+            The time step.
+
+        values : array of float with shape (variables,) or (iterations, variables)
+            The values of the state variables.
+        """
+        for row in np.array(values, dtype=float, ndmin=2):
+            self.__counts[timestep] += 1
+            delta = row - self.__means[timestep]
+            self.__means[timestep] += delta / self.__counts[timestep]
+            self.__squares[timestep] += delta * (row - self.__means[timestep])
+            for estimator in self.__quantiles:
+                estimator.add(row, timestep)
+
+    def add_run(self, results):
+        """
+        Adds all time steps of one iteration.
+
+        Parameters
+        ----------
+        results : array of float with shape (timesteps, variables)
+            The recorded state variables of the iteration.
+        """
+        results = np.asarray(results, dtype=float)
+        assert results.shape == self.__means.shape, \
+            "Results should have shape {} but have {}.".format(self.__means.shape, results.shape)
+        assert np.all(self.__counts == self.__counts[0]), "Time steps have received different numbers of iterations."
+        self.__counts += 1
+        delta = results - self.__means
+        self.__means += delta / self.__counts[:, np.newaxis]
+        self.__squares += delta * (results - self.__means)
+        for estimator in self.__quantiles:
+            estimator.add(results)
+
+    def confidence_half_widths(self, timestep=-1, confidence=DEFAULT_CONFIDENCE):
+        """
+        Returns the half widths of the confidence intervals of the means of all state variables at one time step,
+        from the t-distribution with the standard deviation of the sample. Infinite with fewer than two iterations.
+        """
+        count = int(self.__counts[timestep])
+        if count < 2:
+            return np.full(len(self.__variables), np.inf)
+        from scipy.stats import t
+        sds = np.sqrt(self.__squares[timestep] / (count - 1))
+        return t.ppf((1 + confidence) / 2, count - 1) * sds / np.sqrt(count)
+
+    def frames(self):
+        """
+        Returns a dict with one pd.DataFrame per state variable, with one row per time step and the columns
+        'mean', 'sd', '10% quant' and '90% quant'.
+        """
+        counts = np.maximum(self.__counts, 1)[:, np.newaxis]
+        sds = np.sqrt(self.__squares / counts)
+        low, high = self.__quantiles[0].quantile(), self.__quantiles[1].quantile()
+        frames = collections.OrderedDict()
+        for j, name in enumerate(self.__variables):
+            columns = collections.OrderedDict(zip(STATS_OF_INTEREST, (self.__means[:, j], sds[:, j],
+                                                                     low[:, j], high[:, j])))
+            frames[name] = pd.DataFrame({stat: pd.Series(values) for stat, values in columns.items()})
+        return frames
+
+    def to_frame(self):
+        """
+        Returns all statistics as one pd.DataFrame with the columns (variable, statistic).
+        """
+        return pd.concat(self.frames(), axis=1)
+
+    @property
+    def nb_iterations(self):
+        return int(self.__counts.min()) if len(self.__counts) else 0
+
+    @property
+    def variables(self):
+        return self.__variables
+
+
+def parse_tolerances(arguments):
+    """
+    Turns arguments of the form VARIABLE=WIDTH, e.g. Share_P=0.01, into a dict {variable: width}.
+    """
+    tolerances = collections.OrderedDict()
+    for argument in arguments:
+        variable, _, width = argument.partition('=')
+        assert variable and width, "Tolerance should be given as VARIABLE=WIDTH but is {}.".format(argument)
+        tolerances[variable] = float(width)
+        assert tolerances[variable] > 0, "Tolerance of {} should be positive.".format(variable)
+    return tolerances
+
+
+class SequentialStopping:
+    """
+    Decides after every batch of iterations of a specification whether another batch is needed.
+
+    Batches are added until the confidence intervals of the means at the final time step are at most twice the
+    tolerance wide, i.e. their half widths are at most the tolerances, for all given state variables, or until
+    max_iterations are reached. So specifications with little variation between the iterations stop after the first
+    batch, and the noisy ones get more iterations.
+    """
+    def __init__(self, tolerances, batch_size, max_iterations=DEFAULT_MAX_ITERATIONS, confidence=DEFAULT_CONFIDENCE):
+        """
+        Parameters
+        ----------
+        tolerances : dict
+            The largest acceptable half width of the confidence interval per state variable, see parse_tolerances().
+
+        batch_size : int
+            The number of iterations of every batch, including the first one.
+
+        max_iterations : int
+            The largest number of iterations of a specification.
+
+        confidence : float
+            The confidence level of the intervals.
+        """
+        assert tolerances, "At least one tolerance should be given."
+        assert batch_size >= 2, "Batches should have at least 2 iterations but have {}.".format(batch_size)
+        assert max_iterations >= batch_size, \
+            "The maximum of {} iterations should not be below the batch size {}.".format(max_iterations, batch_size)
+        self.__tolerances = tolerances
+        self.__batch_size = batch_size
+        self.__max_iterations = max_iterations
+        self.__confidence = confidence
+
+    def half_widths(self, statistics):
+        """Returns the half widths of the confidence intervals at the final time step as {variable: width}."""
+        widths = dict(zip(statistics.variables, statistics.confidence_half_widths(-1, self.__confidence)))
+        missing = [variable for variable in self.__tolerances if variable not in widths]
+        assert not missing, "Tolerances given for unknown variables {}.".format(missing)
+        return collections.OrderedDict((variable, widths[variable]) for variable in self.__tolerances)
+
+    def precise(self, statistics):
+        """Returns True if all half widths are within their tolerances."""
+        return all(width <= self.__tolerances[variable] for variable, width in self.half_widths(statistics).items())
+
+    def next_batch(self, statistics):
+        """
+        Returns the number of iterations to add given the statistics over the iterations so far, 0 to stop.
+        """
+        nb_iterations = statistics.nb_iterations
+        if nb_iterations >= self.__max_iterations or (nb_iterations >= 2 and self.precise(statistics)):
+            return 0
+        return min(self.__batch_size, self.__max_iterations - nb_iterations)
+
+    def describe(self, statistics):
+        """Returns the half widths and tolerances for the logs, e.g. 'Share_P 0.0123 (0.01)'."""
+        return ', '.join('{} {:.4g} ({:.4g})'.format(variable, width, self.__tolerances[variable])
+                         for variable, width in self.half_widths(statistics).items())
+
+    @property
+    def batch_size(self):
+        return self.__batch_size
+
+    @property
+    def max_iterations(self):
+        return self.__max_iterations
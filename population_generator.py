@@ -3,18 +3,28 @@
 Used to create the initial agent population. Is called from experiment.py.
 """
 import logging
-import networkx as nx
-import farmer
+import numpy as np
+
+import topology
 
 __author__ = "Claudius Graebner"
 __email__ = "graebnerc@uni-bremen.de"
 
+logger = logging.getLogger(__name__)
+
+DEGREE = 4
+TOPOLOGIES = ('random_regular', 'lattice')
+
 
 class PopulationGenerator:
     """
     This class is used only to initialize the population. All relevant properties are set via the parameter file.
+
+    The optional parameter "topology" selects where the farmers are located: on a random regular network
+    ("random_regular", the default) or on a periodic two-dimensional lattice ("lattice"). The shape of the lattice is
+    the one closest to a square, unless "lattice_rows" is given. Both sides of the lattice need at least 3 cells.
     """
-    def __init__(self, parameter_file, logging_filename, model_instance):
+    def __init__(self, parameter_file, model_instance, seed=None, topology_cache=None):
         """
         Parameters
         ----------
@@ -22,72 +32,88 @@ class PopulationGenerator:
         parameter_file : file
             The file that contains the parametrization of the model run.
 
-        logging_filename : file
-            The file to store the logs.
-
         model_instance : model.Model
             The instance of the associated model.
+
+        seed : int or None
+            The seed for the random network. If None, fresh entropy is used.
+
+        topology_cache : result_cache.TopologyCache or None
+            If given, the network is taken from the cache or stored there. Only used if seed is given.
         """
         assert type(parameter_file) == dict, "Parameters given in the wrong format!"
-        self.__logging_filename = logging_filename
         self.__params = parameter_file
         self.__model = model_instance
-        self.__agents = []
-        """Set up the logger."""
-        self.logger_pop_gen = logging.getLogger(__name__)
-        self.logger_pop_gen.setLevel(logging.INFO)
-        if not len(self.logger_pop_gen.handlers):
-            terminal_handler = logging.StreamHandler()
-            terminal_handler.setLevel(logging.INFO)
-            terminal_formatter = logging.Formatter('%(name)-12s: %(levelname)-8s %(message)s')
-            terminal_handler.setFormatter(terminal_formatter)
-            self.logger_pop_gen.addHandler(terminal_handler)
-            file_handler = logging.FileHandler(filename=self.__logging_filename)
-            file_handler.setLevel(logging.INFO)
-            file_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-            file_handler.setFormatter(file_formatter)
-            self.logger_pop_gen.addHandler(file_handler)
-
+        self.__seed = seed
+        self.__topology_cache = topology_cache
+        self.__initial_seeds = None
+        self.__network = None
         self.init_population()
-        self.logger_pop_gen.info('Successfully initiated a population.')
-        self.make_neighborhoods(self.__agents)
-        assert self.__agents[0].neighborhood != [], "Function make neighborhood did not work"
-        self.logger_pop_gen.info('Successfully updated the network of the population.')
+        logger.info('Successfully initiated a population.')
+        self.make_neighborhoods(len(self.__initial_seeds))
+        assert self.__network.nb_agents == len(self.__initial_seeds), "Function make neighborhood did not work"
+        logger.info('Successfully updated the network of the population.')
 
     def init_population(self):
         """
-        Initializes the population.
+        Initializes the population. The first farmers use the P seed, the remaining ones the NP seed.
         """
         number_of_agents = self.__params['number_of_farmers']
         init_nb_P = int(self.__params['initial_share_P'] * number_of_agents)
         init_nb_NP = number_of_agents - init_nb_P
-        self.logger_pop_gen.info('We have %s P and %s NP agents.', str(init_nb_P), str(init_nb_NP))
-        self.__agents = [farmer.Farmer(0, self.__params, self.__model) for i in range(init_nb_P)] + \
-                        [farmer.Farmer(1, self.__params, self.__model) for j in range(init_nb_NP)]
-        assert isinstance(self.__agents[0], farmer.Farmer), "Not farmer, but {}".format(type(self.__agents[0]))
-        assert len(self.__agents) == number_of_agents, "Nb of agents should be {} but it is {}.".format(
-            number_of_agents, len(self.__agents))
-
-    def make_neighborhoods(self, list_of_agents):
+        logger.info('We have %s P and %s NP agents.', str(init_nb_P), str(init_nb_NP))
+        self.__initial_seeds = np.concatenate((np.zeros(init_nb_P, dtype=np.int8),
+                                               np.ones(init_nb_NP, dtype=np.int8)))
+        assert len(self.__initial_seeds) == number_of_agents, "Nb of agents should be {} but it is {}.".format(
+            number_of_agents, len(self.__initial_seeds))
+
+    def make_neighborhoods(self, number_of_agents):
         """
-        Allocates the agents on a grip. A von Neumann neighborhood is assumed so every agent has four neighbors.
+        Allocates the agents on the topology given in the parameters.
+
+        On a random regular network every agent has DEGREE neighbors, as many as in a von Neumann neighborhood. The
+        neighborhoods are stored as a sparse adjacency matrix in which row i marks the neighbors of agent i.
+
+        On a lattice every agent has the von Neumann neighborhood of the adjacent cells and no adjacency is stored.
+        The agents are placed on the cells in random order, drawn with the seed of the network, so that the P and NP
+        users are mixed as on the random network.
         """
-        assert isinstance(list_of_agents, list), "list of agents not list but {}".format(type(list_of_agents))
-        assert isinstance(list_of_agents[0], farmer.Farmer), \
-            "Entries of list not farmer but {}".format(type(list_of_agents[0]))
-
-        self.logger_pop_gen.warning('Initiated a grid neighborhood.')
-        graph = nx.random_regular_graph(4, self.__params['number_of_farmers'])
-        neighborhood_lists = [[] for i in range(self.__params['number_of_farmers'])]
-        for tup in graph.edges():
-            neighborhood_lists[tup[0]].append(tup[1])
-            neighborhood_lists[tup[1]].append(tup[0])
-        for i in range(len(self.__agents)):
-            self.__agents[i].neighborhood = [self.__agents[j] for j in neighborhood_lists[i]]
-            assert isinstance(self.__agents[i], farmer.Farmer), "An error in the list of agents."
-            assert isinstance(self.__agents[i].neighborhood, list), "Neighborhood not given of list."
-            assert isinstance(self.__agents[i].neighborhood[0], farmer.Farmer), \
-                "Elements in neighborhood not agents."
-
-    def get_agents(self):
-        return self.__agents
+        assert number_of_agents == self.__params['number_of_farmers'], \
+            "Population should have {} agents but has {}.".format(self.__params['number_of_farmers'], number_of_agents)
+        kind = self.__params.get('topology', 'random_regular')
+        assert kind in TOPOLOGIES, "Topology should be one of {} but is {}.".format(TOPOLOGIES, kind)
+        if kind == 'lattice':
+            rows = self.__params.get('lattice_rows')
+            if rows is None:
+                """The shape closest to a square is the only one with at least 3 x 3 cells if there is one at all."""
+                rows, cols = topology.LatticeTopology.square_shape(number_of_agents)
+                assert rows >= 3, "{} agents cannot be placed on a lattice with at least 3 x 3 cells, only on {} x " \
+                    "{}. Choose a number_of_farmers of at least 9 that is not prime or twice a prime.".format(
+                        number_of_agents, rows, cols)
+            else:
+                assert number_of_agents % rows == 0, \
+                    "{} agents cannot be placed on a lattice with {} rows.".format(number_of_agents, rows)
+                cols = number_of_agents // rows
+                assert rows >= 3 and cols >= 3, "A lattice with {} rows for {} agents has {} x {} cells but should " \
+                    "have at least 3 x 3. Choose other lattice_rows or leave them out.".format(
+                        rows, number_of_agents, rows, cols)
+            logger.info('Initiated a %s x %s lattice neighborhood.', rows, cols)
+            self.__initial_seeds = np.random.default_rng(self.__seed).permutation(self.__initial_seeds)
+            self.__network = topology.LatticeTopology(rows, cols)
+            return
+
+        logger.info('Initiated a random regular neighborhood.')
+        if self.__topology_cache is not None and self.__seed is not None:
+            neighbors = self.__topology_cache.get(number_of_agents, DEGREE, self.__seed,
+                                                  topology.random_regular_neighbors)
+        else:
+            neighbors = topology.random_regular_neighbors(number_of_agents, DEGREE, self.__seed)
+        assert neighbors.shape == (number_of_agents, DEGREE), \
+            "Neighborhoods should have shape {} but have {}.".format((number_of_agents, DEGREE), neighbors.shape)
+        self.__network = topology.NetworkTopology(neighbors)
+
+    def get_initial_seeds(self):
+        return self.__initial_seeds
+
+    def get_network(self):
+        return self.__network
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+The random variates used in the model. All random draws of a model run come from one seeded generator, so that a run
+can be reproduced from its seed.
+"""
+import numpy as np
+
+__author__ = "Claudius Graebner"
+__email__ = "graebnerc@uni-bremen.de"
+
+EXACT_SUM_LIMIT = 10 ** 5
+
+
+def spawn_seeds(seed, n):
+    """
+    Returns n independent child seeds of seed as numpy.random.SeedSequence.
+
+    In contrast to SeedSequence.spawn, the children only depend on the seed and not on how often it was spawned
+    before, so the same seed always yields the same children.
+    """
+    parent = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    return [np.random.SeedSequence(parent.entropy, spawn_key=parent.spawn_key + (i,), pool_size=parent.pool_size)
+            for i in range(n)]
+
+
+class RandomVariates:
+    """
+    Provides all random draws of a model run from one seeded generator.
+
+    The constants of the truncated normal distribution of the NP returns are computed once for the specification,
+    and the returns of all NP users are drawn in one vectorized call per time step.
+    """
+    def __init__(self, parameters, seed=None):
+        """
+        Parameters
+        ----------
+        parameters : dict
+            The parametrization of the model run.
+
+        seed : int, numpy.random.SeedSequence or None
+            The seed of the generator. If None, fresh entropy is used.
+        """
+        self.__generator = np.random.default_rng(seed)
+        self.__mean = float(parameters["mean_return_NP"])
+        self.__scale = float(parameters["var_return_NP"])
+        self.__degenerate = self.__scale == 0
+        if not self.__degenerate:
+            """scipy is only loaded if the returns are random, as it takes a while to import."""
+            from scipy.special import ndtr, ndtri
+            self.__ndtri = ndtri
+            self.__lower_cdf = ndtr(-self.__mean)
+            self.__width_cdf = ndtr(self.__mean) - self.__lower_cdf
+            """Variance of the standard normal truncated to (-mean, mean), used for large sums of returns."""
+            density = np.exp(-self.__mean ** 2 / 2) / np.sqrt(2 * np.pi)
+            self.__variance = self.__scale ** 2 * (1 - 2 * self.__mean * density / self.__width_cdf)
+
+    def returns_NP(self, n):
+        """
+        Returns n independent draws of the return of the NP seed.
+
+        The distribution is the truncated normal of the farmer objects, i.e. scipy.stats.truncnorm with bounds
+        (-mean, mean) in standard units, scale var_return_NP and shifted by mean_return_NP, so negative returns are
+        censored. It is sampled by inverting the CDF on the truncated interval. If var_return_NP is zero, all draws
+        equal the mean.
+        """
+        if self.__degenerate:
+            return np.full(n, self.__mean)
+        z = self.__ndtri(self.__lower_cdf + self.__generator.random(n) * self.__width_cdf)
+        np.clip(z, -self.__mean, self.__mean, out=z)
+        z *= self.__scale
+        z += self.__mean
+        return z
+
+    def sum_of_returns_NP(self, n):
+        """
+        Returns the sum of n independent draws of the return of the NP seed.
+
+        Up to EXACT_SUM_LIMIT draws are drawn and summed. The sum of more draws is drawn from the normal distribution
+        with the mean and variance of the sum, which it follows by the central limit theorem, so the costs do not grow
+        with n.
+        """
+        if self.__degenerate:
+            return n * self.__mean
+        if n <= EXACT_SUM_LIMIT:
+            return float(np.sum(self.returns_NP(n)))
+        return float(self.__generator.normal(n * self.__mean, np.sqrt(n * self.__variance)))
+
+    def choices_NP(self, n, p_P):
+        """
+        Returns n independent seed choices (1 for NP) where the P seed is chosen with probability p_P.
+        """
+        return (self.__generator.random(n) >= p_P).astype(np.int8)
+
+    def nb_choices_NP(self, n, p_P):
+        """
+        Returns the number of NP choices among n independent seed choices as in choices_NP().
+        """
+        return int(self.__generator.binomial(n, 1.0 - min(max(p_P, 0.0), 1.0)))
+
+    def coin_flips(self, n):
+        """
+        Returns n independent seed choices with equal probability for both seeds.
+        """
+        return self.__generator.integers(0, 2, size=n, dtype=np.int8)
+
+    def nb_coin_flips_NP(self, n):
+        """
+        Returns the number of NP choices among n independent seed choices as in coin_flips().
+        """
+        return int(self.__generator.binomial(n, 0.5))
+
+    def state(self):
+        """Returns the state of the generator as dict, see restore()."""
+        return self.__generator.bit_generator.state
+
+    def restore(self, state):
+        """Sets the generator to a state returned by state(), so that it continues with the same draws."""
+        self.__generator.bit_generator.state = state
+
+    @property
+    def generator(self):
+        return self.__generator
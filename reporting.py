@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Non-blocking logging and rate-limited progress reports. Is used from main.py, sweep.py, batch_analysis.py and model.py.
+
+The modules only log to their own loggers. A LogPipeline makes the root logger of the main process and of all worker
+processes put the records into one queue, from which a listener thread writes them to the terminal and the log file.
+So neither the simulation nor the workers ever wait for the terminal or the disk.
+
+Instead of one log line per time step, a ProgressReporter logs the steps done, the steps per second, the estimated
+time remaining and the iterations done at most every PROGRESS_INTERVAL seconds.
+"""
+import concurrent.futures
+import datetime
+import logging
+import logging.handlers
+import multiprocessing
+import time
+
+__author__ = "Claudius Graebner"
+__email__ = "graebnerc@uni-bremen.de"
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+PROGRESS_INTERVAL = 2.0
+PROGRESS_LOGGER = 'progress'
+
+_active_pipeline = None
+
+
+def attach(queue, level=logging.WARNING):
+    """
+    Makes the root logger of this process put all records of at least the given level into queue. Is the initializer
+    of the worker processes.
+    """
+    root = logging.getLogger()
+    root.handlers = [logging.handlers.QueueHandler(queue)]
+    root.setLevel(level)
+    logging.getLogger(PROGRESS_LOGGER).setLevel(logging.INFO)
+
+
+class LogPipeline:
+    """
+    Writes the log records of this process and of its worker processes from a queue to the terminal and to a log file.
+    Is used as context manager around the whole run.
+    """
+    def __init__(self, logging_filename=None, level=logging.WARNING):
+        """
+        Parameters
+        ----------
+        logging_filename : str or None
+            The file to store the logs. If None, the logs are only written to the terminal.
+
+        level : int
+            The minimal level of the records that are logged. Progress reports are always logged.
+        """
+        self.__level = level
+        self.__queue = multiprocessing.Queue(-1)
+        formatter = logging.Formatter(LOG_FORMAT)
+        handlers = [logging.StreamHandler()]
+        if logging_filename is not None:
+            handlers.append(logging.FileHandler(filename=logging_filename))
+        for handler in handlers:
+            handler.setFormatter(formatter)
+        self.__listener = logging.handlers.QueueListener(self.__queue, *handlers)
+        self.__previous = None
+
+    def start(self):
+        global _active_pipeline
+        root = logging.getLogger()
+        self.__previous = (root.handlers, root.level, _active_pipeline)
+        self.__listener.start()
+        attach(self.__queue, self.__level)
+        _active_pipeline = self
+        return self
+
+    def stop(self):
+        """Writes the remaining records and restores the previous handlers of the root logger."""
+        global _active_pipeline
+        root = logging.getLogger()
+        root.handlers, level, _active_pipeline = self.__previous
+        root.setLevel(level)
+        self.__listener.stop()
+        for handler in self.__listener.handlers:
+            handler.close()
+        self.__queue.close()
+        self.__queue.join_thread()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    @property
+    def queue(self):
+        return self.__queue
+
+    @property
+    def level(self):
+        return self.__level
+
+
+def process_pool(max_workers=None):
+    """
+    Returns a ProcessPoolExecutor whose workers send their log records to the active LogPipeline, if there is one.
+    """
+    if _active_pipeline is None:
+        return concurrent.futures.ProcessPoolExecutor(max_workers=max_workers)
+    return concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, initializer=attach,
+                                                  initargs=(_active_pipeline.queue, _active_pipeline.level))
+
+
+class ProgressReporter:
+    """
+    Logs the progress of a run at most every interval seconds, so that the costs per step are a clock reading and a
+    comparison.
+    """
+    def __init__(self, label, total_steps=0, total_iterations=None, interval=PROGRESS_INTERVAL, unit='steps'):
+        """
+        Parameters
+        ----------
+        label : str
+            Names the run in the reports.
+
+        total_steps : int
+            The number of steps of the whole run. More can be added with expect().
+
+        total_iterations : int or None
+            The number of iterations of the whole run. If None, the iterations are not reported.
+
+        interval : float
+            The minimal number of seconds between two reports.
+
+        unit : str
+            What the steps are, e.g. 'specifications'.
+        """
+        self.__logger = logging.getLogger(PROGRESS_LOGGER)
+        self.__label = label
+        self.__total_steps = total_steps
+        self.__total_iterations = total_iterations
+        self.__interval = interval
+        self.__unit = unit
+        self.__steps = 0
+        self.__reported_steps = None
+        self.__iterations = 0
+        self.__start = time.monotonic()
+        self.__next_report = self.__start + interval
+
+    def expect(self, steps, iterations=0):
+        """Adds steps and iterations to the total of the run."""
+        self.__total_steps += steps
+        if self.__total_iterations is not None:
+            self.__total_iterations += iterations
+
+    def advance(self, steps=1, iterations=0):
+        """Counts finished steps and iterations and reports if the last report is at least interval seconds ago."""
+        self.__steps += steps
+        self.__iterations += iterations
+        now = time.monotonic()
+        if now >= self.__next_report:
+            self.report(now)
+
+    def report(self, now=None):
+        """Logs the steps done, the steps per second, the estimated time remaining and the iterations done."""
+        now = time.monotonic() if now is None else now
+        self.__next_report = now + self.__interval
+        self.__reported_steps = self.__steps
+        elapsed = max(now - self.__start, 1e-9)
+        rate = self.__steps / elapsed
+        remaining = self.__total_steps - self.__steps
+        eta = str(datetime.timedelta(seconds=round(remaining / rate))) if rate > 0 else 'unknown'
+        iterations = ''
+        if self.__total_iterations is not None:
+            iterations = ', {} of {} iterations done'.format(self.__iterations, self.__total_iterations)
+        self.__logger.info('%s: %s of %s %s%s, %.{}f %s/s, ETA %s.'.format(0 if rate >= 10 else 2), self.__label,
+                           self.__steps, self.__total_steps, self.__unit, iterations, rate, self.__unit, eta)
+
+    def finish(self):
+        """Logs the final report of the run, unless nothing happened since the last one."""
+        if self.__reported_steps != self.__steps:
+            self.report()
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+A cache for the results of single iterations, so that iterations are only simulated again if their parametrization,
+their seed or the code of the model has changed. Is used from main.py and sweep.py. A second cache keeps the networks
+of the farmers, keyed by their size, degree and network seed.
+
+The results of an iteration and its convergence step are stored as .npz file named by the hash of the canonical
+parameter dict, the version of the model code and the seed of the iteration. The files that were used least recently
+are removed after every batch of iterations if the cache exceeds its disk budget. The cache also remembers the inputs
+of the last analysis of every specification, so that the analysis can be skipped if neither the results nor the
+analysis code have changed.
+"""
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+__author__ = "Claudius Graebner"
+__email__ = "graebnerc@uni-bremen.de"
+
+CACHE_DIRECTORY = 'output/cache'
+TOPOLOGY_CACHE_DIRECTORY = 'output/cache/topologies'
+TOPOLOGY_VERSION = 1
+SIMULATION_MODULES = ('model.py', 'engine.py', 'memory.py', 'topology.py', 'random_variates.py',
+                      'population_generator.py', 'farmer.py', 'neighborhood.py', 'aggregate.py')
+ANALYSIS_MODULES = ('analyze.py', 'analysis_class.py', 'online_stats.py', 'result_store.py')
+
+
+def code_version(modules):
+    """
+    Returns a hash of the source code of the given modules, which are looked up next to this file.
+    """
+    digest = hashlib.sha256()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for module in modules:
+        with open(os.path.join(directory, module), 'rb') as f:
+            digest.update(module.encode() + b'\0' + f.read() + b'\0')
+    return digest.hexdigest()
+
+
+def evict_least_recently_used(directory, suffix, budget):
+    """
+    Removes the least recently used files with the given suffix from directory until they fit into budget bytes.
+
+    Other processes may read, write or evict in the same directory at the same time, so files that vanish in between
+    are skipped.
+    """
+    entries = []
+    for name in os.listdir(directory):
+        if name.endswith(suffix) and '.tmp' not in name:
+            try:
+                stat = os.stat(os.path.join(directory, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+    size = sum(entry[1] for entry in entries)
+    for _, entry_size, name in sorted(entries):
+        if size <= budget:
+            break
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
+        size -= entry_size
+
+
+def save_atomically(path, save):
+    """
+    Writes a file by calling save(f) on a temporary file of its own in the same directory, which then replaces path.
+    So processes writing the same file at the same time never see a partly written one. The temporary file is synced
+    to disk before, so that path is not left empty by a crash of the system either.
+    """
+    directory, name = os.path.split(path)
+    handle, temporary = tempfile.mkstemp(prefix=name + '.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(handle, 'wb') as f:
+            save(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.isfile(temporary):
+            os.remove(temporary)
+        raise
+
+
+def canonical_seed(seed):
+    """
+    Returns a JSON-serializable representation of a seed that is identical for identical streams of random numbers.
+    """
+    if isinstance(seed, np.random.SeedSequence):
+        return [int(seed.entropy), [int(k) for k in seed.spawn_key], int(seed.pool_size)]
+    return seed
+
+
+class ResultCache:
+    """
+    Stores the results of single iterations on disk, keyed by their inputs.
+    """
+    def __init__(self, directory=CACHE_DIRECTORY, budget=1024):
+        """
+        Parameters
+        ----------
+        directory : str
+            The directory of the cache.
+
+        budget : float
+            The maximal size of the cache in megabytes.
+        """
+        self.__directory = directory
+        self.__budget = budget * 2 ** 20
+        self.__simulation_version = code_version(SIMULATION_MODULES)
+        os.makedirs(os.path.join(directory, 'analysis'), exist_ok=True)
+
+    def key(self, parameters, seed):
+        """
+        Returns the key of an iteration with the given parameters and seed under the current model code.
+        """
+        content = json.dumps([parameters, self.__simulation_version, canonical_seed(seed)], sort_keys=True)
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def get(self, key):
+        """
+        Returns the cached results of an iteration and its convergence step (None if it did not converge), or None if
+        the iteration is not in the cache.
+        """
+        path = self.__path(key)
+        try:
+            with np.load(path) as entry:
+                results, convergence_step = entry['results'], int(entry['convergence_step'])
+            os.utime(path)
+        except (IOError, ValueError, KeyError):
+            return None
+        return results, (convergence_step if convergence_step >= 0 else None)
+
+    def put(self, key, results, convergence_step=None):
+        """
+        Stores the results of an iteration. The cache is not evicted here, as this scans the whole directory, see
+        evict().
+        """
+        save_atomically(self.__path(key), lambda f: np.savez(
+            f, results=np.asarray(results), convergence_step=-1 if convergence_step is None else convergence_step))
+
+    def evict(self):
+        """
+        Removes the least recently used results until the cache fits into its budget. Is called by the process that
+        owns the run after every batch of iterations, so the cache may exceed its budget by the results of one batch.
+        """
+        evict_least_recently_used(self.__directory, '.npz', self.__budget)
+
+    def analysis_key(self, parameters, replicate_keys, figure_format='pdf'):
+        """
+        Returns the key of the analysis of a specification, given the keys of its iterations and the format of its
+        figures.
+        """
+        content = json.dumps([parameters, sorted(replicate_keys), code_version(ANALYSIS_MODULES), figure_format],
+                             sort_keys=True)
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def analysis_is_current(self, output_filename, key):
+        """
+        Returns True if the specification was last analyzed with the given key and its figures and table exist.
+        """
+        try:
+            with open(self.__analysis_path(output_filename)) as f:
+                stored = json.load(f)
+            stored_key, outputs = stored['key'], stored['outputs']
+        except (IOError, ValueError, KeyError):
+            return False
+        return stored_key == key and all(os.path.isfile(path) for path in outputs)
+
+    def mark_analyzed(self, output_filename, key, outputs):
+        """
+        Records that the specification was analyzed with the given key, together with the paths of its figures and
+        table as returned by analyze.analyze().
+        """
+        with open(self.__analysis_path(output_filename), 'w') as f:
+            json.dump({'key': key, 'outputs': list(outputs)}, f)
+
+    def __path(self, key):
+        return os.path.join(self.__directory, key + '.npz')
+
+    def __analysis_path(self, output_filename):
+        return os.path.join(self.__directory, 'analysis', os.path.basename(output_filename) + '.json')
+
+
+class TopologyCache:
+    """
+    Stores the neighbors of random regular networks on disk as .npy files, keyed by the number of farmers, the degree
+    and the seed of the network. The files are read as memory maps.
+
+    The seed of a network is spawned from the seed of its iteration, see model.Model. So a network is reused when an
+    iteration is run again with the same seed, e.g. when main.py is called again with the same master seed for a
+    changed specification of the same size, or when a sweep is resumed or extended. The specifications of one sweep
+    have different seeds and hence different networks, which they do not share.
+
+    The cache is read and written by the worker processes, but only evicted by the process that owns the run, see
+    evict(), so that no worker removes a file that another one is about to read.
+    """
+    def __init__(self, directory=TOPOLOGY_CACHE_DIRECTORY, budget=1024):
+        """
+        Parameters
+        ----------
+        directory : str
+            The directory of the cache.
+
+        budget : float
+            The maximal size of the cache in megabytes.
+        """
+        self.__directory = directory
+        self.__budget = budget * 2 ** 20
+        os.makedirs(directory, exist_ok=True)
+
+    def get(self, nb_agents, degree, seed, generate):
+        """
+        Returns the neighbors of the network with the given size, degree and seed. If it is not in the cache, it is
+        created by generate(nb_agents, degree, seed) and stored.
+        """
+        path = os.path.join(self.__directory, 'regular_v{}_{}_{}_{}.npy'.format(TOPOLOGY_VERSION, nb_agents, degree,
+                                                                              seed))
+        try:
+            neighbors = np.load(path, mmap_mode='r')
+            if neighbors.shape == (nb_agents, degree):
+                os.utime(path)
+                return neighbors
+        except (IOError, ValueError):
+            pass
+        neighbors = generate(nb_agents, degree, seed)
+        save_atomically(path, lambda f: np.save(f, neighbors))
+        return neighbors
+
+    def evict(self):
+        """
+        Removes the least recently used networks until the cache fits into its budget. Is called by the process that
+        owns the run after every batch of iterations, not by the workers.
+        """
+        evict_least_recently_used(self.__directory, '.npy', self.__budget)
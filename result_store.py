@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+The store for the simulation results of one specification. Is used from model.py, main.py and the analysis.
+
+All iterations of a specification are kept in one chunked and compressed table with the columns 'replicate' and
+'timestep' and one separately stored column per state variable. The table is appendable and written in batches, and
+one variable can be read for all iterations at once. Data files of the old layout with one frame per iteration
+under the keys data_001, data_002, ... can still be read. The summary statistics over all iterations, computed
+while the iterations are simulated, are stored next to the table.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+__author__ = "Claudius Graebner"
+__email__ = "graebnerc@uni-bremen.de"
+
+RESULTS_KEY = 'results'
+REPLICATES_KEY = 'replicates'
+STATISTICS_KEY = 'statistics'
+CONVERGENCE_KEY = 'convergence'
+TIMINGS_KEY = 'timings'
+
+
+class ResultStore:
+    """
+    Provides the results stored in the file [output_filename]_data.h5.
+
+    Use as context manager or call close() at the end, so that the last batch is written:
+
+        with ResultStore('output/m1_k10_B') as store:
+            store.append(1, results)
+            shares = store.read_variable('Share_P')
+    """
+    def __init__(self, output_filename, mode='a', batch_size=10, expected_rows=None):
+        """
+        Parameters
+        ----------
+        output_filename : str
+            The path to the output file excluding ending.
+
+        mode : str
+            'a' to read and append, 'r' to only read.
+
+        batch_size : int
+            The number of iterations collected before they are written to the file.
+
+        expected_rows : int or None
+            The expected total number of rows of the table, used to choose the size of the chunks.
+        """
+        self.__data_name = output_filename + "_data.h5"
+        if mode == 'r' and not os.path.isfile(self.__data_name):
+            raise IOError("Data file {} does not exist.".format(self.__data_name))
+        self.__store = pd.HDFStore(self.__data_name, mode=mode, complevel=5, complib='blosc')
+        self.__batch_size = batch_size
+        self.__expected_rows = expected_rows
+        self.__batch = []
+        keys = self.__store.keys()
+        self.__legacy = '/' + RESULTS_KEY not in keys and any(k.startswith('/data_') for k in keys)
+        self.__stored_replicates = set(self.replicate_seeds()) if mode != 'r' else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def append(self, ident, results, master_seed=None, convergence_step=None, timings=None, nb_replicates=1):
+        """
+        Adds the results of one iteration. Results already stored for this iteration are replaced.
+
+        Parameters
+        ----------
+        ident : int
+            Number of the iteration.
+
+        results : pd.DataFrame
+            The state variables with one row per time step.
+
+        master_seed : int or None
+            The seed from which the seed of the iteration was spawned.
+
+        convergence_step : int or None
+            The time step at which the state of the iteration was found to be final, if any.
+
+        timings : list of (step, phase, seconds, calls) or None
+            The timings of the run, as returned by Model.get_timings(), if it was profiled.
+
+        nb_replicates : int
+            The number of replicates simulated together in the run the timings belong to, starting with ident.
+        """
+        assert not self.__legacy, "Cannot append to data file {} of the old layout.".format(self.__data_name)
+        frame = pd.DataFrame(results).reset_index(drop=True)
+        frame.insert(0, 'timestep', np.arange(len(frame), dtype=np.int32))
+        frame.insert(0, 'replicate', np.int32(ident))
+        if timings is not None:
+            timings = self.__timings_frame(ident, timings, nb_replicates)
+        self.__batch.append({'ident': ident, 'frame': frame, 'timings': timings,
+                             'master_seed': str(-1 if master_seed is None else master_seed),
+                             'convergence_step': -1 if convergence_step is None else convergence_step})
+        if len(self.__batch) >= self.__batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the collected iterations to the file.
+        """
+        if not self.__batch:
+            return
+        idents = [entry['ident'] for entry in self.__batch]
+        replaced = self.__stored_replicates.intersection(idents)
+        if replaced:
+            condition = 'replicate in {}'.format(sorted(replaced))
+            self.__store.remove(RESULTS_KEY, where=condition)
+            self.__store.remove(REPLICATES_KEY, where=condition)
+            for key in (CONVERGENCE_KEY, TIMINGS_KEY):
+                if '/' + key in self.__store.keys():
+                    self.__store.remove(key, where=condition)
+            if '/' + STATISTICS_KEY in self.__store.keys():
+                self.__store.remove(STATISTICS_KEY)
+        self.__store.append(RESULTS_KEY, pd.concat([entry['frame'] for entry in self.__batch], ignore_index=True),
+                            format='table', data_columns=True, index=False,
+                            expectedrows=self.__expected_rows)
+        replicates = pd.DataFrame({'replicate': np.array(idents, dtype=np.int32),
+                                   'master_seed': np.array([entry['master_seed'] for entry in self.__batch],
+                                                           dtype=object)})
+        self.__store.append(REPLICATES_KEY, replicates, format='table', data_columns=['replicate'], index=False,
+                            min_itemsize={'master_seed': 24})
+        steps = pd.DataFrame({'replicate': np.array(idents, dtype=np.int32),
+                              'convergence_step': np.array([entry['convergence_step'] for entry in self.__batch],
+                                                           dtype=np.int32)})
+        self.__store.append(CONVERGENCE_KEY, steps, format='table', data_columns=['replicate'], index=False)
+        timings = [entry['timings'] for entry in self.__batch if entry['timings'] is not None]
+        if timings:
+            self.__store.append(TIMINGS_KEY, pd.concat(timings, ignore_index=True), format='table',
+                                data_columns=['replicate'], index=False, min_itemsize={'phase': 32})
+        self.__stored_replicates.update(idents)
+        self.__batch = []
+
+    def close(self):
+        """
+        Writes the last batch and closes the file.
+        """
+        if self.__stored_replicates is not None:
+            self.flush()
+        self.__store.close()
+
+    def replicate_seeds(self):
+        """
+        Returns a dict with the number of every stored iteration and the master seed it was simulated with (None if
+        the seed is unknown).
+        """
+        if self.__legacy:
+            return {int(key[len('/data_'):]): getattr(self.__store.get_storer(key).attrs, 'master_seed', None)
+                    for key in self.__store.keys() if key.startswith('/data_')}
+        if '/' + REPLICATES_KEY not in self.__store.keys():
+            return {}
+        seeds = self.__store.select(REPLICATES_KEY)
+        return {int(ident): (None if seed == '-1' else int(seed))
+                for ident, seed in zip(seeds['replicate'], seeds['master_seed'])}
+
+    def write_timings(self, ident, timings, nb_replicates=1):
+        """
+        Stores the timings of a run at once and replaces those stored before for ident. Unlike the timings given to
+        append(), they are not collected in the batch, so the iteration should already be written, see flush().
+        """
+        if '/' + TIMINGS_KEY in self.__store.keys():
+            self.__store.remove(TIMINGS_KEY, where='replicate == {}'.format(int(ident)))
+        self.__store.append(TIMINGS_KEY, self.__timings_frame(ident, timings, nb_replicates), format='table',
+                            data_columns=['replicate'], index=False, min_itemsize={'phase': 32})
+
+    @staticmethod
+    def __timings_frame(ident, timings, nb_replicates):
+        import timing
+        frame = timing.timings_frame(timings).astype({'step': np.int32, 'calls': np.int64})
+        frame.insert(0, 'nb_replicates', np.int32(nb_replicates))
+        frame.insert(0, 'replicate', np.int32(ident))
+        return frame
+
+    def read_timings(self):
+        """
+        Returns the stored timings as pd.DataFrame with the columns replicate, nb_replicates, step, phase, seconds
+        and calls. The frame is empty if no run was profiled.
+        """
+        if '/' + TIMINGS_KEY not in self.__store.keys():
+            return pd.DataFrame(columns=['replicate', 'nb_replicates', 'step', 'phase', 'seconds', 'calls'])
+        return self.__store.select(TIMINGS_KEY).reset_index(drop=True)
+
+    def convergence_steps(self):
+        """
+        Returns a dict with the number of every stored iteration and the time step at which its state was found to be
+        final (None if it did not converge or this is unknown).
+        """
+        convergence_steps = {ident: None for ident in self.replicates()}
+        if self.__legacy or '/' + CONVERGENCE_KEY not in self.__store.keys():
+            return convergence_steps
+        steps = self.__store.select(CONVERGENCE_KEY)
+        convergence_steps.update({int(ident): (None if step < 0 else int(step))
+                                  for ident, step in zip(steps['replicate'], steps['convergence_step'])})
+        return convergence_steps
+
+    def replicates(self):
+        """Returns the sorted numbers of all stored iterations."""
+        return sorted(self.replicate_seeds())
+
+    def variables(self):
+        """Returns the names of the state variables."""
+        if self.__legacy:
+            return list(self.__store[self.__legacy_keys()[0]].columns)
+        columns = self.__store.get_storer(RESULTS_KEY).table.colnames
+        return [c for c in columns if c not in ('index', 'replicate', 'timestep')]
+
+    def read_variable(self, name):
+        """
+        Returns one state variable for all iterations with one row per time step and one column per iteration.
+        """
+        if self.__legacy:
+            return pd.DataFrame({int(key[len('/data_'):]): self.__store[key][name].values
+                                 for key in self.__legacy_keys()})
+        data = self.__store.select(RESULTS_KEY, columns=['replicate', 'timestep', name])
+        return data.pivot(index='timestep', columns='replicate', values=name)
+
+    def read_array(self, variables=None, filename=None, chunksize=100000):
+        """
+        Reads the state variables of all iterations in one pass over the file.
+
+        Parameters
+        ----------
+        variables : list of str or None
+            The state variables to read. If None, all of them.
+
+        filename : str or None
+            If given, the array is a memory map stored in this .npy file instead of an array in memory.
+
+        chunksize : int
+            The number of rows of the table read at once.
+
+        Returns
+        -------
+        array of float with shape (variables, iterations, timesteps)
+            The iterations are in the order of replicates().
+        """
+        variables = list(self.variables() if variables is None else variables)
+        replicates = np.array(self.replicates())
+        if self.__legacy:
+            frames = (self.__store[key][variables].values.T for key in self.__legacy_keys())
+            first = next(frames)
+            data = self.__allocate((len(variables), len(replicates), first.shape[1]), filename)
+            data[:, 0] = first
+            for position, frame in enumerate(frames, start=1):
+                data[:, position] = frame
+            return data
+        nb_timesteps = int(self.__store.select_column(RESULTS_KEY, 'timestep').max()) + 1
+        data = self.__allocate((len(variables), len(replicates), nb_timesteps), filename)
+        for chunk in self.__store.select(RESULTS_KEY, columns=['replicate', 'timestep'] + variables,
+                                         chunksize=chunksize):
+            positions = np.searchsorted(replicates, chunk['replicate'].values)
+            data[:, positions, chunk['timestep'].values] = chunk[variables].values.T
+        return data
+
+    def read_replicate(self, ident):
+        """
+        Returns all state variables of one iteration with one row per time step.
+        """
+        if self.__legacy:
+            return self.__store["data_" + format(int(ident), '03d')]
+        data = self.__store.select(RESULTS_KEY, where='replicate == {}'.format(int(ident)))
+        return data.drop(columns=['replicate']).set_index('timestep').rename_axis(None)
+
+    def write_statistics(self, statistics):
+        """
+        Stores the summary statistics over the iterations and replaces those stored before.
+
+        Parameters
+        ----------
+        statistics : online_stats.OnlineStatistics
+            The statistics, fed with the iterations of the specification.
+        """
+        frames = []
+        for name, frame in statistics.frames().items():
+            frame = frame.rename_axis('timestep').reset_index()
+            frame.insert(0, 'variable', name)
+            frames.append(frame)
+        self.__store.put(STATISTICS_KEY, pd.concat(frames, ignore_index=True))
+        self.__store.get_storer(STATISTICS_KEY).attrs.nb_iterations = statistics.nb_iterations
+
+    def read_statistics(self):
+        """
+        Returns the stored summary statistics as dict with one pd.DataFrame per state variable, with one row per time
+        step and one column per statistic, and the number of iterations they cover. Returns (None, 0) if no
+        statistics are stored.
+        """
+        if '/' + STATISTICS_KEY not in self.__store.keys():
+            return None, 0
+        data = self.__store[STATISTICS_KEY]
+        frames = {name: frame.drop(columns=['variable']).set_index('timestep').rename_axis(None)
+                  for name, frame in data.groupby('variable', sort=False)}
+        return frames, int(self.__store.get_storer(STATISTICS_KEY).attrs.nb_iterations)
+
+    @staticmethod
+    def __allocate(shape, filename):
+        if filename is None:
+            return np.empty(shape)
+        return np.lib.format.open_memmap(filename, mode='w+', dtype=np.float64, shape=shape)
+
+    def __legacy_keys(self):
+        return sorted(key for key in self.__store.keys() if key.startswith('/data_'))
+
+    @property
+    def legacy(self):
+        return self.__legacy
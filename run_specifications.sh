@@ -1,7 +1,8 @@
 #!/usr/bin/env bash
 """
-This script calls the model with all the .json files in a directory called 'json2go'
-The main.py file must be in the same directory as the directory 'json2go'
+This script calls the model with all the .json files in a directory called 'specifications'
+It is a thin wrapper around sweep.py, which runs all specifications from one Python process.
+The sweep.py file must be in the same directory as the directory 'specifications'
 The results will be stored in a folder 'output' which must contain a folder 'figures':
 main.py
 specifications/
@@ -10,8 +11,7 @@ output/tables
 
 The default value for the number of iterations is 50, but it can be changed through the optional first argument.
 
-The script requires Python 3 and the package 'PyPDF2'. This can be be installed via:
-pip install pypdf2
+The script requires Python 3 with numpy, scipy, pandas, tables and matplotlib.
 
 For non Mac machines the first line must probably be changed and line 34 changed into python3
 """
@@ -30,8 +30,8 @@ else
     exit 1
 fi
 
-echo "Run all simulation for $iterations times with all json files in directory json2go"
+echo "Run all simulation for $iterations times with all json files in directory specifications"
 
-for i in specifications/*.json; do python main.py $i $iterations; done
+python sweep.py specifications/*.json --replicates $iterations
 
 echo "Finished Script"
\ No newline at end of file
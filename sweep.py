@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+"""
+Runs a whole parameter sweep in one process. Replaces run_specifications.sh, which started a new interpreter for
+every parameter file and another one for its analysis.
+
+All iterations of all specifications are jobs in one shared queue that is worked off by a pool of processes. The
+analysis of a specification is queued as soon as all its iterations are finished. Finished iterations are kept in
+the data files, so an interrupted sweep continues where it stopped when it is called again. Iterations whose
+parametrization, seed and model code are unchanged are taken from the result cache instead of being simulated. The
+logs of all processes are written to output/sweep.log.
+
+With --tolerance, the iterations of every specification are run in batches until the final statistics are precise
+enough, see online_stats.SequentialStopping.
+
+Usage: python sweep.py specifications/m1_k10_A.json [more files] [--grid KEY=V1,V2 ...] [--replicates 50]
+"""
+import argparse
+import concurrent.futures
+import hashlib
+import itertools
+import json
+import logging
+import os
+import sys
+
+import numpy as np
+
+import model
+import online_stats
+import random_variates
+import reporting
+import result_cache
+import result_store
+
+__author__ = "Claudius Graebner"
+__email__ = "graebnerc@uni-bremen.de"
+
+SWEEP_STATE_FILE = 'output/sweep.json'
+SWEEP_LOG_FILE = 'output/sweep.log'
+
+logger = logging.getLogger(__name__)
+
+
+def parse_grid(grid_arguments):
+    """
+    Turns arguments of the form KEY=V1,V2 into an ordered list of (key, values). Values are read as JSON if
+    possible, e.g. -10 becomes an int, and are kept as strings otherwise, e.g. B.
+    """
+    grid = []
+    for argument in grid_arguments:
+        key, _, values = argument.partition('=')
+        assert key and values, "Grid should be given as KEY=V1,V2 but is {}.".format(argument)
+        parsed = []
+        for value in values.split(','):
+            try:
+                parsed.append(json.loads(value))
+            except ValueError:
+                parsed.append(value)
+        grid.append((key, parsed))
+    return grid
+
+
+def expand_specifications(parameter_files, grid):
+    """
+    Expands every parameter file with every combination of the values in grid.
+
+    Returns a list of (name, parameters). Without a grid, the name is the one of the parameter file. Otherwise the
+    varied parameters are appended to it, e.g. m1_k10_B_retrospective_memory-50_model_1_caseC.
+    """
+    specifications = []
+    for parameter_file in parameter_files:
+        assert parameter_file[:15] == 'specifications/', "Called jsons must be in directory specifications/"
+        base_name = os.path.basename(parameter_file)[:-5]
+        template = json.load(open(parameter_file))
+        keys = [key for key, _ in grid]
+        for combination in itertools.product(*[values for _, values in grid]):
+            parameters = dict(template)
+            parameters.update(zip(keys, combination))
+            name = '_'.join([base_name] + [key + str(value) for key, value in zip(keys, combination)])
+            specifications.append((name, parameters))
+    names = [name for name, _ in specifications]
+    assert len(set(names)) == len(names), "Names of the specifications are not unique."
+    return specifications
+
+
+def specification_seed(master_seed, name, parameters):
+    """
+    Returns the seed of a specification. It depends on the master seed of the sweep, the name of the specification
+    and its parameters, so a changed specification is simulated again when the sweep is resumed.
+    """
+    key = json.dumps([master_seed, name, parameters], sort_keys=True)
+    return int.from_bytes(hashlib.sha256(key.encode()).digest()[:8], 'little')
+
+
+def finished_replicates(output_filename, seed):
+    """
+    Returns the numbers of the iterations that are already stored in the data file with the given seed.
+    A data file of the old layout is renamed, as in main.py, and all iterations are simulated again.
+    """
+    data_name = output_filename + "_data.h5"
+    if not os.path.isfile(data_name):
+        return set()
+    with result_store.ResultStore(output_filename, mode='r') as store:
+        legacy = store.legacy
+        seeds = store.replicate_seeds()
+    if legacy:
+        os.rename(data_name, data_name + "_old")
+        return set()
+    return {ident for ident, stored_seed in seeds.items() if stored_seed == seed}
+
+
+def load_master_seed(seed=None):
+    """
+    Returns the master seed of the sweep. Without an explicit seed, the one of the previous sweep is reused so that
+    an interrupted sweep can be resumed. Otherwise a fresh one is drawn. The seed is recorded in SWEEP_STATE_FILE.
+    """
+    if seed is None and os.path.isfile(SWEEP_STATE_FILE):
+        seed = json.load(open(SWEEP_STATE_FILE))['master_seed']
+    if seed is None:
+        seed = int(np.random.SeedSequence().entropy)
+    return seed
+
+
+def run_sweep(specifications, nb_replicates, master_seed, workers=None, analysis=True, cache=None, profile=False,
+              figure_format='pdf', topology_cache=None, checkpoint_interval=None, record_agents=None, stopping=None):
+    """
+    Runs all iterations of all specifications from one shared job queue and analyzes every specification once its
+    iterations are finished.
+
+    Parameters
+    ----------
+    specifications : list of (str, dict)
+        The names and parameters of the specifications.
+
+    nb_replicates : int
+        The number of iterations of every specification.
+
+    master_seed : int
+        The master seed of the sweep.
+
+    workers : int or None
+        The number of processes. If None, one per core.
+
+    analysis : bool
+        If False, the specifications are not analyzed.
+
+    cache : result_cache.ResultCache or None
+        If given, iterations found in the cache are not simulated again, and the analysis of a specification is
+        skipped if neither its results nor the analysis code have changed since its last analysis.
+
+    profile : bool
+        If True, the timings of the phases of every simulated iteration are stored with its results.
+
+    figure_format : str
+        The format of the figures, see analyze.FIGURE_FORMATS.
+
+    topology_cache : result_cache.TopologyCache or None
+        If given, the networks of the farmers are taken from this cache or stored there.
+
+    checkpoint_interval : int or None
+        If given, every iteration saves its state every checkpoint_interval time steps and continues from it after an
+        interruption of the sweep.
+
+    record_agents : str or None
+        If 'full' or 'switches', the micro data of every simulated iteration are written next to its results, see
+        agent_recorder.
+
+    stopping : online_stats.SequentialStopping or None
+        If given, nb_replicates are only the first batch of every specification. Once the iterations of a batch are
+        finished, another batch is queued until the statistics at the final time step are precise enough, so the
+        specifications that vary more get more iterations. The iterations finished by an interrupted sweep are read
+        from the data files for this decision.
+    """
+    with open(SWEEP_STATE_FILE, 'w') as f:
+        json.dump({'master_seed': master_seed, 'replicates': nb_replicates,
+                   'specifications': [name for name, _ in specifications]}, f, indent=2)
+    stores = {}
+    statistics = {}
+    open_jobs = {}
+    planned = {}
+    cache_keys = {}
+    analysis_keys = {}
+    spec_parameters = dict(specifications)
+    spec_seeds = {}
+    progress = reporting.ProgressReporter('Sweep', 0, 0)
+    with reporting.process_pool(workers) as executor:
+        pending = {}
+
+        def start_analysis(name):
+            output_filename = 'output/' + name
+            if not analysis:
+                return
+            if cache is not None:
+                analysis_keys[name] = cache.analysis_key(spec_parameters[name], cache_keys[name], figure_format)
+                if cache.analysis_is_current(output_filename, analysis_keys[name]):
+                    logger.warning('%s: results and analysis code unchanged, analysis skipped.', name)
+                    return
+            import analyze
+            future = executor.submit(analyze.analyze, planned[name] + 1, output_filename, output_filename + '.json', 1,
+                                     figure_format)
+            pending[future] = ('analysis', name, None, None)
+
+        def submit(name, todo):
+            """Queues the given iterations of a specification, unless they are in the cache."""
+            parameters, seed = spec_parameters[name], spec_seeds[name]
+            output_filename = 'output/' + name
+            planned[name] = max([planned.get(name, 0)] + list(todo))
+            seeds = random_variates.spawn_seeds(seed, planned[name])
+            if cache is not None:
+                cache_keys[name] = [cache.key(parameters, s) for s in seeds]
+            cached = {}
+            if cache is not None:
+                for i in todo:
+                    entry = cache.get(cache_keys[name][i - 1])
+                    if entry is not None:
+                        cached[i] = entry
+            logger.warning('%s: %s of %s iterations left, %s of them in the cache.', name, len(todo),
+                           planned[name], len(cached))
+            open_jobs[name] = open_jobs.get(name, 0) + len(todo)
+            progress.expect((len(todo) - len(cached)) * parameters["number_of_timesteps"], len(todo) - len(cached))
+            for i in todo:
+                if i not in cached:
+                    future = executor.submit(model.run_replicate, parameters, output_filename, i, seeds[i - 1],
+                                             profile, topology_cache, checkpoint_interval, record_agents)
+                    pending[future] = ('simulation', name, i, seed)
+            for i, (results, convergence_step) in sorted(cached.items()):
+                keep(name, i, results, convergence_step, seed, simulated=False)
+
+        def finish(name):
+            """Queues the next batch of a specification, or closes its data file and starts its analysis."""
+            if cache is not None:
+                cache.evict()
+            if topology_cache is not None:
+                topology_cache.evict()
+            if stopping is not None and name in statistics:
+                more = stopping.next_batch(statistics[name])
+                logger.warning('%s: %s iterations done, half widths of the confidence intervals (tolerances): %s.%s',
+                               name, planned[name], stopping.describe(statistics[name]),
+                               ' Running {} more.'.format(more) if more > 0 else '')
+                if more > 0:
+                    submit(name, list(range(planned[name] + 1, planned[name] + more + 1)))
+                    return
+            store = stores.pop(name, None)
+            if store is not None:
+                if statistics[name].nb_iterations == planned[name]:
+                    store.write_statistics(statistics.pop(name))
+                store.close()
+            logger.warning('%s: all iterations finished.', name)
+            start_analysis(name)
+
+        def open_store(name, nb_timesteps):
+            if name not in stores:
+                stores[name] = result_store.ResultStore('output/' + name)
+                statistics[name] = online_stats.OnlineStatistics(model.RESULT_VARIABLES, nb_timesteps)
+
+        def keep(name, i, results, convergence_step, seed, simulated=True, timings=None):
+            """Stores the results of an iteration and finishes the batch once all its iterations are finished."""
+            open_store(name, results.shape[0])
+            stores[name].append(i, model.results_frame(results), seed, convergence_step, timings)
+            statistics[name].add_run(results)
+            if simulated:
+                progress.advance(results.shape[0] - 1, 1)
+            if simulated and cache is not None:
+                cache.put(cache_keys[name][i - 1], results, convergence_step)
+            open_jobs[name] -= 1
+            if open_jobs[name] == 0:
+                finish(name)
+
+        for name, parameters in specifications:
+            output_filename = 'output/' + name
+            parameter_file = output_filename + '.json'
+            with open(parameter_file, 'w') as f:
+                json.dump(parameters, f, indent=2)
+            seed = specification_seed(master_seed, name, parameters)
+            spec_seeds[name] = seed
+            finished = finished_replicates(output_filename, seed)
+            nb_iterations = nb_replicates
+            if stopping is not None and finished:
+                """Continue with the batches of the interrupted sweep, whose iterations enter the statistics."""
+                nb_iterations = max(nb_replicates, max(finished))
+                open_store(name, parameters["number_of_timesteps"] + 1)
+                replicates = stores[name].replicates()
+                data = stores[name].read_array(list(model.RESULT_VARIABLES))
+                for position, ident in enumerate(replicates):
+                    if ident in finished and ident <= nb_iterations:
+                        statistics[name].add_run(data[:, position].T)
+            todo = [i for i in range(1, nb_iterations + 1) if i not in finished]
+            planned[name] = nb_iterations
+            submit(name, todo)
+            if not todo:
+                finish(name)
+        try:
+            while pending:
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    job, name, i, seed = pending.pop(future)
+                    if job == 'analysis':
+                        if future.exception() is not None:
+                            logger.error('Analysis of %s failed: %s', name, future.exception())
+                        elif cache is not None:
+                            cache.mark_analyzed('output/' + name, analysis_keys[name], future.result())
+                        continue
+                    results, convergence_step, timings = future.result()
+                    keep(name, i, results, convergence_step, seed, timings=timings)
+        finally:
+            for store in stores.values():
+                store.close()
+    progress.finish()
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(description='Runs a parameter sweep over one or several parameter files.')
+    parser.add_argument('parameterfiles', nargs='+',
+                        help='The parameter files used as templates, must be in the directory specifications/.')
+    parser.add_argument('--grid', action='append', default=[], metavar='KEY=V1,V2',
+                        help='Values for a parameter. Every combination of all grids is run for every template.')
+    parser.add_argument('--replicates', type=int, default=50,
+                        help='The number of iterations of every specification (default: 50).')
+    parser.add_argument('--workers', type=int, default=None, help='The number of processes (default: one per core).')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='The master seed of the sweep (default: the one of the previous sweep, if any).')
+    parser.add_argument('--no-analysis', action='store_true', help='Do not analyze the specifications.')
+    parser.add_argument('--cache-budget', type=float, default=1024,
+                        help='The disk budget of the cache of iteration results and of the cache of networks, each '
+                             'in megabytes (default: 1024).')
+    parser.add_argument('--no-cache', action='store_true', help='Neither use nor fill the caches.')
+    parser.add_argument('--profile', action='store_true',
+                        help='Time the phases of every iteration and store the timings with the results.')
+    parser.add_argument('--figure-format', choices=('pdf', 'png', 'svg'), default='pdf',
+                        help='One multipage PDF with all figures per specification (default), or one PNG or SVG file '
+                             'per figure. PNG files keep the output of sweeps with long runs small.')
+    parser.add_argument('--checkpoint-interval', type=int, default=None, metavar='STEPS',
+                        help='Save the state of every iteration every STEPS time steps, so that an interrupted sweep '
+                             'continues its unfinished iterations from their last checkpoints.')
+    parser.add_argument('--record-agents', choices=('full', 'switches'), default=None,
+                        help='Write the seed and income of every farmer in every time step (full) or only the seed '
+                             'switches (switches) of every iteration to disk, see agent_recorder.py. Disables the '
+                             'cache of iteration results.')
+    parser.add_argument('--tolerance', action='append', default=[], metavar='VARIABLE=WIDTH',
+                        help='Run batches of --replicates iterations per specification until the confidence interval '
+                             'of the mean of VARIABLE at the final time step is at most WIDTH to either side, e.g. '
+                             'Share_P=0.01. Can be given for several variables.')
+    parser.add_argument('--max-iterations', type=int, default=online_stats.DEFAULT_MAX_ITERATIONS,
+                        help='The largest number of iterations per specification with --tolerance (default: {}).'
+                        .format(online_stats.DEFAULT_MAX_ITERATIONS))
+    parser.add_argument('--confidence', type=float, default=online_stats.DEFAULT_CONFIDENCE,
+                        help='The confidence level of the intervals with --tolerance (default: {}).'.format(
+                            online_stats.DEFAULT_CONFIDENCE))
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_arguments(sys.argv[1:])
+    specs = expand_specifications(args.parameterfiles, parse_grid(args.grid))
+    cache = None
+    if not (args.no_cache or args.record_agents):
+        cache = result_cache.ResultCache(budget=args.cache_budget)
+    topology_cache = None if args.no_cache else result_cache.TopologyCache(budget=args.cache_budget)
+    stopping = None
+    if args.tolerance:
+        stopping = online_stats.SequentialStopping(online_stats.parse_tolerances(args.tolerance), args.replicates,
+                                                   args.max_iterations, args.confidence)
+    with reporting.LogPipeline(SWEEP_LOG_FILE):
+        run_sweep(specs, args.replicates, load_master_seed(args.seed), args.workers, not args.no_analysis, cache,
+                  args.profile, args.figure_format, topology_cache, args.checkpoint_interval, args.record_agents,
+                  stopping)
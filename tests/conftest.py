@@ -0,0 +1,51 @@
+"""
+The modules of the model are flat files in the root of the repository, which is put on the path for the tests.
+
+The helpers shared by the tests: small seeded runs of the model whose results are compared by their hashes.
+"""
+import hashlib
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import model  # noqa: E402
+
+"""A small specification of case B, which the tests change with dict(BASE_PARAMETERS, ...)."""
+BASE_PARAMETERS = {"number_of_timesteps": 20, "initial_share_P": 0.5, "number_of_farmers": 20, "p_P": 0.5,
+                   "model": "model_1", "model_1_case": "B", "retrospective_memory": -3, "yearly_cost_P": 1,
+                   "fix_return_P": 3, "mean_return_NP": 2, "var_return_NP": 0}
+
+
+class Interruption(Exception):
+    """Stands in for a run that was killed."""
+
+
+def digest(array):
+    """Returns the SHA-256 hash of the bytes of an array."""
+    return hashlib.sha256(np.ascontiguousarray(array).tobytes()).hexdigest()
+
+
+def run_model(parameters, output_filename, seed, nb_replicates=1, **options):
+    """Runs the model without saving, see model.Model for the options, and returns it."""
+    m = model.Model(parameters, output_filename, 1, seed=seed, nb_replicates=nb_replicates, **options)
+    m.run(save=False)
+    return m
+
+
+def all_results(m, nb_replicates):
+    """Returns the results of all replicates of a run as array with shape (replicates, time steps, variables)."""
+    return np.stack([m.get_results(replicate) for replicate in range(nb_replicates)])
+
+
+def interrupt_update(monkeypatch, timestep):
+    """Lets runs fail right after they updated the given time step."""
+    update = model.Model.update
+
+    def update_and_fail(self, i):
+        update(self, i)
+        if i == timestep:
+            raise Interruption()
+    monkeypatch.setattr(model.Model, 'update', update_and_fail)
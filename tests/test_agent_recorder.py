@@ -0,0 +1,57 @@
+"""
+The recording of the farmers has to match the results of the run, and must be the same whether or not the run was
+interrupted and resumed from a checkpoint, in which case the steps recorded after the checkpoint are written again.
+"""
+import numpy as np
+import pytest
+
+import agent_recorder
+from conftest import BASE_PARAMETERS, Interruption, digest, interrupt_update, run_model
+
+PARAMETERS = dict(BASE_PARAMETERS, number_of_farmers=16, var_return_NP=2)
+NB_REPLICATES = 2
+INTERRUPTED_AT = 9
+
+
+def record(output_filename, mode, interrupt=False):
+    """Runs with a checkpoint every 4 time steps, optionally failing after INTERRUPTED_AT and starting again."""
+    options = dict(checkpoint_interval=4, record_agents=mode)
+    if interrupt:
+        with pytest.MonkeyPatch.context() as patch:
+            interrupt_update(patch, INTERRUPTED_AT)
+            with pytest.raises(Interruption):
+                run_model(PARAMETERS, output_filename, 23, NB_REPLICATES, **options)
+    return run_model(PARAMETERS, output_filename, 23, NB_REPLICATES, **options)
+
+
+def test_full_recording_matches_the_results(tmp_path):
+    m = record(str(tmp_path / 'run'), 'full')
+    seeds, incomes = agent_recorder.read_full(m.agents_filename())
+    assert seeds.shape == incomes.shape == (PARAMETERS["number_of_timesteps"] + 1, NB_REPLICATES, 16)
+    for replicate in range(NB_REPLICATES):
+        results = m.get_results(replicate)
+        assert np.array_equal(np.mean(seeds[:, replicate] == 0, axis=1), results[:, 5])
+        returns_P = np.where(seeds[:, replicate] == 0, incomes[:, replicate], 0).sum(axis=1)
+        assert np.allclose(returns_P, results[:, 1])
+
+
+@pytest.mark.parametrize('mode', agent_recorder.MODES)
+def test_resumed_recording_equals_uninterrupted_one(tmp_path, mode):
+    filename = record(str(tmp_path / 'uninterrupted'), mode).agents_filename()
+    resumed_filename = record(str(tmp_path / 'resumed'), mode, interrupt=True).agents_filename()
+    if mode == 'full':
+        for recorded, resumed in zip(agent_recorder.read_full(filename), agent_recorder.read_full(resumed_filename)):
+            assert digest(resumed) == digest(recorded)
+        return
+    switches = agent_recorder.read_switches(filename)
+    resumed_switches = agent_recorder.read_switches(resumed_filename)
+    assert digest(resumed_switches.values) == digest(switches.values)
+    assert (switches['timestep'] > INTERRUPTED_AT).any()
+
+
+def test_seed_panel_equals_full_recording(tmp_path):
+    seeds, _ = agent_recorder.read_full(record(str(tmp_path / 'full'), 'full').agents_filename())
+    switches = agent_recorder.read_switches(record(str(tmp_path / 'switches'), 'switches').agents_filename())
+    for replicate in range(NB_REPLICATES):
+        panel = agent_recorder.seed_panel(switches, PARAMETERS["number_of_timesteps"], replicate)
+        assert digest(panel) == digest(seeds[:, replicate])
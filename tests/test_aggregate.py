@@ -0,0 +1,58 @@
+"""
+The aggregate simulation only tracks the numbers of interchangeable farmers. Its series must follow the distribution
+of those of the agent-level simulation, and it must be reproducible and resumable like the agent-level one.
+"""
+import numpy as np
+import pytest
+
+import model
+import random_variates
+from conftest import BASE_PARAMETERS, Interruption, all_results, digest, interrupt_update, run_model
+
+PARAMETERS = dict(BASE_PARAMETERS, number_of_timesteps=15, model_1_case='A', var_return_NP=1, simulation='aggregate')
+SPECIFICATIONS = {'model_0': dict(PARAMETERS, model='model_0', p_P=0.4, var_return_NP=3),
+                  'A': dict(PARAMETERS, var_return_NP=0), 'A_random_returns': dict(PARAMETERS, mean_return_NP=3.2,
+                                                                                    var_return_NP=2),
+                  'model_2_A': dict(PARAMETERS, model='model_2', initial_share_P=0.3)}
+NB_REPLICATES = 200
+SHARE_P, RETURNS_NP_PC = model.RESULT_VARIABLES.index("Share_P"), model.RESULT_VARIABLES.index("Returns_NP_pc")
+
+
+def results_of(parameters, output_filename, seed, nb_replicates=NB_REPLICATES, **options):
+    return all_results(run_model(parameters, output_filename, seed, nb_replicates, **options), nb_replicates)
+
+
+@pytest.mark.parametrize('name', sorted(SPECIFICATIONS))
+def test_aggregate_agrees_with_agents_in_distribution(tmp_path, name):
+    parameters = SPECIFICATIONS[name]
+    agents = results_of(dict(parameters, simulation='agents'), str(tmp_path / 'agents'), 240)
+    groups = results_of(parameters, str(tmp_path / 'aggregate'), 241)
+    for variable in (SHARE_P, RETURNS_NP_PC):
+        for timestep in (1, 2, 5, parameters["number_of_timesteps"]):
+            a, b = agents[:, timestep, variable], groups[:, timestep, variable]
+            standard_error = np.sqrt((a.var() + b.var()) / NB_REPLICATES)
+            assert abs(a.mean() - b.mean()) <= 4 * standard_error + 1e-12, \
+                "{} differs at time step {}: {} vs {}".format(model.RESULT_VARIABLES[variable], timestep, a.mean(),
+                                                              b.mean())
+
+
+@pytest.mark.parametrize('name', sorted(SPECIFICATIONS))
+def test_aggregate_is_reproducible(tmp_path, name):
+    parameters = SPECIFICATIONS[name]
+    seeds = random_variates.spawn_seeds(242, 3)
+    together = results_of(parameters, str(tmp_path / 'together'), seeds, 3)
+    assert digest(results_of(parameters, str(tmp_path / 'again'), seeds, 3)) == digest(together)
+    alone = np.concatenate([results_of(parameters, str(tmp_path / 'alone'), seed, 1) for seed in seeds])
+    assert digest(alone) == digest(together)
+
+
+def test_aggregate_resumes_from_checkpoint(tmp_path, monkeypatch):
+    """In the baseline model the farmers keep switching, so the run goes on after the interruption."""
+    parameters = SPECIFICATIONS['model_0']
+    uninterrupted = results_of(parameters, str(tmp_path / 'uninterrupted'), 243, 3, checkpoint_interval=3)
+    with monkeypatch.context() as patch:
+        interrupt_update(patch, 7)
+        with pytest.raises(Interruption):
+            results_of(parameters, str(tmp_path / 'resumed'), 243, 3, checkpoint_interval=3)
+    resumed = results_of(parameters, str(tmp_path / 'resumed'), 243, 3, checkpoint_interval=3)
+    assert digest(resumed) == digest(uninterrupted)
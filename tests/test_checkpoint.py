@@ -0,0 +1,77 @@
+"""
+A run that is interrupted and started again continues from its last checkpoint, and must end with the results of a
+run without interruption.
+"""
+import os
+
+import numpy as np
+import pytest
+
+import model
+import online_stats
+from conftest import BASE_PARAMETERS, Interruption, all_results, digest, run_model
+
+PARAMETERS = dict(BASE_PARAMETERS, number_of_timesteps=30, retrospective_memory=-4, var_return_NP=2)
+
+
+def interrupt_after(monkeypatch, nb_checkpoints):
+    """Lets runs fail right after they saved the given number of checkpoints."""
+    save_checkpoint = model.Model.save_checkpoint
+    saved = []
+
+    def save_and_fail(self, filename=None):
+        save_checkpoint(self, filename)
+        saved.append(filename)
+        if len(saved) == nb_checkpoints:
+            raise Interruption()
+    monkeypatch.setattr(model.Model, 'save_checkpoint', save_and_fail)
+
+
+def run(parameters, output_filename):
+    statistics = online_stats.OnlineStatistics(model.RESULT_VARIABLES, parameters["number_of_timesteps"] + 1)
+    m = run_model(parameters, output_filename, 21, 2, statistics=statistics, checkpoint_interval=2)
+    convergence_steps = [m.get_convergence_step(replicate) for replicate in range(2)]
+    return digest(all_results(m, 2)), convergence_steps, statistics.to_frame().values, m
+
+
+@pytest.mark.parametrize('parameters', [PARAMETERS, dict(PARAMETERS, model_1_case='C', var_return_NP=0),
+                                        dict(PARAMETERS, model='model_2', initial_share_P=0.75)])
+def test_resumed_run_equals_uninterrupted_run(tmp_path, monkeypatch, parameters):
+    results, convergence_steps, statistics, _ = run(parameters, str(tmp_path / 'uninterrupted'))
+
+    output_filename = str(tmp_path / 'interrupted')
+    with monkeypatch.context() as patch:
+        interrupt_after(patch, 2)
+        with pytest.raises(Interruption):
+            run(parameters, output_filename)
+    resumed_results, resumed_convergence_steps, resumed_statistics, m = run(parameters, output_filename)
+    assert resumed_results == results
+    assert resumed_convergence_steps == convergence_steps
+    assert np.array_equal(resumed_statistics, statistics, equal_nan=True)
+    assert not os.path.exists(m.checkpoint_filename())
+
+
+def test_checkpoint_of_other_parameters_is_ignored(tmp_path, monkeypatch):
+    output_filename = str(tmp_path / 'run')
+    with monkeypatch.context() as patch:
+        interrupt_after(patch, 2)
+        with pytest.raises(Interruption):
+            run(dict(PARAMETERS, p_P=0.25), output_filename)
+    assert run(PARAMETERS, output_filename)[0] == run(PARAMETERS, str(tmp_path / 'fresh'))[0]
+
+
+def test_checkpoint_is_written_through_a_temporary_file_of_its_own(tmp_path, monkeypatch):
+    """Another run writing the same checkpoint at the same time must not take over its temporary file."""
+    output_filename = str(tmp_path / 'run')
+    m = model.Model(PARAMETERS, output_filename, 1, seed=21, nb_replicates=2, checkpoint_interval=2)
+    other_temporary = m.checkpoint_filename() + '.tmp'
+    with open(other_temporary, 'wb') as f:
+        f.write(b'partly written')
+    with monkeypatch.context() as patch:
+        interrupt_after(patch, 1)
+        with pytest.raises(Interruption):
+            run(PARAMETERS, output_filename)
+    with open(other_temporary, 'rb') as f:
+        assert f.read() == b'partly written'
+    assert sorted(os.listdir(str(tmp_path))) == sorted([os.path.basename(m.checkpoint_filename()),
+                                                        os.path.basename(other_temporary)])
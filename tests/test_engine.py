@@ -0,0 +1,120 @@
+"""
+The population engine applies the rules of the farmers to all of them at once. Where the activation order does not
+matter, i.e. in the baseline model and in case A, it must take the decisions and pay the incomes of the farmer objects.
+"""
+import numpy as np
+import pytest
+
+import engine
+import random_variates
+import topology
+from conftest import BASE_PARAMETERS
+
+"""With a net P return of 1, the NP users of case A are better off from the second time step on, and with fixed NP
+returns they face ties."""
+PARAMETERS = dict(BASE_PARAMETERS, model_1_case='A', yearly_cost_P=2, var_return_NP=2)
+
+
+class Farmers:
+    """
+    The rules of the farmer objects, applied one farmer after the other with the payoffs kept in lists. The random
+    draws are taken from a generator with the seed of the engine in the order in which the engine takes them.
+
+    Two rules differ from the farmer objects on purpose: without NP users the farmers keep their seed instead of
+    tossing a coin, and in model_2 the NP users get the return of model_2 instead of the one of model_1.
+    """
+    def __init__(self, parameters, seeds, seed):
+        self.parameters = parameters
+        self.seeds = [int(s) for s in seeds]
+        self.wealth = [[0.0] for _ in self.seeds]
+        self.random = random_variates.RandomVariates(parameters, seed)
+        self.net_return_P = float(parameters["fix_return_P"]) - parameters["yearly_cost_P"]
+
+    def update(self, i):
+        params = self.parameters
+        n_NP = sum(self.seeds)
+        if params["model"] == "model_0":
+            self.seeds = [int(self.random.generator.random() >= params["p_P"]) for _ in self.seeds]
+        else:
+            mean_NP = self.net_return_P
+            if i > 0 and n_NP > 0:
+                mean_NP = np.mean([np.mean(w[params["retrospective_memory"]:])
+                                   for w, s in zip(self.wealth, self.seeds) if s == 1])
+            ties = []
+            for j in range(len(self.seeds)):
+                if i > 0 and n_NP == 0:
+                    continue
+                if self.net_return_P > mean_NP:
+                    self.seeds[j] = 0
+                elif self.net_return_P < mean_NP:
+                    self.seeds[j] = 1
+                else:
+                    ties.append(j)
+            for j, coin in zip(ties, self.random.coin_flips(len(ties))):
+                self.seeds[j] = int(coin)
+        for j, s in enumerate(self.seeds):
+            if s == 0:
+                self.wealth[j].append(self.net_return_P)
+            elif params["model"] == "model_2":
+                self.wealth[j].append(2 * self.net_return_P * n_NP / params["number_of_farmers"])
+            else:
+                self.wealth[j].append(float(self.random.returns_NP(1)[0]))
+
+    @property
+    def incomes(self):
+        return [w[-1] for w in self.wealth]
+
+
+def new_engine(parameters, initial_seeds, seed):
+    nb_replicates, nb_agents = np.shape(initial_seeds)
+    network = topology.NetworkTopology.combine([topology.NetworkTopology(topology.random_regular_neighbors(
+        nb_agents, 4, seed + r)) for r in range(nb_replicates)])
+    streams = [random_variates.RandomVariates(parameters, seed + r) for r in range(nb_replicates)]
+    return engine.PopulationEngine(parameters, initial_seeds, network, streams)
+
+
+@pytest.mark.parametrize('parameters', [dict(PARAMETERS, model='model_0', var_return_NP=3), PARAMETERS,
+                                        dict(PARAMETERS, var_return_NP=0), dict(PARAMETERS, retrospective_memory=0),
+                                        dict(PARAMETERS, model='model_2')],
+                         ids=['model_0', 'A', 'A_ties', 'A_whole_memory', 'model_2_A'])
+def test_engine_follows_the_rules_of_the_farmers(parameters):
+    initial_seeds = np.random.default_rng(1).integers(0, 2, parameters["number_of_farmers"])
+    farmers = Farmers(parameters, initial_seeds, 1)
+    population = new_engine(parameters, initial_seeds[np.newaxis], 1)
+    for i in range(parameters["number_of_timesteps"]):
+        population.update(i)
+        farmers.update(i)
+        assert population.seeds[0].tolist() == farmers.seeds
+        assert population.incomes[0].tolist() == farmers.incomes
+
+
+def test_model_2_return_depends_on_the_number_of_NP_users():
+    parameters = dict(PARAMETERS, model='model_2')
+    population = new_engine(parameters, np.random.default_rng(2).integers(0, 2, (3, 20)), 2)
+    net_return_P = parameters["fix_return_P"] - parameters["yearly_cost_P"]
+    for i in range(10):
+        n_NP = np.count_nonzero(population.seeds, axis=1)
+        population.update(i)
+        users_NP = population.seeds == 1
+        expected = np.where(users_NP, (2 * net_return_P * n_NP / 20)[:, np.newaxis], net_return_P)
+        assert np.array_equal(population.incomes, expected)
+
+
+def test_farmers_without_reference_keep_their_seed():
+    """In case A a replicate without NP users stays there, in case B so do farmers without NP neighbors."""
+    initial_seeds = np.array([np.zeros(20), np.random.default_rng(3).integers(0, 2, 20)], dtype=np.int8)
+    population = new_engine(PARAMETERS, initial_seeds, 3)
+    for i in range(1, 6):
+        population.update(i)
+        assert not population.seeds[0].any()
+
+    parameters = dict(PARAMETERS, model_1_case='B', number_of_farmers=16)
+    lattice = topology.LatticeTopology(4, 4)
+    initial_seeds = np.zeros((1, 16), dtype=np.int8)
+    initial_seeds[0, [0, 10]] = 1
+    has_NP_neighbor = np.array([initial_seeds[0, lattice.neighbors_of(i)].any() for i in range(16)])
+    population = engine.PopulationEngine(parameters, initial_seeds, lattice,
+                                         [random_variates.RandomVariates(parameters, 3)])
+    population.update(1)
+    assert np.array_equal(population.seeds[0, ~has_NP_neighbor], initial_seeds[0, ~has_NP_neighbor])
+    assert population.seeds[0, 0] == population.seeds[0, 10] == 1
@@ -0,0 +1,33 @@
+"""
+A run that stops once all replicates have converged must give the same results as a run over all time steps.
+"""
+import numpy as np
+import pytest
+
+import engine
+import model
+import online_stats
+from conftest import BASE_PARAMETERS, all_results, digest, run_model
+
+PARAMETERS = dict(BASE_PARAMETERS, number_of_timesteps=40, number_of_farmers=30)
+
+
+def run(parameters, output_filename):
+    statistics = online_stats.OnlineStatistics(model.RESULT_VARIABLES, parameters["number_of_timesteps"] + 1)
+    m = run_model(parameters, output_filename, 12, 4, statistics=statistics)
+    return all_results(m, 4), [m.get_convergence_step(replicate) for replicate in range(4)], statistics.to_frame()
+
+
+@pytest.mark.parametrize('case', ['A', 'B', 'C'])
+def test_fast_forward_equals_full_run(tmp_path, monkeypatch, case):
+    parameters = dict(PARAMETERS, model_1_case=case)
+    results, convergence_steps, statistics = run(parameters, str(tmp_path / 'fast'))
+    assert any(step is not None for step in convergence_steps)
+    if case != 'B':
+        """In case B some replicates keep switching, so only the others stop early."""
+        assert all(step is not None for step in convergence_steps)
+
+    monkeypatch.setattr(engine.PopulationEngine, 'converged', lambda self: np.zeros(self.nb_replicates, bool))
+    full_results, _, full_statistics = run(parameters, str(tmp_path / 'full'))
+    assert digest(results) == digest(full_results)
+    assert digest(statistics.values) == digest(full_statistics.values)
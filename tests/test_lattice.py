@@ -0,0 +1,64 @@
+"""
+The lattice adds up the neighborhoods with shifted arrays instead of an adjacency matrix. Its neighborhoods are those
+of a periodic von Neumann grid, and a run on it must not depend on whether its replicates are simulated together.
+"""
+import numpy as np
+import pytest
+
+import random_variates
+import topology
+from conftest import BASE_PARAMETERS, all_results, digest, run_model
+
+PARAMETERS = dict(BASE_PARAMETERS, number_of_timesteps=25, number_of_farmers=24, var_return_NP=1, topology='lattice')
+
+
+def lattice_as_network(lattice):
+    """Returns the network with the same neighbors as the lattice, one row per farmer."""
+    return topology.NetworkTopology(lattice.neighbors_of(np.arange(lattice.nb_agents)).T)
+
+
+def results_of(parameters, output_filename, seed, nb_replicates):
+    return all_results(run_model(parameters, output_filename, seed, nb_replicates), nb_replicates)
+
+
+def test_von_neumann_neighbors():
+    lattice = topology.LatticeTopology(3, 4)
+    assert sorted(lattice.neighbors_of(5)) == [1, 4, 6, 9]
+    assert sorted(lattice.neighbors_of(0)) == [1, 3, 4, 8]
+    assert sorted(lattice.neighbors_of(11)) == [3, 7, 8, 10]
+
+
+@pytest.mark.parametrize('shape', [(3, 3), (4, 6), (5, 3)])
+def test_neighbor_sums_equal_the_network_of_the_lattice(shape):
+    lattice = topology.LatticeTopology.combine([topology.LatticeTopology(*shape)] * 2)
+    network = lattice_as_network(lattice)
+    counts = np.random.default_rng(20).integers(0, 2, lattice.nb_agents)
+    assert digest(lattice.neighbor_sums(counts)) == digest(network.neighbor_sums(counts.astype(float)))
+
+    values = np.random.default_rng(21).normal(size=lattice.nb_agents)
+    agents = np.random.default_rng(22).choice(lattice.nb_agents, lattice.nb_agents // 2, replace=False)
+    assert digest(lattice.neighbor_sums_of(values, agents)) == digest(lattice.neighbor_sums(values)[agents])
+
+
+def test_ensemble_of_lattices_equals_single_runs(tmp_path):
+    seeds = random_variates.spawn_seeds(20, 3)
+    together = results_of(PARAMETERS, str(tmp_path / 'together'), seeds, 3)
+    alone = np.concatenate([results_of(PARAMETERS, str(tmp_path / 'alone'), seed, 1) for seed in seeds])
+    assert digest(together) == digest(alone)
+
+
+def test_random_regular_is_the_default(tmp_path):
+    parameters = dict(PARAMETERS)
+    del parameters["topology"]
+    explicit = results_of(dict(parameters, topology='random_regular'), str(tmp_path / 'explicit'), 20, 2)
+    assert digest(results_of(parameters, str(tmp_path / 'default'), 20, 2)) == digest(explicit)
+    assert digest(results_of(PARAMETERS, str(tmp_path / 'lattice'), 20, 2)) != digest(explicit)
+
+
+@pytest.mark.parametrize('shape, message', [(dict(number_of_farmers=101), 'Choose a number_of_farmers'),
+                                            (dict(number_of_farmers=106), 'Choose a number_of_farmers'),
+                                            (dict(number_of_farmers=20, lattice_rows=2), 'Choose other lattice_rows')],
+                         ids=['prime', 'twice_prime', 'rows'])
+def test_too_narrow_lattice_is_refused(tmp_path, shape, message):
+    with pytest.raises(AssertionError, match=message):
+        results_of(dict(PARAMETERS, **shape), str(tmp_path / 'narrow'), 20, 1)
@@ -0,0 +1,43 @@
+"""
+The incremental updates of the neighborhoods and decisions only look at the farmers that changed, and must give the
+same means and the same runs as updating everything in every time step.
+"""
+import numpy as np
+import pytest
+
+import neighborhood
+import topology
+from conftest import BASE_PARAMETERS, all_results, digest, run_model
+
+PARAMETERS = dict(BASE_PARAMETERS, number_of_timesteps=40, number_of_farmers=36, retrospective_memory=-5)
+
+
+def run_digest(parameters, output_filename):
+    return digest(all_results(run_model(parameters, output_filename, 22, 3), 3))
+
+
+@pytest.mark.parametrize('network', [topology.NetworkTopology(topology.random_regular_neighbors(36, 4, 22)),
+                                     topology.LatticeTopology(6, 6)], ids=['network', 'lattice'])
+def test_incremental_means_equal_full_means(network):
+    """Changes a few farmers at a time, so that every update but the first is incremental."""
+    rng = np.random.default_rng(22)
+    seeds = rng.integers(0, 2, (1, 36)).astype(np.int8)
+    window_means = rng.normal(2, 1, (1, 36))
+    incremental = neighborhood.NeighborhoodMeans(network)
+    full = neighborhood.NeighborhoodMeans(network, full_update_share=0)
+    for _ in range(30):
+        means = incremental.update(seeds, window_means)
+        assert digest(means) == digest(full.update(seeds, window_means))
+        changed = rng.choice(36, 1, replace=False)
+        seeds[0, changed] = 1 - seeds[0, changed]
+        window_means[0, rng.choice(36, 1)] += rng.normal()
+
+
+@pytest.mark.parametrize('parameters', [PARAMETERS, dict(PARAMETERS, model_1_case='C'),
+                                        dict(PARAMETERS, var_return_NP=1),
+                                        dict(PARAMETERS, topology='lattice')],
+                         ids=['B', 'C', 'random_returns', 'lattice'])
+def test_incremental_run_equals_full_run(tmp_path, monkeypatch, parameters):
+    incremental = run_digest(parameters, str(tmp_path / 'incremental'))
+    monkeypatch.setattr(neighborhood.ChangeCheck, 'due', lambda self: False)
+    assert run_digest(parameters, str(tmp_path / 'full')) == incremental
@@ -0,0 +1,59 @@
+"""
+The quantiles of the analysis are estimated online by the P-square algorithm. They must be exact as long as all
+observations are kept, and close to np.percentile beyond that.
+"""
+import numpy as np
+import pytest
+
+import online_stats
+
+NB_ENTRIES = 500
+
+
+def estimate(draw, p, n, exact_size=100):
+    """Returns the observations and the estimate of the p quantile of NB_ENTRIES independent entries."""
+    observations = draw(np.random.default_rng(9), (n, NB_ENTRIES))
+    quantile = online_stats.P2Quantile(p, (NB_ENTRIES,), exact_size)
+    for x in observations:
+        quantile.add(x)
+    return observations, quantile.quantile()
+
+
+DISTRIBUTIONS = {'normal': lambda rng, size: rng.normal(size=size),
+                 'exponential': lambda rng, size: rng.exponential(size=size),
+                 'lognormal': lambda rng, size: rng.lognormal(size=size)}
+
+
+@pytest.mark.parametrize('n', [1, 2, 37, 99, 100])
+@pytest.mark.parametrize('p', [0.1, 0.9])
+def test_exact_while_observations_are_kept(p, n):
+    observations, quantile = estimate(DISTRIBUTIONS['normal'], p, n)
+    assert np.array_equal(quantile, np.percentile(observations, 100 * p, axis=0))
+
+
+@pytest.mark.parametrize('n', [150, 1000])
+@pytest.mark.parametrize('p', [0.1, 0.9])
+@pytest.mark.parametrize('distribution', sorted(DISTRIBUTIONS))
+def test_close_to_percentile_beyond(distribution, p, n):
+    """
+    The share of observations below the estimate is off by 0.01 on average and never by 0.1. In the long tails of
+    skewed distributions, this still amounts to a tenth of the interquartile range on average.
+    """
+    observations, quantile = estimate(DISTRIBUTIONS[distribution], p, n)
+    rank_errors = np.abs(np.mean(observations < quantile, axis=0) - p)
+    assert rank_errors.mean() <= 0.015
+    assert rank_errors.max() <= 0.1
+    interquartile_ranges = np.subtract(*np.percentile(observations, [75, 25], axis=0))
+    errors = np.abs(quantile - np.percentile(observations, 100 * p, axis=0))
+    assert np.mean(errors / interquartile_ranges) <= 0.15
+
+
+def test_selected_entries_are_updated_alone():
+    """Replicates of an ensemble run are added per time step, see OnlineStatistics.add()."""
+    observations = np.random.default_rng(9).normal(size=(150, 2, 3))
+    together, apart = online_stats.P2Quantile(0.1, (2, 3), 20), online_stats.P2Quantile(0.1, (2, 3), 20)
+    for x in observations:
+        together.add(x)
+        apart.add(x[0], 0)
+        apart.add(x[1], 1)
+    assert np.array_equal(together.quantile(), apart.quantile())
@@ -0,0 +1,32 @@
+"""
+The NP returns are drawn for all NP users at once. They must follow the truncated normal distribution of the farmer
+objects and be reproducible from the seed.
+"""
+import numpy as np
+import pytest
+import scipy.stats
+
+import random_variates
+from conftest import BASE_PARAMETERS, digest
+
+
+@pytest.mark.parametrize('mean, scale', [(2, 1), (2, 5), (0.5, 2)])
+def test_returns_follow_the_truncated_normal(mean, scale):
+    parameters = dict(BASE_PARAMETERS, mean_return_NP=mean, var_return_NP=scale)
+    returns = random_variates.RandomVariates(parameters, 2).returns_NP(20000)
+    distribution = scipy.stats.truncnorm(-mean, mean, loc=mean, scale=scale)
+    assert scipy.stats.kstest(returns, distribution.cdf).pvalue > 0.001
+    assert returns.min() >= mean - scale * mean
+
+
+def test_returns_are_reproducible_from_the_seed():
+    parameters = dict(BASE_PARAMETERS, var_return_NP=1)
+    draws = [random_variates.RandomVariates(parameters, np.random.SeedSequence(2)).returns_NP(50) for _ in range(2)]
+    assert digest(draws[0]) == digest(draws[1])
+    assert digest(random_variates.RandomVariates(parameters, 3).returns_NP(50)) != digest(draws[0])
+
+
+def test_fixed_returns_equal_the_mean():
+    rv = random_variates.RandomVariates(dict(BASE_PARAMETERS, var_return_NP=0), 2)
+    assert np.array_equal(rv.returns_NP(5), np.full(5, float(BASE_PARAMETERS["mean_return_NP"])))
+    assert rv.sum_of_returns_NP(5) == 5 * BASE_PARAMETERS["mean_return_NP"]
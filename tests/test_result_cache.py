@@ -0,0 +1,98 @@
+"""
+The result cache must only return an iteration for the same parameters, seed and model code. The topology cache is
+shared by the worker processes of a run, which read and write it at the same time.
+"""
+import concurrent.futures
+import os
+
+import numpy as np
+import pytest
+
+import random_variates
+import result_cache
+import topology
+from conftest import BASE_PARAMETERS
+
+NB_PROCESSES = 4
+
+
+def test_round_trip(tmp_path):
+    cache = result_cache.ResultCache(str(tmp_path))
+    results = np.random.default_rng(4).random((21, 5))
+    key = cache.key(BASE_PARAMETERS, 4)
+    assert cache.get(key) is None
+    cache.put(key, results, 7)
+    cached, convergence_step = cache.get(key)
+    assert np.array_equal(cached, results) and convergence_step == 7
+    cache.put(key, results)
+    assert cache.get(key)[1] is None
+
+
+def test_key_changes_with_the_inputs(tmp_path, monkeypatch):
+    cache = result_cache.ResultCache(str(tmp_path))
+    seeds = random_variates.spawn_seeds(4, 2)
+    key = cache.key(BASE_PARAMETERS, seeds[0])
+    assert cache.key(dict(reversed(list(BASE_PARAMETERS.items()))), random_variates.spawn_seeds(4, 1)[0]) == key
+    assert cache.key(dict(BASE_PARAMETERS, p_P=0.6), seeds[0]) != key
+    assert cache.key(BASE_PARAMETERS, seeds[1]) != key
+    assert cache.key(BASE_PARAMETERS, random_variates.spawn_seeds(5, 1)[0]) != key
+    monkeypatch.setattr(result_cache, 'SIMULATION_MODULES', result_cache.SIMULATION_MODULES[:-1])
+    assert result_cache.ResultCache(str(tmp_path)).key(BASE_PARAMETERS, seeds[0]) != key
+
+
+def test_eviction_is_left_to_the_owner(tmp_path):
+    """Storing an iteration does not scan the cache, evict() removes the least recently used iterations."""
+    cache = result_cache.ResultCache(str(tmp_path), budget=0)
+    for i in range(3):
+        cache.put(str(i), np.zeros((21, 5)))
+        os.utime(str(tmp_path / '{}.npz'.format(i)), (i, i))
+    assert cache.get('0') is not None
+    assert len([name for name in os.listdir(str(tmp_path)) if name.endswith('.npz')]) == 3
+    size = os.path.getsize(str(tmp_path / '0.npz'))
+    result_cache.ResultCache(str(tmp_path), budget=size / 2 ** 20).evict()
+    assert sorted(name for name in os.listdir(str(tmp_path)) if name.endswith('.npz')) == ['0.npz']
+
+
+def test_failed_save_keeps_the_previous_file(tmp_path):
+    path = str(tmp_path / 'entry.npy')
+    result_cache.save_atomically(path, lambda f: np.save(f, np.arange(3)))
+
+    def fail(f):
+        f.write(b'partly written')
+        raise IOError()
+    with pytest.raises(IOError):
+        result_cache.save_atomically(path, fail)
+    assert np.array_equal(np.load(path), np.arange(3))
+    assert os.listdir(str(tmp_path)) == ['entry.npy']
+
+
+def evict_repeatedly(directory, rounds):
+    for _ in range(rounds):
+        result_cache.evict_least_recently_used(directory, '.npy', 0)
+    return True
+
+
+def get_networks(directory, seeds):
+    cache = result_cache.TopologyCache(directory, budget=0)
+    for seed in seeds:
+        neighbors = cache.get(60, 4, seed, topology.random_regular_neighbors)
+        assert np.array_equal(neighbors, topology.random_regular_neighbors(60, 4, seed))
+        cache.evict()
+    return True
+
+
+def test_concurrent_eviction(tmp_path):
+    for i in range(500):
+        np.save(str(tmp_path / 'network_{}.npy'.format(i)), np.zeros(16))
+    with concurrent.futures.ProcessPoolExecutor(NB_PROCESSES) as executor:
+        futures = [executor.submit(evict_repeatedly, str(tmp_path), 20) for _ in range(NB_PROCESSES)]
+        assert all(future.result() for future in futures)
+    assert not any(name.endswith('.npy') for name in os.listdir(str(tmp_path)))
+
+
+def test_concurrent_writes_of_the_same_network(tmp_path):
+    with concurrent.futures.ProcessPoolExecutor(NB_PROCESSES) as executor:
+        futures = [executor.submit(get_networks, str(tmp_path), [seed % 3 for seed in range(30)])
+                   for _ in range(NB_PROCESSES)]
+        assert all(future.result() for future in futures)
+    assert not any('.tmp' in name for name in os.listdir(str(tmp_path)))
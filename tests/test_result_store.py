@@ -0,0 +1,79 @@
+"""
+The results of all iterations of a specification are appended to one table. They must be read back as written,
+iterations stored again must replace the earlier ones, and data files of the old layout must still be readable.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+import model
+import result_store
+from conftest import digest
+
+NB_TIMESTEPS = 6
+
+
+def random_results(seed):
+    return np.random.default_rng(seed).uniform(size=(NB_TIMESTEPS + 1, len(model.RESULT_VARIABLES)))
+
+
+def stored_array(output_filename):
+    with result_store.ResultStore(output_filename, mode='r') as store:
+        return store.read_array(list(model.RESULT_VARIABLES))
+
+
+def test_round_trip(tmp_path):
+    output_filename = str(tmp_path / 'spec')
+    results = {ident: random_results(ident) for ident in (3, 1, 2)}
+    with result_store.ResultStore(output_filename, batch_size=2) as store:
+        for ident, array in results.items():
+            convergence_step = ident if ident > 1 else None
+            store.append(ident, model.results_frame(array), master_seed=8, convergence_step=convergence_step)
+
+    expected = np.stack([results[ident] for ident in (1, 2, 3)]).transpose(2, 0, 1)
+    assert digest(stored_array(output_filename)) == digest(expected)
+    with result_store.ResultStore(output_filename, mode='r') as store:
+        assert store.replicates() == [1, 2, 3]
+        assert store.variables() == list(model.RESULT_VARIABLES)
+        assert store.replicate_seeds() == {1: 8, 2: 8, 3: 8}
+        assert store.convergence_steps() == {1: None, 2: 2, 3: 3}
+        assert np.array_equal(store.read_replicate(2).values, results[2])
+        assert np.array_equal(store.read_variable('Share_P').values, expected[5].T)
+
+
+def test_appending_again_replaces_the_iteration(tmp_path):
+    output_filename = str(tmp_path / 'spec')
+    with result_store.ResultStore(output_filename) as store:
+        for ident in (1, 2):
+            store.append(ident, model.results_frame(random_results(ident)), master_seed=8)
+    with result_store.ResultStore(output_filename) as store:
+        store.append(2, model.results_frame(random_results(20)), master_seed=9, convergence_step=4)
+        store.append(3, model.results_frame(random_results(3)))
+
+    expected = np.stack([random_results(1), random_results(20), random_results(3)]).transpose(2, 0, 1)
+    assert digest(stored_array(output_filename)) == digest(expected)
+    with result_store.ResultStore(output_filename, mode='r') as store:
+        assert store.replicate_seeds() == {1: 8, 2: 9, 3: None}
+        assert store.convergence_steps() == {1: None, 2: 4, 3: None}
+        assert len(store.read_replicate(2)) == NB_TIMESTEPS + 1
+
+
+def test_old_layout_is_read(tmp_path):
+    output_filename = str(tmp_path / 'spec')
+    with pd.HDFStore(output_filename + '_data.h5') as store:
+        for ident in (1, 2, 10):
+            store['data_' + format(ident, '03d')] = model.results_frame(random_results(ident))
+        store.get_storer('data_002').attrs.master_seed = 8
+
+    expected = np.stack([random_results(ident) for ident in (1, 2, 10)]).transpose(2, 0, 1)
+    assert digest(stored_array(output_filename)) == digest(expected)
+    with result_store.ResultStore(output_filename, mode='r') as store:
+        assert store.legacy
+        assert store.replicates() == [1, 2, 10]
+        assert store.replicate_seeds() == {1: None, 2: 8, 10: None}
+        assert store.convergence_steps() == {1: None, 2: None, 10: None}
+        assert np.array_equal(store.read_replicate(10).values, random_results(10))
+        assert np.array_equal(store.read_variable('Share_P').values, expected[5].T)
+    with result_store.ResultStore(output_filename) as store:
+        with pytest.raises(AssertionError):
+            store.append(3, model.results_frame(random_results(3)))
@@ -0,0 +1,63 @@
+"""
+With a tolerance, iterations are added in batches until the confidence intervals at the final time step are narrow
+enough. The iterations and thus the stored data must not depend on how they are run, and the rule must stop at the
+first batch after which the intervals, computed as by scipy, are within the tolerance.
+"""
+import numpy as np
+import pytest
+import scipy.stats
+
+import main
+import model
+import online_stats
+import result_store
+from conftest import BASE_PARAMETERS, digest
+
+PARAMETERS = dict(BASE_PARAMETERS, number_of_timesteps=10, model='model_0', model_1_case='A', var_return_NP=3)
+BATCH_SIZE = 4
+MAX_ITERATIONS = 24
+
+
+def run(output_filename, tolerance, **options):
+    """Returns the number of iterations, the stored results and the stored statistics of Share_P."""
+    stopping = online_stats.SequentialStopping({'Share_P': tolerance}, BATCH_SIZE, MAX_ITERATIONS)
+    _, nb_iterations = main.run_replicates(PARAMETERS, output_filename, BATCH_SIZE, 25, stopping=stopping,
+                                           **options)
+    with result_store.ResultStore(output_filename, mode='r') as store:
+        statistics, nb_stored = store.read_statistics()
+        assert nb_stored == nb_iterations == len(store.replicates())
+        return nb_iterations, store.read_array(), statistics['Share_P']
+
+
+def half_width(shares, confidence=online_stats.DEFAULT_CONFIDENCE):
+    low, high = scipy.stats.t.interval(confidence, len(shares) - 1, loc=np.mean(shares), scale=scipy.stats.sem(shares))
+    return (high - low) / 2
+
+
+def test_workers_and_ensemble_store_the_same_iterations(tmp_path):
+    nb_iterations, data, statistics = run(str(tmp_path / 'sequential'), 0.06)
+    assert BATCH_SIZE < nb_iterations < MAX_ITERATIONS
+    for name, options in (('workers', dict(workers=2)), ('ensemble', dict(ensemble=True))):
+        other_nb_iterations, other_data, other_statistics = run(str(tmp_path / name), 0.06, **options)
+        assert other_nb_iterations == nb_iterations
+        assert digest(other_data) == digest(data)
+        assert np.allclose(other_statistics.values, statistics.values, equal_nan=True)
+
+
+@pytest.mark.parametrize('tolerance', [1.0, 0.06, 0.001])
+def test_stops_at_the_first_precise_batch(tmp_path, tolerance):
+    nb_iterations, data, _ = run(str(tmp_path / 'run'), tolerance)
+    assert nb_iterations % BATCH_SIZE == 0
+    shares = data[model.RESULT_VARIABLES.index('Share_P'), :, -1]
+    widths = [half_width(shares[:n]) for n in range(BATCH_SIZE, nb_iterations + 1, BATCH_SIZE)]
+    assert all(width > tolerance for width in widths[:-1])
+    assert widths[-1] <= tolerance or nb_iterations == MAX_ITERATIONS
+
+
+def test_half_widths_equal_the_t_interval():
+    shares = np.random.default_rng(25).uniform(size=(9, 1))
+    statistics = online_stats.OnlineStatistics(['Share_P'], 1)
+    for share in shares:
+        statistics.add(0, share[np.newaxis])
+    assert np.isclose(statistics.confidence_half_widths()[0], half_width(shares[:, 0]))
+    assert np.isclose(statistics.confidence_half_widths(confidence=0.99)[0], half_width(shares[:, 0], 0.99))
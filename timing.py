@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Opt-in timing of the phases of a model run. Is used from model.py, the timings are stored in the result store next to
+the results.
+
+A PhaseTimer accumulates the wall time and the number of calls per phase and time step. The phases are methods of the
+model and the population engine, which the timer replaces on the instances by timed wrappers. Without profiling,
+nothing is replaced, so that the instrumentation costs nothing.
+
+Usage: python timing.py output/m1_k10_A [more output files] prints the timings summed over all stored iterations.
+"""
+import collections
+import functools
+import sys
+import time
+
+__author__ = "Claudius Graebner"
+__email__ = "graebnerc@uni-bremen.de"
+
+SETUP_STEP = -1
+
+
+class PhaseTimer:
+    """
+    Accumulates the wall time and the number of calls of every phase in every time step.
+    Phases outside of the time steps, e.g. the setup and saving of the results, are counted in step -1.
+    """
+    def __init__(self):
+        self.__step = SETUP_STEP
+        self.__timings = collections.OrderedDict()
+
+    def step(self, i):
+        """Sets the current time step."""
+        self.__step = i
+
+    def add(self, phase, seconds, calls=1):
+        """Adds wall time and calls to a phase of the current time step."""
+        entry = self.__timings.setdefault((self.__step, phase), [0.0, 0])
+        entry[0] += seconds
+        entry[1] += calls
+
+    def instrument(self, instance, phases):
+        """
+        Times methods of an instance from now on.
+
+        Parameters
+        ----------
+        instance : object
+            The instance whose methods are timed.
+
+        phases : dict
+            The names of the methods and the phases they are counted as.
+        """
+        for method, phase in phases.items():
+            setattr(instance, method, self.__timed(getattr(instance, method), phase))
+
+    def __timed(self, function, phase):
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.add(phase, time.perf_counter() - start)
+        return timed
+
+    def records(self):
+        """Returns the timings as list of (step, phase, seconds, calls)."""
+        return [(step, phase, seconds, calls) for (step, phase), (seconds, calls) in self.__timings.items()]
+
+    def frame(self):
+        """Returns the timings as pd.DataFrame with the columns step, phase, seconds and calls."""
+        return timings_frame(self.records())
+
+
+def timings_frame(records):
+    """Returns timing records (step, phase, seconds, calls) as pd.DataFrame."""
+    import pandas as pd
+    return pd.DataFrame.from_records(records, columns=['step', 'phase', 'seconds', 'calls'])
+
+
+def summarize(timings, by=('phase',)):
+    """
+    Aggregates timings over iterations and specifications.
+
+    Parameters
+    ----------
+    timings : pd.DataFrame
+        Timings as returned by ResultStore.read_timings() or read_timings(), possibly of several specifications.
+
+    by : tuple of str
+        The columns to group by, e.g. ('specification', 'phase') or ('phase', 'step').
+
+    Returns
+    -------
+    pd.DataFrame with the total seconds and calls, the seconds per call and the share of the total time per group.
+    """
+    summary = timings.groupby(list(by), sort=False)[['seconds', 'calls']].sum()
+    summary['seconds_per_call'] = summary['seconds'] / summary['calls']
+    summary['share'] = summary['seconds'] / summary['seconds'].sum()
+    return summary.sort_values('seconds', ascending=False)
+
+
+def read_timings(output_filenames):
+    """
+    Returns the timings stored for several specifications as one pd.DataFrame with the additional column
+    specification.
+    """
+    import pandas as pd
+    import result_store
+    frames = []
+    for output_filename in output_filenames:
+        with result_store.ResultStore(output_filename, mode='r') as store:
+            frame = store.read_timings()
+        frame.insert(0, 'specification', output_filename)
+        frames.append(frame)
+    return pd.concat(frames, ignore_index=True)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('Arguments missing! Usage: python timing.py [path to outputfile] [more paths]')
+        exit(1)
+    print(summarize(read_timings(sys.argv[1:])).to_string())
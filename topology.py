@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+The topologies on which the farmers are located. They provide the aggregation over the neighborhoods that is needed
+for the decisions in the cases B and C. Is used from population_generator.py and engine.py.
+"""
+import numpy as np
+
+__author__ = "Claudius Graebner"
+__email__ = "graebnerc@uni-bremen.de"
+
+MAX_REPAIR_ATTEMPTS = 100
+
+
+def random_regular_neighbors(nb_agents, degree, seed=None):
+    """
+    Returns a random simple graph in which every agent has exactly degree neighbors, as array of int32 with shape
+    (nb_agents, degree) whose row i contains the neighbors of agent i.
+
+    The graph is drawn with the configuration model: degree stubs per agent are shuffled and paired. The few
+    self-loops and multiple edges this produces, independently of nb_agents on average, are removed by swapping
+    the ends of each of them with a randomly chosen other edge. So the costs are those of one permutation of all
+    stubs.
+
+    Parameters
+    ----------
+    nb_agents : int
+        The number of agents.
+
+    degree : int
+        The number of neighbors of every agent. nb_agents * degree must be even and degree smaller than nb_agents.
+
+    seed : int, numpy.random.SeedSequence or None
+        The seed of the graph. If None, fresh entropy is used.
+    """
+    assert (nb_agents * degree) % 2 == 0, "nb_agents * degree must be even but is {}.".format(nb_agents * degree)
+    assert 0 <= degree < nb_agents, "Degree must be smaller than {} but is {}.".format(nb_agents, degree)
+    rng = np.random.default_rng(seed)
+    while True:
+        edges = rng.permutation(np.repeat(np.arange(nb_agents, dtype=np.int32), degree)).reshape(-1, 2)
+        neighbors = neighbors_of_edges(edges, nb_agents, degree)
+        if repair_edges(edges, neighbors, rng):
+            return neighbors
+
+
+def neighbors_of_edges(edges, nb_agents, degree):
+    """
+    Returns the neighbors of all agents as array with shape (nb_agents, degree), given the undirected edges of a graph
+    in which every agent has degree edge ends.
+    """
+    sources = np.concatenate((edges[:, 0], edges[:, 1]))
+    targets = np.concatenate((edges[:, 1], edges[:, 0]))
+    return targets[np.argsort(sources, kind='stable')].reshape(nb_agents, degree)
+
+
+def repair_edges(edges, neighbors, rng):
+    """
+    Removes all self-loops and multiple edges by double-edge swaps, in place of edges and neighbors. Returns False if
+    this failed, which only happens for very small or very dense graphs.
+    """
+    nb_agents = len(neighbors)
+    keys = np.minimum(edges[:, 0], edges[:, 1]).astype(np.int64) * nb_agents + np.maximum(edges[:, 0], edges[:, 1])
+    order = np.argsort(keys, kind='stable')
+    duplicates = order[1:][keys[order[1:]] == keys[order[:-1]]]
+    bad_edges = np.union1d(np.flatnonzero(edges[:, 0] == edges[:, 1]), duplicates)
+    for e in bad_edges:
+        for _ in range(MAX_REPAIR_ATTEMPTS):
+            u, v = edges[e]
+            f = rng.integers(len(edges))
+            x, y = edges[f] if rng.random() < 0.5 else edges[f][::-1]
+            """Replace the edges (u, v) and (x, y) by (u, x) and (v, y) if both are new and no self-loops."""
+            if f == e or u == x or v == y or {u, x} == {v, y}:
+                continue
+            if x in neighbors[u] or y in neighbors[v]:
+                continue
+            for agent, old, new in ((u, v, x), (v, u, y), (x, y, u), (y, x, v)):
+                row = neighbors[agent]
+                row[np.flatnonzero(row == old)[0]] = new
+            edges[e] = u, x
+            edges[f] = v, y
+            break
+        else:
+            return False
+    return True
+
+
+class NetworkTopology:
+    """
+    A network of farmers stored as a sparse adjacency matrix in CSR format.
+
+    Row i of the matrix has a one in every column j for which farmer j is a neighbor of farmer i, so that the sum of
+    any quantity over all neighborhoods is a single sparse matrix-vector product. As every farmer has the same number
+    of neighbors, the column indices of the matrix are also the table of the neighbors with one row per farmer.
+    """
+    def __init__(self, neighbors):
+        """
+        Parameters
+        ----------
+        neighbors : array of int with shape (number_of_farmers, degree)
+            Row i contains the indices of the neighbors of farmer i.
+        """
+        neighbors = np.asarray(neighbors)
+        assert neighbors.ndim == 2, "Neighbors should be given as 2-D array but have {} dims.".format(neighbors.ndim)
+        nb_agents, degree = neighbors.shape
+        indptr = np.arange(0, nb_agents * degree + 1, degree, dtype=np.int64)
+        indices = neighbors.ravel().astype(np.int32)
+        data = np.ones(len(indices))
+        """scipy is only loaded for networks, as it takes a while to import and lattices do without it."""
+        from scipy import sparse
+        self.__adjacency = sparse.csr_matrix((data, indices, indptr), shape=(nb_agents, nb_agents))
+        self.__nb_agents = nb_agents
+
+    @classmethod
+    def combine(cls, networks):
+        """
+        Returns one network that contains the given networks as disconnected components. Farmer i of the r-th network
+        gets the index r * number_of_farmers + i.
+        """
+        from scipy import sparse
+        combined = cls.__new__(cls)
+        combined.__adjacency = sparse.block_diag([n.adjacency for n in networks], format='csr')
+        combined.__nb_agents = combined.__adjacency.shape[0]
+        return combined
+
+    def neighbor_sums(self, values):
+        """
+        Returns for every farmer the sum of the values of its neighbors.
+        """
+        return self.__adjacency @ values
+
+    def neighbor_sums_of(self, values, agents):
+        """
+        Returns the sums of the values of the neighbors of the given farmers only. The values are added up one
+        neighbor after the other like in the matrix-vector product, so that the sums are bit for bit the same as
+        neighbor_sums(values)[agents].
+        """
+        sums = np.zeros(len(agents))
+        for column in np.asarray(values)[self.neighbor_table()[agents]].T:
+            sums += column
+        return sums
+
+    def neighbors_of(self, i):
+        """
+        Returns the indices of the neighbors of farmer i.
+        """
+        return self.__adjacency.indices[self.__adjacency.indptr[i]:self.__adjacency.indptr[i + 1]]
+
+    def neighbors_of_agents(self, agents):
+        """
+        Returns the indices of the neighbors of all given farmers as one array, with repetitions.
+        """
+        return self.neighbor_table()[agents].ravel()
+
+    def neighbor_table(self):
+        """
+        Returns the indices of the neighbors as array with shape (number_of_farmers, degree).
+        """
+        return self.__adjacency.indices.reshape(self.__nb_agents, -1)
+
+    @property
+    def adjacency(self):
+        return self.__adjacency
+
+    @property
+    def nb_agents(self):
+        return self.__nb_agents
+
+
+class LatticeTopology:
+    """
+    A periodic two-dimensional lattice, i.e. a torus, on which every farmer has the von Neumann neighborhood of the
+    four adjacent cells. Farmer i of replicate r sits in row (i // cols) and column (i % cols) of the lattice of r.
+
+    No adjacency is stored: the sums over all neighborhoods are four shifted additions on the grid, so the memory and
+    the costs are those of the values themselves.
+    """
+    def __init__(self, rows, cols, nb_replicates=1):
+        """
+        Parameters
+        ----------
+        rows, cols : int
+            The shape of the lattice, at least 3 x 3 so that the four neighbors are distinct.
+
+        nb_replicates : int
+            The number of replicates, each with its own lattice of the same shape.
+        """
+        assert rows >= 3 and cols >= 3, "Lattice should have at least 3 x 3 cells but has {} x {}.".format(rows, cols)
+        self.__shape = (nb_replicates, rows, cols)
+        self.__nb_agents = nb_replicates * rows * cols
+
+    @classmethod
+    def combine(cls, networks):
+        """
+        Returns one lattice topology for the replicates of the given ones, which must all have the same shape.
+        """
+        shapes = {n.shape[1:] for n in networks}
+        assert len(shapes) == 1, "Lattices should have the same shape but have {}.".format(shapes)
+        rows, cols = shapes.pop()
+        return cls(rows, cols, sum(n.shape[0] for n in networks))
+
+    def neighbor_sums(self, values):
+        """
+        Returns for every farmer the sum of the values of its four neighbors.
+        """
+        grid = np.asarray(values, dtype=float).reshape(self.__shape)
+        sums = np.empty_like(grid)
+        """Up and down, with the first and the last row being adjacent."""
+        np.add(grid[:, :-2], grid[:, 2:], out=sums[:, 1:-1])
+        np.add(grid[:, -1], grid[:, 1], out=sums[:, 0])
+        np.add(grid[:, -2], grid[:, 0], out=sums[:, -1])
+        """Left and right, with the first and the last column being adjacent."""
+        sums[:, :, 1:-1] += grid[:, :, :-2]
+        sums[:, :, 1:-1] += grid[:, :, 2:]
+        sums[:, :, 0] += grid[:, :, -1] + grid[:, :, 1]
+        sums[:, :, -1] += grid[:, :, -2] + grid[:, :, 0]
+        return sums.ravel()
+
+    def neighbor_sums_of(self, values, agents):
+        """
+        Returns the sums of the values of the neighbors of the given farmers only. The additions are done in the same
+        order as in neighbor_sums(), so that the sums are bit for bit the same as neighbor_sums(values)[agents].
+        """
+        values = np.asarray(values, dtype=float)
+        up, down, left, right = values[self.neighbors_of(np.asarray(agents))]
+        sums = up + down
+        border = np.isin(np.asarray(agents) % self.__shape[2], (0, self.__shape[2] - 1))
+        return np.where(border, sums + (left + right), sums + left + right)
+
+    def neighbors_of_agents(self, agents):
+        """
+        Returns the indices of the neighbors of all given farmers as one array, with repetitions.
+        """
+        return self.neighbors_of(np.asarray(agents)).ravel()
+
+    def neighbors_of(self, i):
+        """
+        Returns the indices of the neighbors of farmer i: the ones above, below, left and right of it. If i is an
+        array of farmers, the result has one column per farmer.
+        """
+        _, rows, cols = self.__shape
+        replicate, cell = divmod(i, rows * cols)
+        row, col = divmod(cell, cols)
+        offset = replicate * rows * cols
+        return np.array([offset + ((row - 1) % rows) * cols + col, offset + ((row + 1) % rows) * cols + col,
+                         offset + row * cols + (col - 1) % cols, offset + row * cols + (col + 1) % cols])
+
+    @staticmethod
+    def square_shape(nb_agents):
+        """
+        Returns the shape (rows, cols) of the lattice closest to a square with nb_agents cells.
+        """
+        rows = int(np.sqrt(nb_agents))
+        while nb_agents % rows:
+            rows -= 1
+        return rows, nb_agents // rows
+
+    @property
+    def shape(self):
+        """The shape (replicates, rows, cols) of the lattices."""
+        return self.__shape
+
+    @property
+    def nb_agents(self):
+        return self.__nb_agents